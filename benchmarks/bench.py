@@ -0,0 +1,194 @@
+"""
+Fleet-scale benchmarks for dlc, run against the stand-ins in benchmarks/fakes/
+instead of the real ceph-util modules, smartctl and ceph CLI:
+
+    python benchmarks/bench.py --hosts 50 --osds-per-host 60 --cases 60 --list-rows 100000
+    python benchmarks/bench.py --latency osdmap=0.5 --latency health=0.2 --compare benchmarks/results/<earlier>.json
+
+Each run writes its timings to benchmarks/results/ (or --output). --compare exits
+non-zero if any benchmark got slower than --threshold times the earlier run.
+"""
+import argparse, contextlib, io, json, os, platform, subprocess, sys, tempfile, time
+from datetime import datetime
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+FAKES = HERE / "fakes"
+REPO = HERE.parent
+sys.path[:0] = [str(FAKES), str(REPO / "dlc")]
+os.environ["PATH"] = str(FAKES / "bin") + os.pathsep + os.environ.get("PATH", "")
+
+import fake_cluster
+
+RESULTS = {}
+
+
+@contextlib.contextmanager
+def timed(name: str, n: int):
+    #dlc prints progress for every case, keep it out of the report
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    seconds = time.perf_counter() - start
+    RESULTS[name] = {"n": n, "seconds": seconds, "per_op": seconds / n if n else None}
+    print(f"{name:<32} n={n:<8} {seconds:10.4f}s  {1000 * seconds / max(n, 1):10.3f} ms/op")
+
+
+def setup(workdir: Path):
+    import drain, host_cache, models, smart, snapshot, storage
+
+    storage._DB_PATH = workdir / "dlc.sqlite"
+    snapshot._CACHE_PATH = workdir / "osdmap.pickle"
+    host_cache._CACHE_PATH = workdir / "host.json"
+    models.CEPH_CLUSTER_FILE = str(workdir / "ceph_cluster")
+    (workdir / "ceph_cluster").write_text("benchcluster\n")
+    smart.SMARTCTL = str(FAKES / "smartctl")
+    #Every case drains at once, the benchmark measures dlc and not the drain throttle
+    drain.BUDGET_PATH = workdir / "drain.json"
+    drain.BUDGET_PATH.write_text('{"max_osds": 1000000, "max_per_host": 1000000, "max_domains": null}')
+
+
+def bench_cases(ns):
+    import intake, miscellaneous, storage
+    from models import DlcCase, State
+    from sweep import sweep
+    from snapshot import ClusterSnapshot
+
+    local = [i for i in range(min(ns.cases, ns.osds_per_host))]
+
+    #One `dlc new` per case: every save builds or loads its own snapshot
+    with timed("create_case", len(local)):
+        cases = [DlcCase(osd_id = osd_id, state = State.NEW).save() for osd_id in local]
+
+    #`dlc import` of the same number of OSDs on another host
+    remote = [{"osd_id": ns.osds_per_host + i} for i in range(len(local))]
+    with timed("import_cases", len(remote)):
+        intake.import_cases(enumerate(remote, start=1))
+
+    #One `dlc update` per case and state, with cached snapshots but no sharing between cases
+    for state in (State.NEW, State.NEW_DETAIL, State.RECOVERY_WAIT):
+        with timed(f"progress[{state.value}]", len(cases)):
+            for case in cases:
+                case.progress()
+
+    #Fresh cases for a sweep, which shares one snapshot between all of them
+    with storage.db_cursor() as cur:
+        cur.execute(f"UPDATE {storage.TABLE_NAME} SET active = 0")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for osd_id in local:
+            DlcCase(osd_id = osd_id, state = State.NEW).save()
+    with timed("sweep", len(local)):
+        sweep(ClusterSnapshot.load())
+
+    case_id = cases[0].case_id
+    with timed("history_write", ns.history_writes):
+        for _ in range(ns.history_writes):
+            miscellaneous.save_case_history(case_id)
+            with storage.db_cursor() as cur:
+                cur.execute(f"UPDATE {storage.TABLE_NAME} SET version = version + 1, updated_at = ? WHERE case_id = ?", (time.time(), case_id))
+
+
+def bench_list(ns):
+    import storage, records, tabular
+
+    rows = [(fake_cluster.hostname(i % ns.hosts), "RESOLVED", fake_cluster.dev_name(i % 26), i, "benchcluster", 0, time.time())
+            for i in range(ns.list_rows)]
+    with storage.db_transaction() as cur:
+        cur.executemany(
+            f"INSERT INTO {storage.TABLE_NAME} (hostname, state, block_dev, osd_id, cluster, active, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    with timed("list[records]", ns.list_rows):
+        n = sum(1 for _ in records.iter_records())
+
+    with timed("list[formatted]", ns.list_rows):
+        schema = [{'name': h, 'value': lambda x, attr=h: getattr(x, attr)} for h in records.CaseRecord._fields]
+        tabular.format_tabular(schema, list(records.iter_records()))
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "-C", str(REPO), "rev-parse", "--short", "HEAD"],
+                stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, threshold: float) -> bool:
+    ok = True
+    for name, result in RESULTS.items():
+        before = previous.get("results", {}).get(name)
+        if not before or not before.get("per_op") or not result["per_op"]:
+            continue
+        ratio = result["per_op"] / before["per_op"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name:<32} {ratio:6.2f}x{flag}")
+    return ok
+
+
+def _parser():
+    p = argparse.ArgumentParser(prog="bench.py")
+    p.add_argument("--hosts", type=int, default=50)
+    p.add_argument("--osds-per-host", type=int, default=60)
+    p.add_argument("--cases", type=int, default=60, help="cases created and progressed (at most --osds-per-host)")
+    p.add_argument("--list-rows", type=int, default=100000)
+    p.add_argument("--history-writes", type=int, default=1000)
+    p.add_argument("--latency", action="append", default=[], metavar="CALL=SECONDS",
+            help=f"delay for a fake call, one of {', '.join(fake_cluster.CONFIG['latency'])}")
+    p.add_argument("--smartctl-delay", type=float, default=0.0)
+    p.add_argument("--output", type=Path)
+    p.add_argument("--compare", type=Path, help="earlier result file to compare against")
+    p.add_argument("--threshold", type=float, default=1.25)
+    return p
+
+
+def main(argv=None):
+    ns = _parser().parse_args(argv)
+    latency = {}
+    for item in ns.latency:
+        call, _, seconds = item.partition("=")
+        latency[call] = float(seconds)
+    fake_cluster.configure(hosts = ns.hosts, osds_per_host = ns.osds_per_host, latency = latency)
+    os.environ["FAKE_SMARTCTL_DELAY"] = str(ns.smartctl_delay) if ns.smartctl_delay else ""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        setup(workdir)
+        bench_cases(ns)
+
+        import storage
+        storage.close_conn()
+        storage._DB_PATH = workdir / "list.sqlite"
+        bench_list(ns)
+        storage.close_conn()
+
+    import metrics
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "config": fake_cluster.CONFIG,
+            "args": {k: str(v) for k, v in vars(ns).items()},
+            "fake_calls": fake_cluster.CALLS,
+        },
+        "results": RESULTS,
+        #dlc's own spans and counters for the whole run, to see where a slower benchmark spent its time
+        "metrics": metrics.snapshot(),
+    }
+    output = ns.output or HERE / "results" / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+    if ns.compare:
+        if not compare(json.loads(ns.compare.read_text()), ns.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""Stand-in for ceph-util's ceph_admin."""
+import fake_cluster
+
+
+def osd_remove(osd, args):
+    fake_cluster.simulate("osd_remove")
@@ -0,0 +1,32 @@
+"""Stand-in for ceph-util's ceph_common: an OSD map of CONFIG["hosts"] x CONFIG["osds_per_host"] OSDs."""
+import fake_cluster
+
+
+class CephOsd:
+    def __init__(self, osd_id, hostname, dev_name, crush_weight, lv_name):
+        self.osd_id = osd_id
+        self.hostname = hostname
+        self.dev_name = dev_name
+        self.crush_weight = crush_weight
+        self.lv_name = lv_name
+
+
+class CephOsdMap:
+    def __init__(self, hw):
+        fake_cluster.simulate("osdmap")
+        cfg = fake_cluster.CONFIG
+        self.osd_map = {}
+        for h in range(cfg["hosts"]):
+            hostname = fake_cluster.hostname(h)
+            for d in range(cfg["osds_per_host"]):
+                osd_id = h * cfg["osds_per_host"] + d
+                self.osd_map[osd_id] = CephOsd(osd_id, hostname, fake_cluster.dev_name(d), 7.3, f"ceph-osd-block-{osd_id}")
+        self.osd_map_local = {k: v for k, v in self.osd_map.items() if v.hostname == hw.hostname}
+
+
+class CephState:
+    def __init__(self):
+        fake_cluster.simulate("health")
+
+    def is_clean(self):
+        return fake_cluster.CONFIG["clean"]
@@ -0,0 +1,51 @@
+"""
+Shared configuration for the ceph-util stand-ins in this directory.
+bench.py calls configure() before anything imports dlc.
+"""
+import time
+
+CONFIG = {
+    "hosts": 50,
+    "osds_per_host": 60,
+    "local_host": "host000",
+    "host_serial": "SERIAL000",
+    "epoch": 1000,
+    "clean": True,
+    #seconds spent in each fake call, to model a slow cluster
+    "latency": {
+        "osdmap": 0.0,
+        "health": 0.0,
+        "hwinv": 0.0,
+        "dmidecode": 0.0,
+        "osd_remove": 0.0,
+    },
+}
+
+CALLS = {}
+
+
+def configure(**kwargs):
+    latency = kwargs.pop("latency", {})
+    CONFIG.update(kwargs)
+    CONFIG["latency"].update(latency)
+
+
+def hostname(i: int) -> str:
+    return f"host{i:03d}"
+
+
+def dev_name(i: int) -> str:
+    #sda..sdz, sdaa..
+    letters = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        letters = chr(ord("a") + r) + letters
+    return "sd" + letters
+
+
+def simulate(call: str):
+    CALLS[call] = CALLS.get(call, 0) + 1
+    delay = CONFIG["latency"].get(call, 0.0)
+    if delay:
+        time.sleep(delay)
@@ -0,0 +1,17 @@
+"""Stand-in for ceph-util's hwinv."""
+import fake_cluster
+
+
+class _Dmidecode:
+    def __init__(self, serial):
+        self.sysinfo = {"system": {"serial": serial}}
+
+
+class HWInv:
+    def __init__(self):
+        fake_cluster.simulate("hwinv")
+        self.hostname = fake_cluster.CONFIG["local_host"]
+
+    def dmidecode(self):
+        fake_cluster.simulate("dmidecode")
+        return _Dmidecode(fake_cluster.CONFIG["host_serial"])
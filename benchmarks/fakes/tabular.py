@@ -0,0 +1,7 @@
+"""Stand-in for ceph-util's tabular."""
+
+
+def format_tabular(schema, rows, align = 'right', indent = 0):
+    print("\t".join(col['name'] for col in schema))
+    for row in rows:
+        print("\t".join(str(col['value'](row)) for col in schema))
@@ -0,0 +1,227 @@
+"""
+Retention for resolved cases (`dlc archive`):
+* RESOLVED cases (DlcCase.save closes them, active = 0) that have been resolved for
+  at least `min_age` move, together with their history, out of the hot tables into one
+  archive database per month (archive/cases-YYYY-MM.sqlite next to the main database,
+  by the month the case was resolved).
+* ARCHIVE_INDEX_TABLE in the main database says which file holds an archived case, so
+  records.load_record / iter_history / record_as_of and DlcCase.load(case_id, version)
+  still find it.
+* Runs in batches. A batch is first written and committed to its archive files,
+  then removed from the hot tables in one short transaction. A case that changed in
+  between (compare-and-swap on version) stays where it is. A run that stops half-way
+  leaves copies that the next run simply writes again.
+"""
+import sqlite3, time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+import storage
+from storage import db_cursor, db_transaction, TABLE_NAME, HISTORY_TABLE, ARCHIVE_INDEX_TABLE
+from records import CaseRecord, COLUMNS, iter_records
+import metrics
+
+RETENTION = 90 * 86400
+BATCH = 500
+ARCHIVED_STATES = ("RESOLVED",)
+#Cases without updated_at (saved before it existed)
+UNDATED = "undated"
+
+_CASES_DDL = f"""
+CREATE TABLE IF NOT EXISTS cases (
+    case_id INTEGER PRIMARY KEY, {", ".join(CaseRecord._fields[1:])}
+);
+CREATE TABLE IF NOT EXISTS history (
+    {COLUMNS},
+    PRIMARY KEY (case_id, version)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class ArchiveResult:
+    cases: int = 0
+    history_rows: int = 0
+    #Changed while they were being archived, left in the hot tables
+    skipped: int = 0
+    partitions: dict = field(default_factory=dict)
+
+
+def archive_dir() -> Path:
+    #Follows the main database, so tests and benchmarks pointing _DB_PATH elsewhere get their own archive
+    return Path(storage._DB_PATH).parent / "archive"
+
+
+def partition_of(updated_at: Optional[float]) -> str:
+    if updated_at is None:
+        return UNDATED
+    return datetime.fromtimestamp(updated_at, tz = timezone.utc).strftime("%Y-%m")
+
+
+def _path(partition: str) -> Path:
+    return archive_dir() / f"cases-{partition}.sqlite"
+
+
+def _connect(partition: str, *, create: bool = False) -> Optional[sqlite3.Connection]:
+    path = _path(partition)
+    if create:
+        path.parent.mkdir(parents = True, exist_ok = True)
+        c = sqlite3.connect(path, isolation_level = None)
+        c.executescript(_CASES_DDL)
+        return c
+    if not path.exists():
+        return None
+    return sqlite3.connect(f"file:{path}?mode=ro", uri = True, isolation_level = None)
+
+
+# ---------- moving cases out ----------
+def candidates(*, min_age: float = RETENTION, after: int = 0, limit: int = BATCH, now: Optional[float] = None) -> list:
+    cutoff = (now or time.time()) - min_age
+    states = ", ".join("?" * len(ARCHIVED_STATES))
+    return list(iter_records(
+        f"active = 0 AND state IN ({states}) AND (updated_at IS NULL OR updated_at <= ?) AND case_id > ?",
+        (*ARCHIVED_STATES, cutoff, after), limit = limit,
+    ))
+
+
+def _history_rows(case_ids: list) -> list:
+    with db_cursor() as cur:
+        cur.execute(
+            f"SELECT {COLUMNS} FROM {HISTORY_TABLE} WHERE case_id IN ({', '.join('?' * len(case_ids))}) ORDER BY case_id, version",
+            case_ids,
+        )
+        return [tuple(row) for row in cur.fetchall()]
+
+
+def _write(partition: str, cases: list, history: list):
+    c = _connect(partition, create = True)
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.executemany(f"INSERT OR REPLACE INTO cases ({COLUMNS}) VALUES ({', '.join('?' * len(CaseRecord._fields))})", cases)
+        c.executemany(f"INSERT OR REPLACE INTO history ({COLUMNS}) VALUES ({', '.join('?' * len(CaseRecord._fields))})", history)
+        c.execute("COMMIT")
+    except BaseException:
+        if c.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
+        c.close()
+
+
+def _forget(partition: str, case_ids: list):
+    #Copies of cases that stayed in the hot tables; nothing points at them, but a later run would archive them again elsewhere
+    c = _connect(partition, create = True)
+    try:
+        marks = ", ".join("?" * len(case_ids))
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(f"DELETE FROM cases WHERE case_id IN ({marks})", case_ids)
+        c.execute(f"DELETE FROM history WHERE case_id IN ({marks})", case_ids)
+        c.execute("COMMIT")
+    finally:
+        c.close()
+
+
+def _archive_batch(records: list, result: ArchiveResult, now: float):
+    by_partition = {}
+    for record in records:
+        by_partition.setdefault(partition_of(record.updated_at), []).append(record)
+    history = _history_rows([r.case_id for r in records])
+
+    for partition, cases in by_partition.items():
+        ids = {r.case_id for r in cases}
+        with metrics.span("archive_write"):
+            _write(partition, [tuple(r) for r in cases], [h for h in history if h[0] in ids])
+
+    moved, kept = [], []
+    #The only write lock taken: a few DELETEs per case for one batch
+    with db_transaction() as cur:
+        for record in records:
+            cur.execute(f"DELETE FROM {TABLE_NAME} WHERE case_id = ? AND version = ? AND active = 0", (record.case_id, record.version))
+            if cur.rowcount != 1:
+                kept.append(record)
+                continue
+            cur.execute(f"DELETE FROM {HISTORY_TABLE} WHERE case_id = ?", (record.case_id,))
+            result.history_rows += cur.rowcount
+            cur.execute(
+                f"""
+                    INSERT OR REPLACE INTO {ARCHIVE_INDEX_TABLE} (case_id, partition, hostname, osd_id, cluster, resolved_at, archived_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (record.case_id, partition_of(record.updated_at), record.hostname, record.osd_id, record.cluster, record.updated_at, now)
+            )
+            moved.append(record)
+
+    for record in kept:
+        _forget(partition_of(record.updated_at), [record.case_id])
+    result.cases += len(moved)
+    result.skipped += len(kept)
+    for record in moved:
+        partition = partition_of(record.updated_at)
+        result.partitions[partition] = result.partitions.get(partition, 0) + 1
+    metrics.count("archived_cases", len(moved))
+
+
+def archive(*, min_age: float = RETENTION, batch: int = BATCH, max_batches: Optional[int] = None,
+        now: Optional[float] = None) -> ArchiveResult:
+    """Moves cases resolved at least min_age seconds ago to the archive, `batch` cases per transaction."""
+    now = now or time.time()
+    result = ArchiveResult()
+    after, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        records = candidates(min_age = min_age, after = after, limit = batch, now = now)
+        if not records:
+            break
+        after = records[-1].case_id
+        _archive_batch(records, result, now)
+        batches += 1
+    return result
+
+
+# ---------- finding archived cases ----------
+def partition_for(case_id: int) -> Optional[str]:
+    with db_cursor() as cur:
+        cur.execute(f"SELECT partition FROM {ARCHIVE_INDEX_TABLE} WHERE case_id = ?", (case_id,))
+        row = cur.fetchone()
+    return row["partition"] if row is not None else None
+
+
+def _query(case_id: int, sql: str, params) -> list:
+    partition = partition_for(case_id)
+    c = _connect(partition) if partition is not None else None
+    if c is None:
+        return []
+    try:
+        return [CaseRecord._make(row) for row in c.execute(sql, params).fetchall()]
+    finally:
+        c.close()
+
+
+def load_archived(case_id: int, version: Optional[int] = None) -> Optional[CaseRecord]:
+    #The case as it was archived, or one of its earlier versions
+    if version is None:
+        rows = _query(case_id, f"SELECT {COLUMNS} FROM cases WHERE case_id = ?", (case_id,))
+    else:
+        rows = _query(case_id, f"""
+                SELECT {COLUMNS} FROM cases WHERE case_id = ? AND version = ?
+                UNION ALL SELECT {COLUMNS} FROM history WHERE case_id = ? AND version = ?
+            """, (case_id, version, case_id, version))
+    return rows[0] if rows else None
+
+
+def iter_archived_history(case_id: int) -> Iterator[CaseRecord]:
+    yield from _query(case_id, f"""
+            SELECT {COLUMNS} FROM history WHERE case_id = ?
+            UNION ALL SELECT {COLUMNS} FROM cases WHERE case_id = ?
+            ORDER BY version
+        """, (case_id, case_id))
+
+
+def archived_as_of(case_id: int, when: float) -> Optional[CaseRecord]:
+    rows = _query(case_id, f"""
+            SELECT {COLUMNS} FROM (
+                SELECT {COLUMNS} FROM history WHERE case_id = ? AND updated_at <= ?
+                UNION ALL SELECT {COLUMNS} FROM cases WHERE case_id = ? AND updated_at <= ?
+            ) ORDER BY updated_at DESC, version DESC LIMIT 1
+        """, (case_id, when, case_id, when))
+    return rows[0] if rows else None
@@ -1,13 +1,21 @@
-import argparse, json, sys
-from models import DlcCase, State, Action, WaitReason
+import argparse, contextlib, csv, itertools, json, sys, time
+from datetime import datetime
+#Only modules without ceph-util imports are imported here. models, snapshot and the other cluster modules are imported by the commands that need them, so read-only commands (list, history) start fast.
+from states import State, Action, WaitReason
+from errors import CaseError, CaseWaiting
+import metrics
+import smart_trends
 import sqlite3
-#This import is from ceph-util
-import tabular
 TABLE_NAME = "testing_table"
+#Commands that only read. Monitoring runs them often, so they don't add their SQLite timings to the node-wide
+#metrics totals (a file lock and a rewrite of ~/.dlc/metrics.json each time) unless --metrics-textfile asks for it.
+READ_ONLY_COMMANDS = {"list", "history", "drive-tests", "status-server"}
 
 
 def _parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(prog="dlc")
+    p.add_argument("--metrics-log", help="append one JSON line per timed operation to this file")
+    p.add_argument("--metrics-textfile", help="write node-wide totals to this Prometheus textfile-collector file on exit")
     #dest is for naming the attribute by which the subcommands can be accessed (ArgumentParser.cmd = "new", "update", or "list"). 'required' is to indicate that a subcommand must be provided
     sp = p.add_subparsers(dest="cmd", required=True)
 
@@ -16,6 +24,13 @@ def _parser() -> argparse.ArgumentParser:
     newp = sp.add_parser("new", help="create a new case")
     _common_args(newp)
 
+    #add a subcommand for opening many cases at once
+    # ------------- import ----------
+    imp = sp.add_parser("import", help="create cases from a JSON-lines or CSV file in one transaction")
+    imp.add_argument("file", nargs="?", default="-", help="file with one case per line/row (hostname, block_dev, osd_id), '-' for stdin")
+    imp.add_argument("--format", choices=["jsonl", "csv"], help="defaults to csv for *.csv files, jsonl otherwise")
+    imp.add_argument("--refresh", action="store_true", help="ignore the cached OSD map snapshot and rebuild it")
+
     #add a subcommand for updating cases
     # ------------- update ----------
     upd = sp.add_parser("update", help="update or new version")
@@ -26,7 +41,92 @@ def _parser() -> argparse.ArgumentParser:
     #add a subcommand for listing cases
     # ------------- list ------------
     lst = sp.add_parser("list", help="list cases")
-    lst.add_argument("--all", action="store_true", help="include inactive versions")
+    lst.add_argument("--all", action="store_true", help="include resolved cases (closed when they reach RESOLVED) that haven't been archived")
+    lst.add_argument("--state", choices=[s.value for s in State])
+    lst.add_argument("--hostname")
+    lst.add_argument("--cluster")
+    lst.add_argument("--osd-id", type=int)
+    lst.add_argument("--older-than", metavar="AGE", help="only cases last updated at least AGE ago (seconds, or e.g. 90m, 12h, 7d)")
+    lst.add_argument("--newer-than", metavar="AGE", help="only cases last updated at most AGE ago")
+    lst.add_argument("--limit", type=int, help="at most this many cases; the case_id to continue --after is printed on stderr")
+    lst.add_argument("--after", type=int, metavar="CASE_ID", help="only cases after this case_id (the next page)")
+    lst.add_argument("--format", choices=["table", "json", "csv"], default="table", help="json is one object per line")
+
+    #add a subcommand for moving old resolved cases out of the hot tables
+    # ------------- archive ---------
+    arc = sp.add_parser("archive", help="move resolved cases and their history to the monthly archive databases")
+    arc.add_argument("--min-age", default="90d", metavar="AGE", help="only cases resolved at least AGE ago (seconds, or e.g. 12h, 30d)")
+    arc.add_argument("--batch", type=int, default=500, help="cases moved per transaction")
+    arc.add_argument("--max-batches", type=int, help="stop after this many batches, the next run continues")
+    arc.add_argument("--dry-run", action="store_true", help="only count the cases that would be archived")
+
+    #add a subcommand for showing every version of a case
+    # ------------- history ---------
+    hst = sp.add_parser("history", help="show every version of a case")
+    hst.add_argument("case_id", type=int)
+    hst.add_argument("--as-of", help="only show the version current at this time (ISO 8601 or unix seconds)")
+
+    #add a subcommand for finding failing drives on this host and opening cases for them
+    # ------------- scan ------------
+    scn = sp.add_parser("scan", help="check SMART on this host's OSD devices and open cases for failing drives")
+    scn.add_argument("--max-age", type=float, default=3600, help="skip devices with a SMART sample younger than this many seconds")
+    scn.add_argument("--workers", type=int, default=8, help="smartctl processes at the same time")
+    scn.add_argument("--dry-run", action="store_true", help="report failing drives without opening cases")
+    scn.add_argument("--refresh", action="store_true", help="ignore the cached OSD map snapshot and rebuild it")
+    scn.add_argument("--json", action="store_true", help="one JSON object per device on stdout, everything else on stderr")
+
+    #add a subcommand for showing background drive tests
+    # ------------- drive-tests -----
+    dts = sp.add_parser("drive-tests", help="show drive tests and how far they got")
+    dts.add_argument("--case-id", type=int)
+    dts.add_argument("--host", help="only tests on this host")
+    dts.add_argument("--unfinished", action="store_true", help="only queued and running tests")
+
+    #add a subcommand for fleet-wide SMART attribute trends
+    # ------------- smart-trends ----
+    trd = sp.add_parser("smart-trends", help="growth per day of a SMART attribute on every drive, fastest first (needs numpy)")
+    trd.add_argument("attribute", nargs="?", default="pending_sectors", choices=sorted(smart_trends.ATTRIBUTES))
+    trd.add_argument("--days", type=float, default=365, help="only samples from the last DAYS days")
+    trd.add_argument("--host", action="append", help="only drives last seen on these hosts (repeatable)")
+    trd.add_argument("--top", type=int, default=20, help="show this many drives, 0 for all")
+    trd.add_argument("--backfill", action="store_true", help="first add samples from smartctl results stored before trends were kept")
+
+    #add a subcommand for progressing every active case on this host
+    # ------------- sweep -----------
+    swp = sp.add_parser("sweep", help="progress all active cases on this host against one OSD map snapshot")
+    swp.add_argument("--refresh", action="store_true", help="ignore the cached OSD map snapshot and rebuild it")
+    swp.add_argument("--case-id", type=int, action="append", help="only these cases (repeatable)")
+    swp.add_argument("--json", action="store_true", help="one JSON object per case on stdout, everything else on stderr")
+
+    #add a subcommand for sweeping every host with active cases from one place
+    # ------------- coordinate ------
+    crd = sp.add_parser("coordinate", help="run a sweep on every host with active cases, in parallel")
+    crd.add_argument("--transport", choices=["ssh", "local"], default="ssh")
+    crd.add_argument("--max-hosts", type=int, default=8, help="hosts swept at the same time")
+    crd.add_argument("--timeout", type=float, default=900, help="seconds before a host's sweep is abandoned")
+    crd.add_argument("--host", action="append", help="only these hosts (repeatable)")
+    crd.add_argument("--json", action="store_true", help="one JSON object per case on stdout")
+
+    #add a subcommand for running as a long-lived process instead of from cron
+    # ------------- daemon ----------
+    dmn = sp.add_parser("daemon", help="keep progressing active cases on this host")
+    dmn.add_argument("--tick", type=float, default=60, help="seconds between full passes over the active cases")
+    dmn.add_argument("--health-poll", type=float, default=5, help="seconds between health checks while cases wait for recovery")
+    dmn.add_argument("--max-concurrent", type=int, default=4, help="cases progressed at the same time")
+    dmn.add_argument("--once", action="store_true", help="run a single pass and exit")
+    dmn.add_argument("--scan-interval", type=float, help="also scan this host's drives and open cases for failing ones, at most every this many seconds")
+    stream = dmn.add_mutually_exclusive_group()
+    stream.add_argument("--health-stream", metavar="PATH", help="FIFO or file with `ceph status --format json` lines (or `ceph -w` output), '-' for stdin; replaces health polling")
+    stream.add_argument("--health-command", metavar="CMD", help="command printing health updates, e.g. 'ceph -w'; restarted when it exits")
+    dmn.add_argument("--health-debounce", type=float, default=10, help="seconds the stream must stay clean before waiting cases are woken")
+
+    #add a subcommand for answering monitoring scrapes from memory
+    # ------------- status-server ---
+    sts = sp.add_parser("status-server", help="serve active cases, state counts and recent transitions over HTTP from memory")
+    where = sts.add_mutually_exclusive_group()
+    where.add_argument("--socket", help="Unix socket to listen on (default ~/.dlc/status.sock)")
+    where.add_argument("--port", type=int, help="listen on this localhost TCP port instead of a Unix socket")
+    sts.add_argument("--interval", type=float, default=2, help="seconds between checks of the database for changes")
     return p
 
 #Need to clean this up. The 'new' subcommand shouldn't need this many args, neither should update. Should all these be taken away for standard 'new' and 'update' calls and used for special cases? Not sure yet.
@@ -43,19 +143,62 @@ def _common_args(pp: argparse.ArgumentParser, *, require_any=False):
     pp.add_argument("--action", choices=[a.value for a in Action])
     pp.add_argument("--wait-reason", choices=[w.value for w in WaitReason])
     pp.add_argument("--force-save", help="Force an attempt at saving a case without a matching OSD.", type=bool)
+    pp.add_argument("--refresh", action="store_true", help="ignore the cached OSD map snapshot and rebuild it")
 
 
 def main(argv=None):
     ns = _parser().parse_args(argv)
+    metrics.configure(json_log = ns.metrics_log)
+    #finally: exit paths (sys.exit included) still add their timings to the totals
+    try:
+        _dispatch(ns)
+    finally:
+        if ns.cmd not in READ_ONLY_COMMANDS or ns.metrics_textfile:
+            try:
+                metrics.flush(ns.metrics_textfile)
+            except OSError as e:
+                print(f"Could not write metrics: {e}")
+
+
+def _dispatch(ns):
     if ns.cmd == "new":
         _cmd_new(ns)
+    elif ns.cmd == "import":
+        _cmd_import(ns)
     elif ns.cmd == "update":
         _cmd_update(ns)
     elif ns.cmd == "list":
         _cmd_list(ns)
+    elif ns.cmd == "history":
+        _cmd_history(ns)
+    elif ns.cmd == "archive":
+        _cmd_archive(ns)
+    elif ns.cmd == "scan":
+        _cmd_scan(ns)
+    elif ns.cmd == "drive-tests":
+        _cmd_drive_tests(ns)
+    elif ns.cmd == "smart-trends":
+        _cmd_smart_trends(ns)
+    elif ns.cmd == "sweep":
+        _cmd_sweep(ns)
+    elif ns.cmd == "coordinate":
+        _cmd_coordinate(ns)
+    elif ns.cmd == "daemon":
+        _cmd_daemon(ns)
+    elif ns.cmd == "status-server":
+        _cmd_status_server(ns)
+
+
+def _print_table(schema, rows):
+    #This import is from ceph-util
+    import tabular
+    tabular.format_tabular(schema, rows, align = 'right', indent=0)
 
 
 def _cmd_new(ns):
+    from models import DlcCase
+    from snapshot import ClusterSnapshot
+
     if ns.block_dev is not None:
         if ns.block_dev.startswith('/dev/'):
             dev = ns.block_dev
@@ -69,17 +212,55 @@ def _cmd_new(ns):
             #**({"cluster": ns.cluster} if ns.cluster is not None else {}),
     }
     case = DlcCase(**case_kwargs)
-    #try:
-        #saved_case = case.save(force_save = ns.force_save)
-    #except sqlite3.IntegrityError as e:
-    #    print(e)
-    #    sys.exit(1)
+    try:
+        #force_save skips the OSD map lookup, so there is no snapshot to load
+        snapshot = None if ns.force_save else ClusterSnapshot.load(refresh = ns.refresh)
+        saved_case = case.save(force_save = bool(ns.force_save), snapshot = snapshot)
+    except sqlite3.IntegrityError as e:
+        print(case.osd_id, case.block_dev, case.hostname)
+        print(e)
+        sys.exit(1)
+    except CaseError as e:
+        print(e)
+        sys.exit(1)
+
+    if saved_case:
+        print(f"Created case {saved_case.case_id}")
+
+
+def _cmd_import(ns):
+    from intake import import_cases, read_specs, CREATED
+    from snapshot import ClusterSnapshot
+
+    fmt = ns.format or ("csv" if ns.file.endswith(".csv") else "jsonl")
+    try:
+        f = sys.stdin if ns.file == "-" else open(ns.file, newline="")
+    except OSError as e:
+        print(e)
+        sys.exit(1)
 
-    #if saved_case:
-    #    print(f"Created case {saved_case.case_id}")
+    with f:
+        try:
+            results = import_cases(read_specs(f, fmt), ClusterSnapshot.load(refresh = ns.refresh))
+        except CaseError as e:
+            print(e)
+            sys.exit(1)
+
+    schema = []
+    for header in ("line", "outcome", "case_id", "hostname", "block_dev", "osd_id", "message"):
+        schema.append({'name': header, 'value': lambda x, attr=header: getattr(x, attr), })
+    _print_table(schema, results)
+
+    created = sum(r.outcome == CREATED for r in results)
+    print(f"Created {created} of {len(results)} cases")
+    if created != len(results):
+        sys.exit(1)
 
 
 def _cmd_update(ns):
+    from models import DlcCase
+    from snapshot import ClusterSnapshot
+
     try:
         case = DlcCase.load(ns.case_id)
     except ValueError as exc:
@@ -88,7 +269,24 @@ def _cmd_update(ns):
 
     #For now assuming new_version is True for updates via the cmd line
     #updated_case = case.save(new_version=ns.new_version)
-    updated_case = case.progress(new_version = True)
+    snapshot = ClusterSnapshot.load(refresh = ns.refresh)
+    testing = case.state == State.DRIVE_TESTING
+    if testing:
+        import drive_tests
+        #Like a sweep: record a test that finished before the case looks at it
+        drive_tests.step(snapshot.hostname)
+    try:
+        updated_case = case.progress(new_version = True, snapshot = snapshot)
+    except CaseWaiting as exc:
+        print(exc, "Exiting.")
+        sys.exit()
+    except CaseError as exc:
+        print(exc, "Exiting...")
+        sys.exit(1)
+    finally:
+        if testing:
+            #A test queued (or waited on) here starts now instead of on the next sweep or daemon tick
+            drive_tests.step(snapshot.hostname)
     #updated_case = case.save(new_version=True)
 
     if updated_case:
@@ -98,26 +296,251 @@ def _cmd_update(ns):
         print("Case is NoneType, if not testing then something went wrong...")
 
 
-from storage import db_cursor
+from records import CaseRecord, iter_history, record_as_of, query_records
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _format_time(value):
+    return datetime.fromtimestamp(value).isoformat(sep=" ", timespec="seconds") if value is not None else None
+
+
+def _record_schema():
+    schema = []
+    for header in CaseRecord._fields:
+        if header == "updated_at":
+            schema.append({'name': header, 'value': lambda x: _format_time(x.updated_at), })
+        else:
+            schema.append({'name': header, 'value': lambda x, attr=header: getattr(x, attr), })
+    return schema
+
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+#Rows the column widths of a streamed table are taken from; later rows are printed as they come, wider cells just stick out
+TABLE_BLOCK = 1000
+
+
+def _parse_duration(value: str) -> float:
+    unit = _DURATION_UNITS.get(value[-1:].lower())
+    if unit is not None:
+        return float(value[:-1]) * unit
+    return float(value)
 
 
 def _cmd_list(ns):
-    with db_cursor() as cur:
-        sql = f"SELECT * FROM {TABLE_NAME}"
-        cur.execute(sql)
-        #Here I'm fetching the rows
-        sql_rows = cur.fetchall()
-        #Here I'm grabbing the headers
-        headers = [d[0] for d in cur.description]
+    #Read-only records: no DlcCase objects, so listing can never reach the cluster or write to the database
+    try:
+        older_than = _parse_duration(ns.older_than) if ns.older_than else None
+        newer_than = _parse_duration(ns.newer_than) if ns.newer_than else None
+    except ValueError:
+        print(f"Can't parse an age out of {ns.older_than or ns.newer_than!r}, use seconds or a number with s, m, h, d or w")
+        sys.exit(1)
+
+    cases = query_records(
+            state = ns.state, hostname = ns.hostname, cluster = ns.cluster, osd_id = ns.osd_id,
+            active = None if ns.all else True, older_than = older_than, newer_than = newer_than,
+            after = ns.after, limit = ns.limit,
+    )
+    last, count = None, 0
+    for last in _write_records(cases, ns.format):
+        count += 1
+
+    #A full page may have more after it
+    if ns.limit is not None and count == ns.limit and last is not None:
+        print(f"More cases may follow: --after {last.case_id}", file=sys.stderr)
+
+
+def _write_records(cases, fmt):
+    #Writes each case as it comes from the database and yields it back once written
+    if fmt == "json":
+        for case in cases:
+            sys.stdout.write(json.dumps(case._asdict()) + "\n")
+            yield case
+    elif fmt == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(CaseRecord._fields)
+        for case in cases:
+            writer.writerow(case)
+            yield case
+    else:
+        #One header and one set of widths for the whole table, so memory doesn't grow with the number of cases
+        schema = _record_schema()
+        cases = iter(cases)
+        block = list(itertools.islice(cases, TABLE_BLOCK))
+        widths = [max([len(col['name'])] + [len(str(col['value'](case))) for case in block]) for col in schema]
 
-        #Here I'm creating a list of DlcCase objects and using dictionary unpacking to instantiate the objects. I'm doing this in order to reuse the methods in ceph-util.tabular 
-        cases = [DlcCase(**dict(row)) for row in sql_rows]
+        def line(cells):
+            return "  ".join(str(cell).rjust(width) for cell, width in zip(cells, widths)) + "\n"
 
+        sys.stdout.write(line(col['name'] for col in schema))
+        for case in itertools.chain(block, cases):
+            sys.stdout.write(line(col['value'](case) for col in schema))
+            yield case
+
+
+def _cmd_history(ns):
+    if ns.as_of is not None:
+        try:
+            when = _parse_time(ns.as_of)
+        except ValueError:
+            print(f"Can't parse --as-of {ns.as_of!r}, use ISO 8601 or unix seconds")
+            sys.exit(1)
+        record = record_as_of(ns.case_id, when)
+        versions = [record] if record is not None else []
+    else:
+        versions = list(iter_history(ns.case_id))
+
+    if not versions:
+        print("Case not found")
+        sys.exit(1)
+
+    _print_table(_record_schema(), versions)
+
+
+def _cmd_archive(ns):
+    import archive
+    try:
+        min_age = _parse_duration(ns.min_age)
+    except ValueError:
+        print(f"Can't parse an age out of {ns.min_age!r}, use seconds or a number with s, m, h, d or w")
+        sys.exit(1)
+
+    if ns.dry_run:
+        count, after = 0, 0
+        while batch := archive.candidates(min_age = min_age, after = after, limit = ns.batch):
+            count += len(batch)
+            after = batch[-1].case_id
+        print(f"{count} cases would be archived")
+        return
+
+    result = archive.archive(min_age = min_age, batch = ns.batch, max_batches = ns.max_batches)
+    print(f"Archived {result.cases} cases ({result.history_rows} history rows) to {archive.archive_dir()}")
+    for partition, count in sorted(result.partitions.items()):
+        print(f"  cases-{partition}.sqlite: {count}")
+    if result.skipped:
+        print(f"{result.skipped} cases changed while being archived and were left in place")
+
+
+def _cmd_scan(ns):
+    import scanner
+    from snapshot import ClusterSnapshot
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr if ns.json else sys.stdout):
+            results = scanner.scan(ClusterSnapshot.load(refresh = ns.refresh), max_age = ns.max_age,
+                    max_workers = ns.workers, open_cases = not ns.dry_run)
+    except CaseError as exc:
+        print(exc, file = sys.stderr if ns.json else sys.stdout)
+        sys.exit(1)
+
+    if ns.json:
+        for r in results:
+            print(json.dumps(r.as_dict()))
+    else:
         schema = []
-        for header in headers:
+        for header in ("device", "osd_id", "serial", "outcome", "case_id", "message"):
             schema.append({'name': header, 'value': lambda x, attr=header: getattr(x, attr), })
+        _print_table(schema, results)
+
+    if any(r.outcome == scanner.ERROR for r in results):
+        sys.exit(1)
+
+
+def _cmd_drive_tests(ns):
+    import drive_tests
+    tests = drive_tests.jobs(hostname = ns.host, case_id = ns.case_id, unfinished = ns.unfinished)
+
+    schema = []
+    for header in ("job_id", "case_id", "hostname", "device", "controller", "kind", "status", "progress", "passed", "error"):
+        schema.append({'name': header, 'value': lambda x, attr=header: getattr(x, attr), })
+    for header in ("started_at", "finished_at"):
+        schema.append({'name': header, 'value': lambda x, attr=header: _format_time(getattr(x, attr)), })
+    _print_table(schema, tests)
+
+
+def _cmd_smart_trends(ns):
+    if ns.backfill:
+        print("Backfilled samples from {} stored smartctl results".format(smart_trends.backfill()))
+    try:
+        trends = smart_trends.growth_rates(ns.attribute, since = time.time() - ns.days * 86400, hostnames = ns.host)
+    except ImportError:
+        print("smart-trends needs numpy: pip install 'dlc[trends]'")
+        sys.exit(1)
+
+    schema = []
+    for header in ("serial", "samples", "first", "last", "per_day"):
+        schema.append({'name': header, 'value': lambda x, attr=header: getattr(x, attr), })
+    for header in ("first_seen", "last_seen"):
+        schema.append({'name': header, 'value': lambda x, attr=header: _format_time(getattr(x, attr)), })
+    _print_table(schema, trends[:ns.top] if ns.top else trends)
+
+
+def _cmd_sweep(ns):
+    from sweep import sweep, FAILED
+    from snapshot import ClusterSnapshot
+
+    try:
+        #In JSON mode stdout carries only the results, dlc's progress messages go to stderr
+        with contextlib.redirect_stdout(sys.stderr if ns.json else sys.stdout):
+            results = sweep(ClusterSnapshot.load(refresh = ns.refresh), case_ids = ns.case_id)
+    except CaseError as exc:
+        print(exc, file = sys.stderr if ns.json else sys.stdout)
+        sys.exit(1)
+
+    if ns.json:
+        for r in results:
+            print(json.dumps(r.as_dict()))
+        if any(r.outcome == FAILED for r in results):
+            sys.exit(1)
+        return
+
+    schema = []
+    for header in ("case_id", "state_before", "state_after", "outcome", "message"):
+        schema.append({'name': header, 'value': lambda x, attr=header: getattr(x, attr), })
+    _print_table(schema, results)
+
+    if any(r.outcome == FAILED for r in results):
+        sys.exit(1)
+
+
+def _cmd_coordinate(ns):
+    import coordinator
+
+    transport = coordinator.SSHTransport() if ns.transport == "ssh" else coordinator.LocalTransport()
+    host_results = coordinator.coordinate(transport, max_hosts = ns.max_hosts, timeout = ns.timeout, hosts = ns.host)
+
+    if ns.json:
+        for h in host_results:
+            for r in h.results:
+                print(json.dumps({"hostname": h.hostname, **r}))
+    else:
+        schema = []
+        for header in ("hostname", "ok", "cases", "seconds", "error"):
+            schema.append({'name': header, 'value': lambda x, attr=header: getattr(x, attr), })
+        _print_table(schema, host_results)
+
+    if not all(h.ok for h in host_results):
+        sys.exit(1)
+
+
+def _cmd_daemon(ns):
+    import daemon, shlex
+    health_stream = shlex.split(ns.health_command) if ns.health_command else ns.health_stream
+    daemon.run(tick = ns.tick, health_poll = ns.health_poll, max_concurrent = ns.max_concurrent, once = ns.once,
+            health_stream = health_stream, health_debounce = ns.health_debounce, scan_interval = ns.scan_interval)
 
-        tabular.format_tabular(schema, cases, align = 'right', indent=0)
+def _cmd_status_server(ns):
+    import status_api
+    from storage import get_conn
+    #The server only opens the database read-only, so create or migrate it here first
+    get_conn()
+    socket_path = None if ns.port is not None else (ns.socket or status_api.SOCKET_PATH)
+    status_api.run(socket_path = socket_path, port = ns.port, interval = ns.interval)
 
 if __name__ == "__main__":  # so `python -m dlc.cli` works
     main()
@@ -0,0 +1,144 @@
+"""
+Cluster-wide sweep from one place (`dlc coordinate`):
+* Reads the active cases, groups them by hostname.
+* Runs `dlc sweep --json --case-id ...` for each host through a Transport, at most
+  `max_hosts` at a time, each with its own timeout.
+* Collects the per-case results centrally, so a fleet pass takes as long as the
+  slowest host instead of the sum of all hosts.
+get_complete_information refuses to work on another host's cases, which is why
+the work has to run on each host.
+"""
+import json, subprocess, time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
+
+from records import iter_records
+import runner
+
+COORDINATE_TIMEOUT = 900
+MAX_HOSTS = 8
+
+
+@dataclass
+class HostResult:
+    hostname: str
+    ok: bool
+    cases: int
+    seconds: float
+    results: List[dict] = field(default_factory=list)
+    returncode: Optional[int] = None
+    error: Optional[str] = None
+
+
+class Transport(ABC):
+    """Runs argv on `hostname` and returns (returncode, stdout, stderr); raises subprocess.TimeoutExpired."""
+
+    @abstractmethod
+    def command(self, hostname: str, argv: List[str]) -> List[str]:
+        #The local command line that runs argv on hostname
+        ...
+
+    def run(self, hostname: str, argv: List[str], timeout: float):
+        #Through runner.py, so the ssh session (and whatever it started) is killed on timeout and counts against the host's limit
+        R = runner.run(self.command(hostname, argv), timeout = timeout, host = hostname, step = "coordinate")
+        if R.error is not None:
+            raise OSError(R.error)
+        if R.timed_out:
+            raise subprocess.TimeoutExpired(R.argv, timeout)
+        return R.returncode, R.stdout, R.stderr
+
+
+class SSHTransport(Transport):
+    def __init__(self, ssh_options: Iterable[str] = ("-o", "BatchMode=yes", "-o", "ConnectTimeout=10")):
+        self.ssh_options = list(ssh_options)
+
+    def command(self, hostname, argv):
+        return ["ssh", *self.ssh_options, hostname, "--", *argv]
+
+
+class LocalTransport(Transport):
+    #Runs the command on this machine, whatever the target host. Meant for tests and single-node setups.
+    def command(self, hostname, argv):
+        return list(argv)
+
+
+def sweep_command(hostname: str, case_ids: List[int]) -> List[str]:
+    argv = ["dlc", "sweep", "--json"]
+    for case_id in case_ids:
+        argv += ["--case-id", str(case_id)]
+    return argv
+
+
+def active_cases_by_host(hosts: Optional[Iterable[str]] = None) -> dict:
+    wanted = set(hosts) if hosts else None
+    batches = defaultdict(list)
+    for record in iter_records("active = 1"):
+        if record.hostname is None or (wanted is not None and record.hostname not in wanted):
+            continue
+        batches[record.hostname].append(record.case_id)
+    return dict(batches)
+
+
+def _parse_results(stdout: str):
+    #(the per-case results, whether stdout was nothing but them); anything else there (an ssh banner, a crash) is skipped
+    results = []
+    clean = True
+    for line in stdout.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            result = json.loads(line)
+        except ValueError:
+            clean = False
+            continue
+        if isinstance(result, dict):
+            results.append(result)
+        else:
+            clean = False
+    return results, clean and bool(results)
+
+
+def _host_error(returncode: int, results: list, clean: bool, stderr: str) -> str:
+    #`dlc sweep --json` sends its progress messages to stderr, so the failed cases on stdout say what went wrong.
+    #stderr only explains a host whose stdout isn't the results (ssh errors, a CaseError before the sweep, ...).
+    if clean:
+        failed = [r for r in results if r.get("outcome") == "failed"]
+        if failed:
+            return "; ".join("case {}: {}".format(r.get("case_id"), r.get("message")) for r in failed)
+        return f"exit status {returncode}"
+    lines = stderr.strip().splitlines()
+    return lines[-1] if lines else f"exit status {returncode}"
+
+
+def run_host(transport: Transport, hostname: str, case_ids: List[int], *, timeout: float = COORDINATE_TIMEOUT,
+        command: Callable[[str, List[int]], List[str]] = sweep_command) -> HostResult:
+    start = time.monotonic()
+    try:
+        returncode, out, err = transport.run(hostname, command(hostname, case_ids), timeout)
+    except subprocess.TimeoutExpired:
+        return HostResult(hostname, False, len(case_ids), round(time.monotonic() - start, 3), error = f"timed out after {timeout}s")
+    except OSError as e:
+        return HostResult(hostname, False, len(case_ids), round(time.monotonic() - start, 3), error = str(e))
+
+    results, clean = _parse_results(out)
+    error = _host_error(returncode, results, clean, err) if returncode != 0 else None
+    return HostResult(hostname, returncode == 0, len(case_ids), round(time.monotonic() - start, 3), results, returncode, error)
+
+
+def coordinate(transport: Transport, *, max_hosts: int = MAX_HOSTS, timeout: float = COORDINATE_TIMEOUT,
+        hosts: Optional[Iterable[str]] = None, command: Callable[[str, List[int]], List[str]] = sweep_command) -> list:
+    batches = active_cases_by_host(hosts)
+    if not batches:
+        return []
+    #Our own Runner for the ssh sessions, so runner.MAX_CONCURRENT doesn't quietly cap max_hosts
+    current = runner.get_runner()
+    sessions = runner.Runner(current.executor, max_concurrent = max(1, max_hosts), max_per_host = current.max_per_host,
+            default_timeout = current.default_timeout)
+    with runner.use(sessions), ThreadPoolExecutor(max_workers = max(1, min(max_hosts, len(batches)))) as pool:
+        futures = [pool.submit(run_host, transport, hostname, case_ids, timeout = timeout, command = command)
+                for hostname, case_ids in sorted(batches.items())]
+        return [f.result() for f in futures]
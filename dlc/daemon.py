@@ -0,0 +1,186 @@
+"""
+Long-running replacement for running `dlc update`/`dlc sweep` from cron:
+* Active cases stay in memory between ticks, only new ones are loaded from SQLite.
+* Cluster health is evaluated once per tick and every case waiting on
+  WaitReason.cluster_health is woken together when it turns clean.
+* While cases wait on health, health is polled every `health_poll` seconds, so
+  OSD removal starts seconds after recovery finishes instead of a cron interval later.
+* With a health stream (health_stream.HealthStream) nothing is polled: waiting cases
+  are woken by the stream's debounced transition to clean, and a tick skips the
+  monitor query while the stream says the cluster isn't clean. Polling comes back
+  whenever the stream has nothing to say.
+* With scan_interval, the host's drives are scanned (scanner.scan) at most that often
+  and cases are opened for failing ones.
+* Cases ready to drain are admitted together against the drain budget (drain.py)
+  before the others progress.
+* Independent cases progress concurrently (bounded); each step is checkpointed by
+  DlcCase.save() as before.
+"""
+import asyncio, signal
+from typing import Optional
+
+from models import DlcCase, State, WaitReason, CaseError
+from snapshot import ClusterSnapshot
+from storage import db_cursor, TABLE_NAME
+from sweep import progress_case, drain_batch, IDLE_STATES, FAILED, CONFLICT
+from health_stream import HealthStream, DEBOUNCE
+import drive_tests
+import scanner
+
+TICK = 60
+HEALTH_POLL = 5
+MAX_CONCURRENT = 4
+
+
+def _waits_on_health(case: DlcCase) -> bool:
+    return case.state == State.RECOVERY_WAIT or case.wait_reason == WaitReason.cluster_health
+
+
+class Daemon:
+    def __init__(self, *, tick: float = TICK, health_poll: float = HEALTH_POLL, max_concurrent: int = MAX_CONCURRENT,
+            health_stream: Optional[HealthStream] = None, scan_interval: Optional[float] = None):
+        self.tick_interval = tick
+        self.health_poll = health_poll
+        self.max_concurrent = max_concurrent
+        self.health_stream = health_stream
+        self.scan_interval = scan_interval
+        self._next_scan = 0.0
+        self.cases = {}
+        self.last_results = {}
+        self._stop = None
+
+    # ---------- case bookkeeping ----------
+    def _active_case_ids(self, hostname: str, cluster: str) -> set:
+        with db_cursor() as cur:
+            cur.execute(f"SELECT case_id FROM {TABLE_NAME} WHERE active=1 AND hostname=? AND cluster=?", (hostname, cluster))
+            return {row["case_id"] for row in cur.fetchall()}
+
+    def _refresh_cases(self, hostname: str, cluster: str):
+        #Only cases we haven't seen are loaded, the others keep their in-memory state
+        active = self._active_case_ids(hostname, cluster)
+        for case_id in set(self.cases) - active:
+            del self.cases[case_id]
+        for case_id in active - set(self.cases):
+            self.cases[case_id] = DlcCase.load(case_id)
+
+    # ---------- one pass ----------
+    async def tick(self, snapshot: Optional[ClusterSnapshot] = None) -> list:
+        if snapshot is None:
+            snapshot = await asyncio.to_thread(ClusterSnapshot.load)
+
+        cluster_name, e = DlcCase._check_ceph_cluster()
+        if not cluster_name:
+            raise CaseError(e)
+        await self._scan(snapshot)
+        await asyncio.to_thread(self._refresh_cases, snapshot.hostname, cluster_name)
+
+        runnable = [c for c in self.cases.values() if c.state not in IDLE_STATES]
+        drained = await asyncio.to_thread(drain_batch, runnable, snapshot, cluster_name)
+        handled = {r.case_id for r in drained}
+        runnable = [c for c in runnable if c.case_id not in handled]
+        if any(_waits_on_health(c) for c in runnable):
+            #Asked once here, every waiting case then sees the same answer through the snapshot.
+            #The stream saying "not clean" is enough to leave them be; "clean" is still confirmed with the monitors.
+            if self.health_stream is not None and self.health_stream.live and not self.health_stream.clean:
+                clean = False
+            else:
+                clean = await asyncio.to_thread(snapshot.is_clean)
+            if not clean:
+                runnable = [c for c in runnable if not _waits_on_health(c)]
+
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        async def _one(case):
+            async with semaphore:
+                return await asyncio.to_thread(progress_case, case, snapshot)
+
+        await asyncio.to_thread(drive_tests.step, snapshot.hostname)
+        results = drained + list(await asyncio.gather(*(_one(c) for c in runnable)))
+        await asyncio.to_thread(drive_tests.step, snapshot.hostname)
+        for result in results:
+            self.last_results[result.case_id] = result
+            if result.outcome == FAILED:
+                print("Case {} failed in state {}: {}".format(result.case_id, result.state_before, result.message))
+                #The in-memory object may be half-way through a step that never got saved, reload it next tick
+                self.cases.pop(result.case_id, None)
+            elif result.outcome == CONFLICT:
+                #Another process saved the case, our copy is stale
+                self.cases.pop(result.case_id, None)
+        return results
+
+    async def _scan(self, snapshot: ClusterSnapshot):
+        #Cases opened here are loaded by the _refresh_cases right after, and progressed in the same tick
+        loop = asyncio.get_running_loop()
+        if not self.scan_interval or loop.time() < self._next_scan:
+            return
+        self._next_scan = loop.time() + self.scan_interval
+        try:
+            results = await asyncio.to_thread(scanner.scan, snapshot)
+        except Exception as e:
+            print("dlc daemon scan failed: {}: {}".format(type(e).__name__, e))
+            return
+        for r in results:
+            if r.outcome in (scanner.OPENED, scanner.ERROR):
+                print("Scan of {}: {} {}".format(r.device, r.outcome, r.message or ""))
+
+    async def _wait_for_next_tick(self):
+        #Sleeps until the next tick, unless a case waits on health and the cluster turns clean first
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.tick_interval
+        while not self._stop.is_set():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            waiting = any(_waits_on_health(c) for c in self.cases.values())
+            if waiting and self.health_stream is not None and self.health_stream.live:
+                if await self._wait_for_stream(remaining):
+                    return
+                continue
+            timeout = min(self.health_poll, remaining) if waiting else remaining
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout = timeout)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if waiting and await asyncio.to_thread(ClusterSnapshot.is_cluster_clean):
+                return
+
+    async def _wait_for_stream(self, timeout: float) -> bool:
+        #True if the stream woke us (clean) or we were stopped, False if it timed out or the stream went quiet
+        clean = asyncio.ensure_future(self.health_stream.wait_clean())
+        stop = asyncio.ensure_future(self._stop.wait())
+        done, pending = await asyncio.wait({clean, stop}, timeout = timeout, return_when = asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if stop in done:
+            return True
+        return clean in done and clean.result()
+
+    async def run(self, *, once: bool = False):
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stop.set)
+        stream_task = asyncio.create_task(self.health_stream.run()) if self.health_stream is not None else None
+
+        try:
+            while not self._stop.is_set():
+                #A bad tick (e.g. the OSD map couldn't be built) is retried on the next one
+                try:
+                    await self.tick()
+                except Exception as e:
+                    print("dlc daemon tick failed: {}: {}".format(type(e).__name__, e))
+                if once:
+                    break
+                await self._wait_for_next_tick()
+        finally:
+            if stream_task is not None:
+                #Lets the stream kill its command before the loop goes away
+                stream_task.cancel()
+                await asyncio.gather(stream_task, return_exceptions = True)
+
+
+def run(*, once: bool = False, health_stream = None, health_debounce: float = DEBOUNCE, **kwargs):
+    #health_stream: argv of a command printing health updates, a FIFO/recorded file, or "-" for stdin
+    stream = HealthStream(health_stream, debounce = health_debounce) if health_stream is not None else None
+    asyncio.run(Daemon(health_stream = stream, **kwargs).run(once = once))
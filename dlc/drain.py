@@ -0,0 +1,232 @@
+"""
+Admission control for OSD drains (cases leaving NEW_DETAIL):
+* DrainBudget caps what may drain at once across the cluster: OSDs, bytes to move,
+  OSDs per host, OSDs per failure domain and failure domains. Only the OSD caps are
+  on by default; the others need OSD usage from the cluster, read only when set.
+* plan() admits ready cases host by host, oldest case first. The admitted OSDs of a
+  host form one group: one stop / reweight / out pass and one recovery wait.
+* drain_ready() reserves the admitted cases (NEW_DETAIL, Action.reweighting_OSD) in one
+  transaction, so two dlc processes can't both spend the same budget, then drains each
+  group and only then moves its cases to RECOVERY_WAIT. A case whose drain was cut short
+  keeps its reservation and is drained again by the next run.
+* Cases over budget stay in NEW_DETAIL with WaitReason.drain_budget.
+Overrides for the budget are read from BUDGET_PATH (JSON, same keys as DrainBudget).
+"""
+import json
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from storage import db_transaction
+from records import iter_records
+from states import State, Action, WaitReason
+from errors import CommandError
+import metrics
+import runner
+
+BUDGET_PATH = Path.home() / ".dlc" / "drain.json"
+#Bucket type of the CRUSH failure domain. Hosts outside such a bucket are their own failure domain.
+DOMAIN_TYPE = "rack"
+DRAINING_STATES = (State.RECOVERY_WAIT.value, State.RECOVERY_DONE.value)
+
+
+@dataclass
+class DrainBudget:
+    max_osds: int = 8
+    max_bytes: Optional[int] = None
+    max_per_host: int = 4
+    max_per_domain: Optional[int] = None
+    #With replicas spread over failure domains, draining two at once can leave PGs with a single copy; set it to 1
+    #in BUDGET_PATH for that. Unset, as with max_bytes and max_per_domain, drains don't need `ceph osd df tree`.
+    max_domains: Optional[int] = None
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> "DrainBudget":
+        path = Path(path or BUDGET_PATH)
+        try:
+            overrides = json.loads(path.read_text())
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError) as e:
+            print("Ignoring drain budget in {}: {}".format(path, e))
+            return cls()
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in overrides.items() if k in known})
+
+    @property
+    def needs_usage(self) -> bool:
+        return self.max_bytes is not None or self.max_per_domain is not None or self.max_domains is not None
+
+
+class ClusterUsage:
+    #Data on each OSD (what a drain moves) and the failure domain of each host
+    def __init__(self, osd_bytes: Optional[dict] = None, domains: Optional[dict] = None):
+        self._osd_bytes = osd_bytes or {}
+        self._domains = domains or {}
+
+    def osd_bytes(self, osd_id) -> int:
+        return self._osd_bytes.get(osd_id, 0) if osd_id is not None else 0
+
+    def failure_domain(self, hostname: str) -> str:
+        return self._domains.get(hostname, hostname)
+
+    @classmethod
+    def from_osd_df_tree(cls, data: dict, domain_type: str = DOMAIN_TYPE) -> "ClusterUsage":
+        nodes = {n["id"]: n for n in data.get("nodes", [])}
+        osd_bytes = {n["id"]: int(n.get("kb_used", 0)) * 1024 for n in nodes.values() if n.get("type") == "osd"}
+        domains = {}
+        for bucket in nodes.values():
+            if bucket.get("type") != domain_type:
+                continue
+            for child in bucket.get("children", []):
+                host = nodes.get(child)
+                if host is not None and host.get("type") == "host":
+                    domains[host["name"]] = bucket["name"]
+        return cls(osd_bytes, domains)
+
+    @classmethod
+    def load(cls, domain_type: str = DOMAIN_TYPE) -> "ClusterUsage":
+        #Without usage, bytes count as 0 and every host is its own failure domain; the OSD counts still hold
+        try:
+            R = runner.run(["ceph", "osd", "df", "tree", "--format", "json"], timeout = 30, step = "osd_df_tree", check = True)
+            return cls.from_osd_df_tree(json.loads(R.stdout), domain_type)
+        except (CommandError, ValueError) as e:
+            print("Could not read OSD usage, drain budget only counts OSDs: {}".format(e))
+            return cls()
+
+
+@dataclass
+class Plan:
+    groups: List[list] = field(default_factory=list)
+    waiting: dict = field(default_factory=dict)
+
+    @property
+    def admitted(self) -> list:
+        return [case for group in self.groups for case in group]
+
+
+def draining(cluster: Optional[str]) -> list:
+    #Every case in the cluster whose OSD is reserved for a drain or out and still being drained, from any host
+    return list(iter_records(
+        "active = 1 AND cluster IS ? AND (state IN (?, ?) OR (state = ? AND action = ?))",
+        (cluster, *DRAINING_STATES, State.NEW_DETAIL.value, Action.reweighting_OSD.value)
+    ))
+
+
+def plan(ready: Iterable, draining: Iterable, budget: DrainBudget, usage: Optional[ClusterUsage] = None) -> Plan:
+    """
+    ready and draining: cases or records (case_id, hostname, osd_id). Pure function, no I/O.
+    Every ready case ends up either in one of plan.groups or in plan.waiting with the reason.
+    """
+    usage = usage or ClusterUsage()
+    draining = list(draining)
+    osds = len(draining)
+    moving = sum(usage.osd_bytes(c.osd_id) for c in draining)
+    per_host = Counter(c.hostname for c in draining)
+    per_domain = Counter(usage.failure_domain(c.hostname) for c in draining)
+
+    by_host = defaultdict(list)
+    for case in ready:
+        by_host[case.hostname].append(case)
+
+    result = Plan()
+    for hostname, cases in sorted(by_host.items(), key = lambda item: min(c.case_id for c in item[1])):
+        domain = usage.failure_domain(hostname)
+        group = []
+        for case in sorted(cases, key = lambda c: c.case_id):
+            size = usage.osd_bytes(case.osd_id)
+            reason = None
+            if osds >= budget.max_osds:
+                reason = f"{osds} OSDs are draining (max_osds {budget.max_osds})"
+            elif per_host[hostname] >= budget.max_per_host:
+                reason = f"{per_host[hostname]} OSDs on {hostname} are draining (max_per_host {budget.max_per_host})"
+            elif budget.max_per_domain is not None and per_domain[domain] >= budget.max_per_domain:
+                reason = f"{per_domain[domain]} OSDs in {domain} are draining (max_per_domain {budget.max_per_domain})"
+            elif budget.max_domains is not None and per_domain[domain] == 0 and len(+per_domain) >= budget.max_domains:
+                reason = f"{len(+per_domain)} failure domains are draining (max_domains {budget.max_domains})"
+            #An OSD bigger than the whole byte budget still drains, alone
+            elif budget.max_bytes is not None and moving + size > budget.max_bytes and osds > 0:
+                reason = f"{moving + size} bytes would be moving (max_bytes {budget.max_bytes})"
+            if reason is not None:
+                result.waiting[case.case_id] = reason
+                continue
+            group.append(case)
+            osds += 1
+            moving += size
+            per_host[hostname] += 1
+            per_domain[domain] += 1
+        if group:
+            result.groups.append(group)
+    return result
+
+
+def drain_ready(cases: Iterable, snapshot, *, budget: Optional[DrainBudget] = None, new_version: bool = True, op = None) -> Plan:
+    """
+    Admits what the budget allows out of `cases` (DlcCase objects in NEW_DETAIL that op
+    verified) and drains the admitted ones, one group per host.
+    The case objects are updated and saved in place. A case only reaches RECOVERY_WAIT once
+    its OSD is out, so a crash in between can't send an undrained OSD to remove_OSD.
+    """
+    from models import DlcCase
+
+    op = op or DlcCase.operation(snapshot)
+
+    cases = [c for c in cases if c.state == State.NEW_DETAIL]
+    if not cases:
+        return Plan()
+    budget = budget or DrainBudget.load()
+    usage = snapshot.usage if budget.needs_usage else None
+
+    #Reserved by a run that stopped before its drain finished: they already hold their share of the budget
+    #and are drained again (stop, reweight and out are idempotent)
+    resumed = [c for c in cases if c.action == Action.reweighting_OSD]
+    fresh = [c for c in cases if c.action != Action.reweighting_OSD]
+
+    #Reading what drains and reserving our share happen under one write lock
+    before = [(case, dict(vars(case))) for case in cases]
+    try:
+        with db_transaction():
+            result = plan(fresh, draining(cases[0].cluster), budget, usage)
+            for case in result.admitted:
+                case.action = Action.reweighting_OSD
+                case.wait_reason = None
+                case.save(new_version = new_version, snapshot = snapshot, op = op)
+            for case in cases:
+                reason = result.waiting.get(case.case_id)
+                #Saved once when the case starts waiting, not on every pass
+                if reason is not None and case.wait_reason != WaitReason.drain_budget:
+                    case.wait_reason = WaitReason.drain_budget
+                    case.save(new_version = new_version, snapshot = snapshot, op = op)
+    except BaseException:
+        #Nothing was saved, the objects must not claim otherwise
+        for case, attributes in before:
+            vars(case).clear()
+            vars(case).update(attributes)
+        raise
+
+    for case in resumed:
+        group = next((g for g in result.groups if g[0].hostname == case.hostname), None)
+        if group is None:
+            result.groups.append([case])
+        else:
+            group.append(case)
+
+    for group in result.groups:
+        metrics.count("drains", osds = len(group))
+        try:
+            DlcCase.drain_OSDs([case.osd_id for case in group])
+        except Exception as e:
+            print("Draining OSDs {} on {} failed: {}".format([c.osd_id for c in group], group[0].hostname, e))
+            #Left with Action.reweighting_OSD: the operator sees where it stopped, and it no longer counts as draining
+            for case in group:
+                case.state = State.OPERATOR_NEEDED
+                case.save(new_version = new_version, snapshot = snapshot, op = op)
+            continue
+        with db_transaction():
+            for case in group:
+                case.state = State.RECOVERY_WAIT
+                case.action = None
+                case.wait_reason = WaitReason.cluster_health
+                case.save(new_version = new_version, snapshot = snapshot, op = op)
+    return result
@@ -0,0 +1,375 @@
+"""
+Background disk tests for cases in DRIVE_TESTING:
+* submit() queues a job in DRIVE_TEST_TABLE, at most one unfinished job per case.
+* step() polls the running jobs and starts queued ones, at most MAX_PER_HOST per host
+  and MAX_PER_CONTROLLER per disk controller (HBA) at a time, so a batch of pulled
+  drives is tested side by side instead of one after the other.
+* Tests run detached from dlc (a SMART long self-test runs inside the drive, read
+  scans and fio run in their own session) and every job's state is in SQLite, so a
+  restarted dlc resumes polling instead of starting the test over.
+"""
+import json, os, re, signal, subprocess, time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from storage import db_cursor, db_transaction, DRIVE_TEST_TABLE
+import host_cache
+import metrics
+import runner
+import smart
+
+MAX_PER_HOST = 8
+MAX_PER_CONTROLLER = 4
+#A job still running after this long is given up on (and its process killed, if it has one)
+MAX_RUNTIME = 48 * 3600
+#A claimed job gets this long to record its handle; the runner's start() can take up to smart.SMART_TIMEOUT
+START_GRACE = smart.SMART_TIMEOUT + 60
+DEFAULT_KIND = "smart_long"
+LOG_DIR = Path.home() / ".dlc" / "drive-tests"
+SYS_BLOCK = "/sys/block"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+_PCI_ADDRESS = re.compile(r"^[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-9a-f]$")
+
+
+class DriveTestError(Exception):
+    pass
+
+
+@dataclass
+class DriveTest:
+    job_id: int
+    case_id: int
+    hostname: str
+    device: str
+    controller: str
+    kind: str
+    status: str
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: Optional[float] = None
+    passed: Optional[bool] = None
+    #What the runner needs to poll the test; None until it has been started
+    handle: Optional[dict] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, ERROR)
+
+    @classmethod
+    def from_row(cls, row) -> "DriveTest":
+        data = dict(row)
+        data["passed"] = None if data["passed"] is None else bool(data["passed"])
+        data["handle"] = json.loads(data["handle"]) if data["handle"] is not None else None
+        data["result"] = json.loads(data["result"]) if data["result"] else None
+        return cls(**data)
+
+
+@dataclass
+class Poll:
+    done: bool
+    progress: Optional[float] = None
+    passed: Optional[bool] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+
+def controller_of(device: str) -> str:
+    #The last PCI address on the device's sysfs path is the HBA (or the NVMe drive itself)
+    name = os.path.basename(smart.device_path(device))
+    path = os.path.realpath(os.path.join(SYS_BLOCK, name))
+    addresses = [part for part in path.split("/") if _PCI_ADDRESS.match(part)]
+    return addresses[-1] if addresses else "unknown"
+
+
+# ---------- runners ----------
+class SmartSelfTest:
+    #smartctl -t long: the drive runs the test itself, we only ask how far it got
+    def start(self, job: DriveTest) -> dict:
+        R = runner.run([smart.SMARTCTL, "-t", "long", smart.device_path(job.device)], timeout = smart.SMART_TIMEOUT, step = "smart_self_test")
+        if R.error is not None or R.timed_out:
+            raise DriveTestError(f"Could not start the SMART self-test: {R.describe()}")
+        if R.returncode & (smart.CMDLINE_ERROR | smart.DEVICE_OPEN_FAILED | smart.SMART_COMMAND_FAILED):
+            raise DriveTestError(f"smartctl -t long failed with exit status {R.returncode}: {R.stdout.strip()[-200:]}")
+        return {}
+
+    def poll(self, job: DriveTest) -> Poll:
+        result = smart.run_smartctl(job.device)
+        if result.error:
+            #Not fatal, the drive may just be busy; the next step asks again
+            return Poll(done = False, error = result.error)
+        data = result.data or {}
+
+        status = data.get("ata_smart_data", {}).get("self_test", {}).get("status")
+        if status is not None:
+            if "remaining_percent" in status:
+                return Poll(done = False, progress = 100 - status["remaining_percent"])
+            return Poll(done = True, progress = 100, passed = status.get("passed"), result = status)
+
+        nvme = data.get("nvme_self_test_log")
+        if nvme is not None:
+            if (nvme.get("current_self_test_operation") or {}).get("value"):
+                return Poll(done = False, progress = nvme.get("current_self_test_completion_percent"))
+            entries = nvme.get("table") or []
+            last = entries[0] if entries else {}
+            code = (last.get("self_test_result") or {}).get("value")
+            return Poll(done = True, progress = 100, passed = code == 0 if code is not None else None, result = last)
+
+        return Poll(done = True, error = "smartctl doesn't report self-test progress for this device")
+
+
+class CommandTest:
+    """
+    Runs argv (with {device} filled in) in its own session. The exit status is written
+    next to the log when it finishes, so any later dlc process can pick up the result.
+    """
+    _WRAPPER = 'rc="$1"; shift; "$@"; echo $? > "$rc.tmp" && mv "$rc.tmp" "$rc"'
+
+    def __init__(self, argv: List[str]):
+        self.argv = list(argv)
+
+    def start(self, job: DriveTest) -> dict:
+        LOG_DIR.mkdir(parents = True, exist_ok = True)
+        log = LOG_DIR / f"{job.job_id}.log"
+        rc = LOG_DIR / f"{job.job_id}.rc"
+        argv = [arg.format(device = smart.device_path(job.device)) for arg in self.argv]
+        try:
+            with open(log, "wb") as out:
+                proc = subprocess.Popen(["sh", "-c", self._WRAPPER, "sh", str(rc), *argv], stdin = subprocess.DEVNULL,
+                        stdout = out, stderr = subprocess.STDOUT, start_new_session = True)
+        except OSError as e:
+            raise DriveTestError(f"Could not start {argv[0]}: {e}")
+        return {"pid": proc.pid, "log": str(log), "rc": str(rc), "boot_id": host_cache.boot_id()}
+
+    @staticmethod
+    def _tail(path: str, size: int = 2000) -> str:
+        try:
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - size))
+                return f.read().decode(errors = "replace")
+        except OSError:
+            return ""
+
+    def poll(self, job: DriveTest) -> Poll:
+        handle = job.handle
+        try:
+            exit_status = int(Path(handle["rc"]).read_text())
+        except FileNotFoundError:
+            exit_status = None
+        if exit_status is not None:
+            return Poll(done = True, progress = 100, passed = exit_status == 0,
+                    result = {"exit_status": exit_status, "output": self._tail(handle["log"])})
+
+        if handle.get("boot_id") and handle["boot_id"] != host_cache.boot_id():
+            return Poll(done = True, error = "the host rebooted while the test was running")
+        try:
+            #If this process started it, reap it so a dead test doesn't look alive as a zombie
+            os.waitpid(handle["pid"], os.WNOHANG)
+        except ChildProcessError:
+            pass
+        try:
+            os.kill(handle["pid"], 0)
+        except ProcessLookupError:
+            return Poll(done = True, error = "the test process went away without an exit status")
+        return Poll(done = False)
+
+    def cancel(self, job: DriveTest):
+        try:
+            os.killpg(job.handle["pid"], signal.SIGTERM)
+        except (KeyError, ProcessLookupError, PermissionError):
+            pass
+
+
+RUNNERS = {
+    "smart_long": SmartSelfTest(),
+    "read_scan": CommandTest(["dd", "if={device}", "of=/dev/null", "bs=4M", "iflag=direct", "status=none"]),
+    "fio": CommandTest(["fio", "--name=dlc-verify", "--filename={device}", "--readonly", "--rw=randread", "--bs=128k",
+            "--direct=1", "--ioengine=libaio", "--iodepth=16", "--time_based", "--runtime=3600"]),
+}
+
+
+# ---------- jobs ----------
+def submit(case_id: int, hostname: str, device: str, *, kind: str = DEFAULT_KIND, controller: Optional[str] = None) -> DriveTest:
+    if kind not in RUNNERS:
+        raise ValueError(f"kind must be one of {sorted(RUNNERS)}")
+    controller = controller or controller_of(device)
+    with db_transaction() as cur:
+        cur.execute(
+            f"""
+                INSERT INTO {DRIVE_TEST_TABLE} (case_id, hostname, device, controller, kind, status, submitted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (case_id, hostname, device, controller, kind, QUEUED, time.time())
+        )
+        job_id = cur.lastrowid
+    metrics.count("drive_tests", kind = kind, status = QUEUED)
+    return get(job_id)
+
+
+def get(job_id: int) -> DriveTest:
+    with db_cursor() as cur:
+        row = cur.execute(f"SELECT * FROM {DRIVE_TEST_TABLE} WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        raise ValueError("Drive test not found")
+    return DriveTest.from_row(row)
+
+
+#since: only jobs submitted at or after this time, e.g. since the case (re)entered DRIVE_TESTING
+def latest(case_id: int, *, since: Optional[float] = None) -> Optional[DriveTest]:
+    with db_cursor() as cur:
+        row = cur.execute(
+            f"SELECT * FROM {DRIVE_TEST_TABLE} WHERE case_id = ? AND submitted_at >= ? ORDER BY job_id DESC LIMIT 1",
+            (case_id, since if since is not None else 0),
+        ).fetchone()
+    return DriveTest.from_row(row) if row is not None else None
+
+
+def jobs(*, hostname: Optional[str] = None, case_id: Optional[int] = None, unfinished: bool = False) -> List[DriveTest]:
+    where, params = [], []
+    if hostname is not None:
+        where.append("hostname = ?")
+        params.append(hostname)
+    if case_id is not None:
+        where.append("case_id = ?")
+        params.append(case_id)
+    if unfinished:
+        where.append(f"status IN ('{QUEUED}', '{RUNNING}')")
+    sql = f"SELECT * FROM {DRIVE_TEST_TABLE}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with db_cursor() as cur:
+        rows = cur.execute(sql + " ORDER BY job_id", params).fetchall()
+    return [DriveTest.from_row(row) for row in rows]
+
+
+def abandon(case_id: int, reason: str) -> List[DriveTest]:
+    #Ends the case's unfinished jobs (killing their process, if they have one) so a new one can be submitted
+    abandoned = jobs(case_id = case_id, unfinished = True)
+    for job in abandoned:
+        runner = RUNNERS.get(job.kind)
+        if job.status == RUNNING and job.handle is not None and hasattr(runner, "cancel"):
+            runner.cancel(job)
+        #Whatever it has become meanwhile (claimed, started), it is no longer wanted
+        _finish(job, ERROR, reason, expect = (QUEUED, RUNNING))
+    return abandoned
+
+
+def _claim(job: DriveTest) -> bool:
+    #Another dlc process on the host (cron and the daemon) may be stepping the same queue
+    with db_transaction() as cur:
+        cur.execute(
+            f"UPDATE {DRIVE_TEST_TABLE} SET status = ?, started_at = ? WHERE job_id = ? AND status = ?",
+            (RUNNING, time.time(), job.job_id, QUEUED),
+        )
+        return cur.rowcount == 1
+
+
+def _update(job: DriveTest, *, expect = (RUNNING,), starting: bool = False) -> bool:
+    #Compare-and-swap: only written if the row is still in one of the `expect` statuses (and, when starting,
+    #has no handle yet), so a job another dlc process finished meanwhile isn't brought back. On a miss the
+    #object is reloaded with what that process wrote.
+    with db_transaction() as cur:
+        cur.execute(
+            f"""
+                UPDATE {DRIVE_TEST_TABLE}
+                SET status = ?, started_at = ?, finished_at = ?, progress = ?, passed = ?, handle = ?, result = ?, error = ?
+                WHERE job_id = ? AND status IN ({", ".join("?" * len(expect))}){" AND handle IS NULL" if starting else ""}
+            """, (
+                job.status, job.started_at, job.finished_at, job.progress, job.passed,
+                json.dumps(job.handle) if job.handle is not None else None, json.dumps(job.result) if job.result is not None else None, job.error, job.job_id,
+                *expect,
+            )
+        )
+        updated = cur.rowcount == 1
+    if not updated:
+        vars(job).update(vars(get(job.job_id)))
+    return updated
+
+
+def _finish(job: DriveTest, status: str, error: Optional[str] = None, **expected) -> bool:
+    job.status = status
+    job.finished_at = time.time()
+    job.error = error
+    if not _update(job, **expected):
+        return False
+    metrics.count("drive_tests", kind = job.kind, status = status if status == ERROR else ("passed" if job.passed else "failed"))
+    return True
+
+
+def _poll(job: DriveTest, runner):
+    if job.handle is None:
+        #Claimed and still starting in another dlc process, or that process stopped before the runner's
+        #handle was saved: then there is nothing to poll, and nothing says whether the test ever started
+        if job.started_at is not None and time.time() - job.started_at < START_GRACE:
+            return
+        _finish(job, ERROR, "the test was claimed but never recorded as started", starting = True)
+        return
+    if job.started_at is not None and time.time() - job.started_at > MAX_RUNTIME:
+        if hasattr(runner, "cancel"):
+            runner.cancel(job)
+        _finish(job, ERROR, f"did not finish within {MAX_RUNTIME}s")
+        return
+    try:
+        with metrics.span("drive_test_poll", kind = job.kind):
+            poll = runner.poll(job)
+    except Exception as e:
+        print("Polling drive test {} on {} failed, will try again: {}".format(job.job_id, job.device, e))
+        return
+    if poll.progress is not None:
+        job.progress = poll.progress
+    if not poll.done:
+        _update(job)
+        return
+    job.passed = poll.passed
+    job.result = poll.result
+    _finish(job, ERROR if poll.error else DONE, poll.error)
+
+
+def step(hostname: str, *, runners: Optional[dict] = None, max_per_host: int = MAX_PER_HOST,
+        max_per_controller: int = MAX_PER_CONTROLLER) -> List[DriveTest]:
+    """
+    Polls this host's running jobs, then starts queued ones (oldest first) while the caps allow.
+    Never waits for a test. Returns the host's unfinished jobs and the ones that finished in this step.
+    """
+    runners = runners or RUNNERS
+    pending = jobs(hostname = hostname, unfinished = True)
+
+    for job in pending:
+        if job.status == RUNNING:
+            _poll(job, runners[job.kind])
+
+    running = [job for job in pending if job.status == RUNNING]
+    per_controller = Counter(job.controller for job in running)
+    for job in pending:
+        if job.status != QUEUED:
+            continue
+        if len(running) >= max_per_host:
+            break
+        if per_controller[job.controller] >= max_per_controller:
+            continue
+        if not _claim(job):
+            continue
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            handle = job.handle = runners[job.kind].start(job)
+        except Exception as e:
+            _finish(job, ERROR, str(e), starting = True)
+            continue
+        if not _update(job, starting = True):
+            #Abandoned or given up on while it was starting: the test we just started isn't wanted
+            if hasattr(runners[job.kind], "cancel"):
+                runners[job.kind].cancel(DriveTest(**{**vars(job), "handle": handle}))
+            continue
+        running.append(job)
+        per_controller[job.controller] += 1
+    return pending
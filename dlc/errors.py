@@ -0,0 +1,24 @@
+"""
+Exceptions raised while working on a case. No ceph-util imports.
+"""
+
+class CaseError(Exception):
+    #Raised when a case can't be moved forward. The CLI turns this into exit(1), a sweep records it and moves on to the next case.
+    pass
+
+class InvalidTransitionError(CaseError):
+    pass
+
+class ConcurrentUpdateError(CaseError):
+    #Raised by save() when another process saved the case after we loaded it. Reload the case and try again.
+    pass
+
+class CaseWaiting(Exception):
+    #Raised by progress() when the case has to wait on something outside dlc (e.g. cluster recovery). Not an error.
+    pass
+
+class CommandError(Exception):
+    #Raised by runner.run(check=True) when a command failed, timed out or couldn't be started. .result has the details.
+    def __init__(self, result):
+        super().__init__(result.describe())
+        self.result = result
@@ -0,0 +1,183 @@
+"""
+Cluster health pushed to the daemon instead of polled from the monitors:
+* Reads a stream of `ceph status --format json` documents (one per line) or plain
+  `ceph -w` log lines from a command, a FIFO, stdin or a recorded file.
+* Keeps the last known state (clean / not clean / unknown).
+* wait_clean() returns once the stream has stayed clean for `debounce` seconds, so
+  a cluster flapping between clean and degraded doesn't wake the waiting cases.
+A command that exits (mon failover, ssh drop) is restarted; until it reports again
+the state is unknown and the daemon goes back to polling.
+"""
+import asyncio, json, os, stat, sys, time
+from typing import Optional, Sequence, Union
+
+import metrics
+
+DEBOUNCE = 10
+RESTART_DELAY = 5
+
+#Plain `ceph -w` lines that tell us the health changed
+_CLEAN_MARKERS = ("HEALTH_OK", "Cluster is now healthy")
+_UNCLEAN_MARKERS = ("HEALTH_WARN", "HEALTH_ERR", "Health check failed", "Health check update")
+
+
+def _status_is_clean(status: dict) -> Optional[bool]:
+    #Same question as CephState.is_clean(): are all PGs active+clean. Health is the fallback if there is no pgmap.
+    pgmap = status.get("pgmap") or {}
+    by_state = pgmap.get("pgs_by_state")
+    if by_state is not None:
+        clean = sum(s.get("count", 0) for s in by_state if s.get("state_name") == "active+clean")
+        total = pgmap.get("num_pgs", sum(s.get("count", 0) for s in by_state))
+        return clean == total
+    health = (status.get("health") or {}).get("status")
+    if health:
+        return health == "HEALTH_OK"
+    return None
+
+
+def parse_line(line: str) -> Optional[bool]:
+    #True/False if the line says something about cluster health, None if it doesn't
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        try:
+            status = json.loads(line)
+        except ValueError:
+            return None
+        return _status_is_clean(status) if isinstance(status, dict) else None
+    if any(m in line for m in _UNCLEAN_MARKERS):
+        return False
+    if any(m in line for m in _CLEAN_MARKERS):
+        return True
+    return None
+
+
+class HealthStream:
+    def __init__(self, source: Union[str, Sequence[str]], *, debounce: float = DEBOUNCE, restart_delay: float = RESTART_DELAY):
+        #source: an argv list to run, a path (FIFO or recorded file), or "-" for stdin
+        self.source = source
+        self.debounce = debounce
+        self.restart_delay = restart_delay
+        self.clean: Optional[bool] = None
+        self.clean_since: Optional[float] = None
+        self.closed = False
+        self.transitions = 0
+        self._woken_for: Optional[float] = None
+        #Created by the first waiter: on Python 3.9 an Event is bound to the loop current when it is made,
+        #and daemon.run() builds the stream before asyncio.run() starts the loop it waits in
+        self._changed: Optional[asyncio.Event] = None
+
+    # ---------- state ----------
+    def _event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _notify(self):
+        #Wakes everyone waiting on the current event; later waiters get a fresh one
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def observe(self, clean: Optional[bool]):
+        if clean is None or clean == self.clean:
+            return
+        self.clean = clean
+        self.clean_since = time.monotonic() if clean else None
+        self.transitions += 1
+        metrics.count("health_stream_transitions", to = "clean" if clean else "unclean")
+        self._notify()
+
+    def feed(self, line: str):
+        self.observe(parse_line(line))
+
+    def _lost(self):
+        #Nothing reliable to say until the source reports again
+        if self.clean is not None:
+            self.clean = None
+            self.clean_since = None
+            self._notify()
+
+    @property
+    def live(self) -> bool:
+        return not self.closed and self.clean is not None
+
+    async def wait_clean(self) -> bool:
+        """
+        True once the stream has been clean for `debounce` seconds. Each clean period wakes
+        the caller once; after that only a new transition to clean does.
+        False if the stream ended or lost its state, the caller has to poll then.
+        """
+        while True:
+            if self.closed or self.clean is None:
+                return False
+            changed = self._event()
+            if self.clean:
+                remaining = self.debounce - (time.monotonic() - self.clean_since)
+                if remaining <= 0 and self._woken_for != self.clean_since:
+                    self._woken_for = self.clean_since
+                    metrics.count("health_stream_wakeups")
+                    return True
+                if remaining <= 0:
+                    await changed.wait()
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout = remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await changed.wait()
+
+    # ---------- reading ----------
+    async def _read_command(self):
+        proc = await asyncio.create_subprocess_exec(*self.source, stdout = asyncio.subprocess.PIPE,
+                stderr = asyncio.subprocess.DEVNULL)
+        try:
+            async for line in proc.stdout:
+                self.feed(line.decode(errors = "replace"))
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+
+    async def _read_file(self, f):
+        if stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+            #A recorded stream: regular files can't be watched by the event loop, but a read never blocks for long
+            while line := await asyncio.to_thread(f.readline):
+                self.feed(line.decode(errors = "replace"))
+            return
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), f)
+        try:
+            async for line in reader:
+                self.feed(line.decode(errors = "replace"))
+        finally:
+            transport.close()
+
+    async def run(self):
+        try:
+            if isinstance(self.source, str):
+                if self.source == "-":
+                    await self._read_file(sys.stdin.buffer)
+                    return
+                flags = os.O_RDONLY
+                if stat.S_ISFIFO(os.stat(self.source).st_mode):
+                    #Opened read-write so the open doesn't block until a writer shows up, and a writer
+                    #going away (the feeding loop restarting) isn't the end of the stream
+                    flags = os.O_RDWR
+                with os.fdopen(os.open(self.source, flags), "rb") as f:
+                    await self._read_file(f)
+                return
+            while True:
+                try:
+                    await self._read_command()
+                except OSError as e:
+                    print("Health stream {} failed: {}".format(" ".join(self.source), e))
+                self._lost()
+                metrics.count("health_stream_restarts")
+                await asyncio.sleep(self.restart_delay)
+        finally:
+            self.closed = True
+            self._notify()
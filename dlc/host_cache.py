@@ -0,0 +1,81 @@
+"""
+Host identity (hostname, dmidecode system serial) cached for the current boot:
+* Kept in ~/.dlc/host-<hostname>.json together with /proc/sys/kernel/random/boot_id.
+* A reboot changes the boot id, so the next dlc process re-reads HWInv and dmidecode.
+* Shared by every dlc process on the node; written atomically.
+"""
+import json, os, socket, tempfile
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Optional
+
+import metrics
+
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+_CACHE_PATH = Path.home() / ".dlc" / f"host-{socket.gethostname()}.json"
+
+
+@dataclass
+class HostIdentity:
+    hostname: str
+    serial: Optional[str]
+    boot_id: Optional[str] = None
+
+
+def boot_id() -> Optional[str]:
+    try:
+        with open(BOOT_ID_PATH) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _read(current_boot_id: str) -> Optional[HostIdentity]:
+    try:
+        data = json.loads(_CACHE_PATH.read_text())
+        identity = HostIdentity(**data)
+    except (OSError, ValueError, TypeError):
+        return None
+    return identity if identity.boot_id == current_boot_id else None
+
+
+def _write(identity: HostIdentity):
+    _CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir = _CACHE_PATH.parent, prefix = _CACHE_PATH.name, suffix = ".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(asdict(identity), f)
+        os.replace(tmp, _CACHE_PATH)
+    except OSError as e:
+        print("Could not cache the host inventory, continuing without it: {}".format(e))
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
+
+def load(hw = None, *, refresh: bool = False) -> HostIdentity:
+    """
+    The cached identity if it was recorded during this boot, otherwise a fresh one from
+    `hw` (or a new hwinv.HWInv()), which is then cached. Without a boot id nothing is cached.
+    """
+    current_boot_id = boot_id()
+    if current_boot_id and not refresh:
+        cached = _read(current_boot_id)
+        if cached is not None:
+            metrics.count("host_cache", result = "hit")
+            return cached
+    metrics.count("host_cache", result = "refresh" if refresh else "miss")
+
+    if hw is None:
+        #ceph-util import
+        import hwinv
+        with metrics.span("hwinv"):
+            hw = hwinv.HWInv()
+    with metrics.span("dmidecode"):
+        serial = hw.dmidecode().sysinfo['system']['serial']
+
+    identity = HostIdentity(hostname = hw.hostname, serial = serial, boot_id = current_boot_id)
+    if current_boot_id:
+        _write(identity)
+    return identity
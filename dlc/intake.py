@@ -0,0 +1,113 @@
+"""
+Bulk case intake (`dlc import`):
+* Reads case specs (hostname, block_dev, osd_id) from JSON lines or CSV.
+* Reads and validates every spec before taking the write lock, so a slow stdin
+  doesn't hold up other dlc writers.
+* Resolves every spec against one ClusterSnapshot and one Operation (the cluster
+  name is read once, not per row).
+* Inserts them in one transaction; each row runs in its own savepoint, so a row
+  that hits uq_active_hostdev / uq_active_osdcluster is reported and the rest
+  of the batch still goes in.
+"""
+import csv, json, sqlite3
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, TextIO
+
+from models import DlcCase, State
+from snapshot import ClusterSnapshot
+from storage import db_transaction
+
+CREATED = "created"
+CONFLICT = "conflict"
+INVALID = "invalid"
+
+SPEC_FIELDS = ("hostname", "block_dev", "osd_id")
+
+
+@dataclass
+class ImportResult:
+    line: int
+    outcome: str
+    case_id: Optional[int] = None
+    hostname: Optional[str] = None
+    block_dev: Optional[str] = None
+    osd_id: Optional[int] = None
+    message: Optional[str] = None
+
+
+def case_kwargs(spec: dict) -> dict:
+    #Same rules as `dlc new`: /dev/ is stripped from block devices, missing fields are left to DlcCase's defaults
+    kwargs = {"state": State["NEW"]}
+    for key in SPEC_FIELDS:
+        value = spec.get(key)
+        if value is None or value == "":
+            continue
+        if key == "block_dev" and str(value).startswith('/dev/'):
+            value = str(value)[5:]
+        if key == "osd_id":
+            value = int(value)
+        kwargs[key] = value
+    return kwargs
+
+
+def read_specs(f: TextIO, fmt: str = "jsonl") -> Iterator[tuple]:
+    #Yields (line number, spec dict or the exception that made the line unreadable)
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for spec in reader:
+            yield reader.line_num, spec
+        return
+
+    for line_num, line in enumerate(f, start=1):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        try:
+            spec = json.loads(line)
+            if not isinstance(spec, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield line_num, e
+            continue
+        yield line_num, spec
+
+
+def import_cases(specs: Iterable[tuple], snapshot: Optional[ClusterSnapshot] = None) -> list:
+    if snapshot is None:
+        snapshot = ClusterSnapshot.load()
+
+    #Every line is read (specs may be a generator over stdin) and checked before the write lock is taken
+    rows = []
+    for line_num, spec in list(specs):
+        if isinstance(spec, Exception):
+            rows.append(ImportResult(line_num, INVALID, message = str(spec)))
+            continue
+        try:
+            rows.append((line_num, DlcCase(**case_kwargs(spec))))
+        except (ValueError, TypeError) as e:
+            rows.append(ImportResult(line_num, INVALID, message = str(e)))
+
+    op = DlcCase.operation(snapshot)
+    results = []
+    with db_transaction():
+        for row in rows:
+            if isinstance(row, ImportResult):
+                results.append(row)
+                continue
+            line_num, case = row
+            result = ImportResult(line_num, INVALID, hostname = case.hostname, block_dev = case.block_dev, osd_id = case.osd_id)
+            try:
+                #Savepoint: a failing row is undone on its own, the outer transaction keeps going
+                with db_transaction():
+                    saved = case.save(snapshot = snapshot, op = op)
+            except sqlite3.IntegrityError as e:
+                result.outcome, result.message = CONFLICT, str(e)
+            except Exception as e:
+                result.message = f"{type(e).__name__}: {e}"
+            else:
+                if saved:
+                    result.outcome, result.case_id = CREATED, saved.case_id
+                    result.hostname, result.block_dev, result.osd_id = saved.hostname, saved.block_dev, saved.osd_id
+                else:
+                    result.message = "No matching OSD in the OSD map"
+            results.append(result)
+    return results
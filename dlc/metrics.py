@@ -0,0 +1,169 @@
+"""
+Timing and counters for everything dlc waits on:
+* span("name") times a block (OSD map build, smartctl, subprocesses, SQLite, ...)
+  and counts its failures.
+* count("name", **labels) for events such as state transitions.
+* configure(json_log=...) appends one JSON line per span as it finishes.
+* flush() adds this process's numbers to the totals in METRICS_STATE (shared by
+  every dlc process on the node, under a file lock) and optionally renders them
+  as a Prometheus textfile-collector file. A process that recorded nothing leaves
+  the files alone.
+"""
+import fcntl, json, os, tempfile, threading, time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Optional
+
+METRICS_STATE = Path.home() / ".dlc" / "metrics.json"
+PREFIX = "dlc"
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+_json_log: Optional[Path] = None
+
+
+def configure(*, json_log=None):
+    global _json_log
+    _json_log = Path(json_log) if json_log else None
+
+
+def _key(name: str, labels: dict) -> str:
+    #Stored as one string so the totals survive a round trip through JSON
+    return json.dumps([name, sorted(labels.items())])
+
+
+def _log(entry: dict):
+    if _json_log is None:
+        return
+    line = json.dumps(entry, default=str) + "\n"
+    with _lock, open(_json_log, "a") as f:
+        f.write(line)
+
+
+@contextmanager
+def span(name: str, **labels):
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        key = _key(name, labels)
+        with _lock:
+            s = _spans.setdefault(key, {"count": 0, "errors": 0, "seconds": 0.0, "max": 0.0})
+            s["count"] += 1
+            s["errors"] += error is not None
+            s["seconds"] += seconds
+            s["max"] = max(s["max"], seconds)
+        _log({"ts": time.time(), "span": name, "seconds": round(seconds, 6), "error": error, "pid": os.getpid(), **labels})
+
+
+def timed(name: str):
+    #Decorator form of span()
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _log({"ts": time.time(), "counter": name, "value": value, "pid": os.getpid(), **labels})
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {"spans": {k: dict(v) for k, v in _spans.items()}, "counters": dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def _merge(totals: dict, current: dict):
+    for key, s in current["spans"].items():
+        t = totals["spans"].setdefault(key, {"count": 0, "errors": 0, "seconds": 0.0, "max": 0.0})
+        for field in ("count", "errors", "seconds"):
+            t[field] += s[field]
+        t["max"] = max(t["max"], s["max"])
+    for key, value in current["counters"].items():
+        totals["counters"][key] = totals["counters"].get(key, 0) + value
+
+
+def format_labels(pairs) -> str:
+    #{k="v",...} with Prometheus escaping, "" for no labels
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render_prometheus(totals: dict) -> str:
+    lines = []
+    span_metrics = [
+        ("span_calls_total", "counter", "count", "Calls of each timed operation"),
+        ("span_errors_total", "counter", "errors", "Calls that raised"),
+        ("span_seconds_total", "counter", "seconds", "Total seconds spent in each timed operation"),
+        ("span_seconds_max", "gauge", "max", "Slowest single call seen"),
+    ]
+    for metric, kind, field, help_text in span_metrics:
+        lines.append(f"# HELP {PREFIX}_{metric} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{metric} {kind}")
+        for key, s in sorted(totals["spans"].items()):
+            name, labels = json.loads(key)
+            lines.append(f"{PREFIX}_{metric}{format_labels([('span', name)] + labels)} {s[field]}")
+
+    names = sorted({json.loads(key)[0] for key in totals["counters"]})
+    for name in names:
+        lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+        for key, value in sorted(totals["counters"].items()):
+            counter, labels = json.loads(key)
+            if counter == name:
+                lines.append(f"{PREFIX}_{name}_total{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _atomic_write(path: Path, text: str):
+    #The textfile collector may read at any moment, it must never see half a file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def flush(prometheus_textfile=None, *, state_path: Optional[Path] = None) -> Optional[dict]:
+    """Adds this process's metrics to the node-wide totals, writes the textfile if asked, and resets."""
+    current = snapshot()
+    #Nothing to add and no textfile to render: no lock, no read, no rewrite
+    if not current["spans"] and not current["counters"] and not prometheus_textfile:
+        return None
+    state_path = Path(state_path or METRICS_STATE)
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(state_path.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            totals = json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            totals = {"spans": {}, "counters": {}}
+        _merge(totals, current)
+        _atomic_write(state_path, json.dumps(totals))
+        if prometheus_textfile:
+            _atomic_write(Path(prometheus_textfile), render_prometheus(totals))
+
+    reset()
+    return totals
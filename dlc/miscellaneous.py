@@ -1,13 +1,26 @@
-from storage import db_cursor
+from storage import db_transaction
 
 TABLE_NAME = "testing_table"
 HISTORY_TABLE = "history_testing_table"
 
-def save_case_history(case_id):
-    with db_cursor() as cur:
+#Spelled out so the copy doesn't depend on both tables having their columns in the same order
+CASE_COLUMNS = ", ".join([
+    "case_id", "hostname", "host_serial", "smart_passed", "test_passed", "state", "block_dev", "osd_id", "cluster",
+    "crush_weight", "mount", "action", "wait_reason", "active", "version", "updated_at",
+])
+
+#Joins the caller's transaction if there is one, so the copy and the UPDATE that follows commit together.
+#With a version only that version of the row is copied; returns the number of rows copied (0 means it changed).
+def save_case_history(case_id, version=None):
+    where, params = "case_id = ?", [case_id]
+    if version is not None:
+        where += " AND version = ?"
+        params.append(version)
+    with db_transaction() as cur:
         cur.execute(
             f"""
-                INSERT INTO {HISTORY_TABLE}
-                SELECT * FROM {TABLE_NAME} WHERE case_id = ?;
-            """, (case_id,)
+                INSERT INTO {HISTORY_TABLE} ({CASE_COLUMNS})
+                SELECT {CASE_COLUMNS} FROM {TABLE_NAME} WHERE {where};
+            """, params
         )
+        return cur.rowcount
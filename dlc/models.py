@@ -1,53 +1,20 @@
 from dataclasses import dataclass, asdict, field
-from enum import Enum
 from typing import Optional
-import sys
-import json
-import subprocess
-from storage import db_cursor
-#ceph-util import
-import ceph_common as cc
-#ceph-util import
-import ceph_admin as cadmin
-import hwinv
+import time
+from storage import db_cursor, db_transaction, HISTORY_TABLE
 from miscellaneous import save_case_history
-import sqlite3
+from snapshot import ClusterSnapshot
+from operation import Operation
+#Defined in their own modules so the CLI can use them without importing ceph-util, re-exported here
+from states import State, Action, WaitReason
+from errors import CaseError, InvalidTransitionError, CaseWaiting, ConcurrentUpdateError, CommandError
+import runner
+import smart
+import smart_trends
+import metrics
 
 TABLE_NAME = "testing_table"
-
-class State(str, Enum):
-    #OSD failure -> Log failure into database -> start resolution 'Change OSD/disk attributes' (CRUSH weight, etc.) -> wait ceph health (totally clean) -> re-check OSD/disk attributes (OSD reweighted, disk not missing, etc.) -> remove OSD (osd-remove --replace) -> check failure type (IO error?) -> check smartctl -> test disk? -> test results...
-    #There should be a case state plus an action for any one point in time.
-
-    NEW = "NEW" 
-    NEW_DETAIL = "NEW-DETAILS"
-    RECOVERY_WAIT = "RECOVERY-WAIT"
-    RECOVERY_DONE = "RECOVERY-DONE"
-    OSD_REMOVED = "OSD-REMOVED"
-    DRIVE_TESTING = "DRIVE-TESTING"
-    TEST_DONE = "TEST-DONE"
-    REPLACE_DRIVE = "REPLACE-DRIVE"
-    WAIT_FOR_REPLACE = "WAIT-FOR_REPLACE"
-    REBUILD_OSD = "REBUILD-OSD"
-    RESOLVED = "RESOLVED"
-    OPERATOR_NEEDED = "OPERATOR-NEEDED"
-
-class Action(str, Enum):
-    logging = "Logging info"
-    testing_disk = "Testing disk"
-    checking_info = "Checking for information"
-    checking_smart = "Checking SMART Health"
-    editing_OSD = "Editing OSD"
-    operator_handoff = "Handing to operator"
-    removing_OSD = "Removing OSD"
-    reweighting_OSD = "Reweighting OSD"
-    none = None
-
-class WaitReason(str, Enum):
-    cluster_health = "Waiting for 'HEALTH_OK'"
-    disk_test_completion = "Waiting for disk test to finish"
-    disk_replacement_completion = "Waiting for disk replacement"
-    none = None
+CEPH_CLUSTER_FILE = '/etc/ceph/ceph_cluster'
 
 def _validate_positive_int(value: int, name: str):
     if not isinstance(value, int) or value < 0:
@@ -56,6 +23,21 @@ def _validate_positive_int(value: int, name: str):
 
 #@dataclass
 class DlcCase:
+    #Dict for valid transitions. Shared by every case, nothing may modify it.
+    valid_transitions = {
+            State.NEW: {State.NEW_DETAIL, State.OPERATOR_NEEDED},
+            State.NEW_DETAIL: {State.RECOVERY_WAIT, State.OPERATOR_NEEDED},
+            State.RECOVERY_WAIT: {State.RECOVERY_DONE, State.OPERATOR_NEEDED},
+            State.RECOVERY_DONE: {State.OSD_REMOVED, State.OPERATOR_NEEDED},
+            State.OSD_REMOVED: {State.DRIVE_TESTING, State.REPLACE_DRIVE, State.OPERATOR_NEEDED},
+            State.REPLACE_DRIVE: {State.WAIT_FOR_REPLACE,  State.OPERATOR_NEEDED},
+            State.WAIT_FOR_REPLACE: {State.REBUILD_OSD, State.OPERATOR_NEEDED},
+            State.REBUILD_OSD: {State.RESOLVED, State.OPERATOR_NEEDED},
+            State.DRIVE_TESTING: {State.TEST_DONE, State.OPERATOR_NEEDED},
+            State.TEST_DONE: {State.REPLACE_DRIVE, State.REBUILD_OSD, State.OPERATOR_NEEDED},
+            State.RESOLVED: frozenset(),
+            }
+
     def __init__(
             self,
             case_id: Optional[int] = None,
@@ -69,9 +51,12 @@ class DlcCase:
             crush_weight: float = -1.0,
             mount: Optional[str] = None,
             active: int = 1, 
-            osd: Optional[cc.CephOsd] = None,
+            osd: Optional["ceph_common.CephOsd"] = None,
             host_serial = None,
             smart_passed = None,
+            test_passed = None,
+            version: int = 1,
+            updated_at: Optional[float] = None,
             ):
         self.case_id = case_id
         self.hostname = hostname
@@ -87,25 +72,16 @@ class DlcCase:
         self.osd = osd
         self.host_serial = host_serial
         self.smart_passed = smart_passed
+        self.test_passed = test_passed
+        self.version = version
+        self.updated_at = updated_at
 
-        #Dict for valid transitions
-        self.valid_transitions = {
-                State.NEW: {State.NEW_DETAIL, State.OPERATOR_NEEDED},
-                State.NEW_DETAIL: {State.RECOVERY_WAIT, State.OPERATOR_NEEDED},
-                State.RECOVERY_WAIT: {State.RECOVERY_DONE, State.OPERATOR_NEEDED},
-                State.RECOVERY_DONE: {State.OSD_REMOVED, State.OPERATOR_NEEDED},
-                State.OSD_REMOVED: {State.DRIVE_TESTING, State.REPLACE_DRIVE, State.OPERATOR_NEEDED},
-                State.REPLACE_DRIVE: {State.WAIT_FOR_REPLACE,  State.OPERATOR_NEEDED},
-                State.WAIT_FOR_REPLACE: {State.REBUILD_OSD, State.OPERATOR_NEEDED},
-                State.REBUILD_OSD: {State.RESOLVED, State.OPERATOR_NEEDED},
-                State.DRIVE_TESTING: {State.TEST_DONE, State.OPERATOR_NEEDED},
-                State.TEST_DONE: {State.REPLACE_DRIVE, State.REBUILD_OSD, State.OPERATOR_NEEDED},
-                State.RESOLVED: set(),
-                }
-        
         self._post_init()
+        #State as last read from or written to the database, for the transition counters
+        self._saved_state = self.state if case_id is not None else None
 
     # ---------- validation ----------
+    #Only validates. Creating a DlcCase never touches the cluster or the database, call save() for that.
     def _post_init(self):
         if not isinstance(self.state, State):
             # argparse passes strings → cast
@@ -115,16 +91,6 @@ class DlcCase:
                 raise ValueError(
                     f"state must be one of {[s.value for s in State]}"
                 ) from e
-       
-        elif self.state == State.NEW:
-            try:
-                self.save()
-            except sqlite3.IntegrityError as e:
-                print(self.osd_id, self.block_dev, self.hostname)
-                print(e)
-                sys.exit(1)
-            
-            print("New case saved.")
 
 
     def transition_to(self, new_state: State):
@@ -140,38 +106,41 @@ class DlcCase:
                     )
 
 
-    def _check_ceph_cluster(self):
+    @staticmethod
+    def _check_ceph_cluster():
         try:
-            with open ('/etc/ceph/ceph_cluster', 'r') as f:
+            with open (CEPH_CLUSTER_FILE, 'r') as f:
                 cluster = f.read()
                 return cluster.strip(), None 
         except FileNotFoundError as e:
             return False, e
 
 
-    def get_complete_information(self) -> bool:
+    #One verification of the case against the cluster, shared by every save and transition of one step (operation.py)
+    @staticmethod
+    def operation(snapshot: Optional[ClusterSnapshot] = None) -> Operation:
+        return Operation(snapshot, check_cluster = DlcCase._check_ceph_cluster)
+
+
+    #snapshot lets a caller that handles many cases (e.g. a sweep) share one OSD map and host inventory between them
+    @metrics.timed("get_complete_information")
+    def get_complete_information(self, snapshot: Optional[ClusterSnapshot] = None) -> bool:
 
         if (self.osd_id is None) and (self.hostname is None or self.block_dev is None):
             raise Exception ("Enter either a valid OSD id or a valid combination of hostname and device name. Inputs provided:  OSD ID: {}, Hostname: {}, Block device: {}".format(self.osd_id, self.hostname, self.block_dev))
 
-        hw = hwinv.HWInv()  
-        OsdMap = cc.CephOsdMap(hw)
+        if snapshot is None:
+            snapshot = ClusterSnapshot.load()
 
+        #The indexes are built once per snapshot, so resolving many cases doesn't rescan the OSD map for each one
         if self.state == State.NEW:
-            osd_map = OsdMap.osd_map
+            index = snapshot.index
         else:
-            if self.hostname != hw.hostname:
-                raise Exception ("The case's stored hostname does not match the current host. Cannot proceed with case on this node. Case hostname: {}, This host: {}".format(self.hostname, hw.hostname))
-            osd_map = OsdMap.osd_map_local
+            if self.hostname != snapshot.hostname:
+                raise Exception ("The case's stored hostname does not match the current host. Cannot proceed with case on this node. Case hostname: {}, This host: {}".format(self.hostname, snapshot.hostname))
+            index = snapshot.local_index
 
-        valid_OSD = None
-
-        if self.osd_id != None and int(self.osd_id) in osd_map:
-            valid_OSD = osd_map[self.osd_id] 
-        else:
-            for osd_id, osd_object in osd_map.items():
-                if self.hostname == osd_object.hostname and self.block_dev == osd_object.dev_name:
-                    valid_OSD = osd_object
+        valid_OSD = index.find(osd_id = self.osd_id, hostname = self.hostname, dev_name = self.block_dev)
 
         if valid_OSD:
             print("Found an equivalent OSD in the OSD Map. Plugging in OSD data into the case. This overwrites runtime data pulled from the database!")
@@ -190,9 +159,9 @@ class DlcCase:
             self.check_SMART()
         if self.host_serial is None and self.state != State.NEW:
             print("Checking Host serial...")
-            self.host_serial = hw.dmidecode().sysinfo['system']['serial']
-        elif self.host_serial is not None and self.host_serial != hw.dmidecode().sysinfo['system']['serial']:
-            raise Exception ("This host's serial number doesn't match the serial number saved in this case (case id: {self.case_id}). Exiting...")
+            self.host_serial = snapshot.host_serial
+        elif self.host_serial is not None and self.host_serial != snapshot.host_serial:
+            raise Exception (f"This host's serial number doesn't match the serial number saved in this case (case id: {self.case_id}). Exiting...")
 
         return True
 
@@ -206,23 +175,20 @@ class DlcCase:
 
 
     #This * means that any arguments after it will not be positional and will be supplied as keyword arguments
-    def save(self, *, new_version: bool = False, force_save: bool = False):
+    #op: the Operation of the step this save is part of; the case isn't checked against the cluster again if op already did
+    def save(self, *, new_version: bool = False, force_save: bool = False, snapshot: Optional[ClusterSnapshot] = None,
+            op: Optional[Operation] = None):
 
         found_osd_equivalent = False
+        op = op or self.operation(snapshot)
 
         #Here we try to find the cluster name by looking under /etc/ceph/ceph_cluster
-        cluster_name, e = self._check_ceph_cluster()
-
-        if cluster_name:
-            self.cluster = cluster_name
-        else:
-            print(e)
-            exit(1)
+        self.cluster = op.cluster
 
         if not force_save:
             #I took out cluster from the list of available arguments for an operator, I can put this back when it is appropriate. For now, assuming that the cluster name is the same as that which is listed under the local /etc/ceph/ceph_cluster
 
-            found_osd_equivalent = self.get_complete_information()
+            found_osd_equivalent = op.verify(self)
 
             try:
                 self._validate_case()
@@ -232,7 +198,12 @@ class DlcCase:
 
         #Here we're going to save if we found an OSD candidate in the OSD map or if the user is forcing us to try.
         if force_save == True or found_osd_equivalent == True:
-            with db_cursor() as cur:
+            #A resolved case is closed: it leaves the active cases (and their unique indexes) and `dlc archive` can move it out
+            if self.state == State.RESOLVED:
+                self.active = 0
+            #History copy and UPDATE commit together. Both only touch the row if it still has the version we loaded
+            #(compare-and-swap), so a second writer (cron and an operator on the same case) can't lose an update.
+            with db_transaction() as cur:
                 data = {
                     "hostname": self.hostname,
                     "state": self.state,
@@ -245,18 +216,26 @@ class DlcCase:
                     "action": self.action,
                     "wait_reason": self.wait_reason,
                     "smart_passed": self.smart_passed,
-                    "host_serial": self.host_serial
+                    "test_passed": self.test_passed,
+                    "host_serial": self.host_serial,
+                    "updated_at": time.time(),
                 }
 
                 if new_version:
                     #save history
                     print("Going into history to save...")
-                    save_case_history(self.case_id)
+                    copied = save_case_history(self.case_id, self.version)
                     set_clause = ", ".join([f"{key} = :{key}" for key in data.keys()])
                     cur.execute(
-                        f"UPDATE {TABLE_NAME} SET {set_clause} WHERE case_id = :case_id",
-                        {**data, "case_id": self.case_id},
+                        f"UPDATE {TABLE_NAME} SET {set_clause}, version = version + 1 WHERE case_id = :case_id AND version = :version",
+                        {**data, "case_id": self.case_id, "version": self.version},
                     )
+                    if not copied or cur.rowcount != 1:
+                        metrics.count("save_conflicts")
+                        raise ConcurrentUpdateError(
+                            f"Case {self.case_id} was changed by someone else since version {self.version} was loaded, nothing was saved"
+                        )
+                    self.version += 1
                 else:
                     columns = ", ".join(data.keys())
                     placeholders = ", ".join([f":{key}" for key in data.keys()])
@@ -265,6 +244,12 @@ class DlcCase:
                         data,
                     )
                     self.case_id = cur.lastrowid
+                    self.version = 1
+                self.updated_at = data["updated_at"]
+
+            if self._saved_state != self.state:
+                metrics.count("transitions", from_state = self._saved_state.value if self._saved_state else "", to_state = self.state.value)
+                self._saved_state = self.state
 
             return self
 
@@ -273,6 +258,7 @@ class DlcCase:
             return False
 
 
+    #With a version, the case is looked up in the current row first and then in the history table
     @staticmethod
     def load(case_id: int, version: Optional[int] = None) -> "DlcCase":
         sql = f"SELECT * FROM {TABLE_NAME} WHERE case_id=? "
@@ -281,12 +267,20 @@ class DlcCase:
             sql += "AND active=1"
             pass
         else:
-            sql += "AND version_number=?"
+            sql += "AND version=?"
             params.append(version)
 
         with db_cursor() as cur:
             cur.execute(sql, params)
             row = cur.fetchone()
+            if row is None and version is not None:
+                cur.execute(f"SELECT * FROM {HISTORY_TABLE} WHERE case_id=? AND version=?", params)
+                row = cur.fetchone()
+            #Resolved cases may have been moved to the archive (archive.py)
+            if row is None and version is not None:
+                import archive
+                row = archive.load_archived(case_id, version)
+                row = row._asdict() if row is not None else None
             if row is None:
                 raise ValueError("Case not found")
             #Dropping 'rowid' and 'active' columns from the query as it's not present in or relevant to the object
@@ -295,54 +289,65 @@ class DlcCase:
             row_dict.pop("active", None)
             #print(DlcCase)
             return DlcCase(**row_dict)
-    
+
+
+    #All active cases that this host can work on (get_complete_information refuses cases from other hosts)
+    @staticmethod
+    def load_active(hostname: str, cluster: str) -> list:
+        with db_cursor() as cur:
+            cur.execute(
+                f"SELECT * FROM {TABLE_NAME} WHERE active=1 AND hostname=? AND cluster=? ORDER BY case_id",
+                (hostname, cluster),
+            )
+            rows = cur.fetchall()
+        return [DlcCase(**dict(row)) for row in rows]
+
 
     #Right now this method should only be called from 'load' because it calls 'get_complete_information' which likely rewrites case information
-    def progress(self, *, new_version = True) -> "DlcCase":
+    #The case is verified against the cluster once per call, every save below reuses that (operation.py)
+    def progress(self, *, new_version = True, snapshot: Optional[ClusterSnapshot] = None, op: Optional[Operation] = None) -> "DlcCase":
+
+        if snapshot is None:
+            snapshot = op.snapshot if op is not None else ClusterSnapshot.load()
+        op = op or self.operation(snapshot)
 
         if self.state == State.NEW:
             self.state = State.NEW_DETAIL
             #print(self.state)
-            return self.save(new_version = new_version)
+            return self.save(new_version = new_version, snapshot = snapshot, op = op)
        
-        found_osd_equivalent = self.get_complete_information()
+        found_osd_equivalent = op.verify(self)
 
-        cluster_name, e = self._check_ceph_cluster()
-
-        if cluster_name:
-            pass
-        else:
-            print(e)
-            exit(1)
+        cluster_name = op.cluster
 
         if found_osd_equivalent and cluster_name == self.cluster:
         
             if self.state == State.NEW_DETAIL:
-                try:
-                    self.prep_OSD_for_removal()
-                except Exception as e:
-                    print("Unhandled Exception was encountered while prepping OSD for removal (state is NEW-DETAIL)")
-                    print(e)
-                    self.state = State.OPERATOR_NEEDED
-                    self.save(new_version = True)
-                
-                return self.save(new_version = new_version)
+                #The drain only starts if the budget allows (drain.py); sweeps drain the ready cases of a host together
+                import drain
+                result = drain.drain_ready([self], snapshot, new_version = new_version, op = op)
+                if self.case_id in result.waiting:
+                    raise CaseWaiting(result.waiting[self.case_id])
+                return self
 
             if self.state == State.RECOVERY_WAIT:
 
                 #wait for recovery, if false print that we're still waiting and will do nothing for now
                 #in ceph_common there is a class called CephState and there is a method called is_clean
-                cluster_state = cc.CephState()
-                if cluster_state.is_clean():
+                #The snapshot evaluates it once, so a sweep doesn't ask the monitors once per waiting case
+                if snapshot.is_clean():
                     #print("Ceph health check passed, will continute to OSD removal.")
                     self.state = State.RECOVERY_DONE
-                    self.save(new_version = new_version)
-                    self.remove_OSD()
+                    self.wait_reason = None
+                    self.save(new_version = new_version, snapshot = snapshot, op = op)
+                    return self.remove_OSD(snapshot = snapshot, op = op)
                 
                 else:
-                    print("Ceph health check failed. Won't do anything for now... Exiting.")
-                    sys.exit()
+                    raise CaseWaiting("Ceph health check failed. Won't do anything for now...")
             
+            elif self.state == State.DRIVE_TESTING:
+                return self.test_drive(new_version = new_version, snapshot = snapshot, op = op)
+
             elif self.state != State.OSD_REMOVED and self.state != State.TEST_DONE:
                 
                 #Do some operations depending on the state. For example, for self.state == State.RECOVERY_DONE:
@@ -370,7 +375,7 @@ class DlcCase:
                     if state != State.OPERATOR_NEEDED:
                         self.transition_to(state)
                     
-                return self.save(new_version = new_version)
+                return self.save(new_version = new_version, snapshot = snapshot, op = op)
                 
                 #Otherwise, if something went wrong (for now assuming everything is right):
                 #self.transition_to(State.OPERATOR_NEEDED)
@@ -378,100 +383,127 @@ class DlcCase:
                 return None
 
         else:
-            print("Tried to progress from {self.state} but this cluster doesn't match the case's saved cluster. Exiting...")
-            sys.exit(1)
+            raise CaseError(f"Tried to progress from {self.state} but this cluster doesn't match the case's saved cluster.")
 
     
-    def check_SMART(self):
+    #The test itself runs in the background, started and polled by drive_tests.step() (sweep and daemon call it).
+    #This only queues it, waits for it, and records the outcome.
+    def test_drive(self, *, new_version = True, snapshot: Optional[ClusterSnapshot] = None, op: Optional[Operation] = None):
+        import drive_tests
+        import records
+
+        #Only a test of this stay in DRIVE_TESTING counts, not one from an earlier time the case was tested
+        job = drive_tests.latest(self.case_id, since = records.state_since(self.case_id))
+        if job is None:
+            drive_tests.abandon(self.case_id, "superseded by a new test of the case")
+            job = drive_tests.submit(self.case_id, self.hostname, self.block_dev)
+            print("DlcCase({}) queued drive test {} ({}) on {}".format(self.case_id, job.job_id, job.kind, job.device))
+            self.action = Action.testing_disk
+            self.wait_reason = WaitReason.disk_test_completion
+            return self.save(new_version = new_version, snapshot = snapshot, op = op)
+
+        if not job.finished:
+            progress = f", {job.progress:.0f}% done" if job.progress is not None else ""
+            raise CaseWaiting(f"Drive test {job.job_id} ({job.kind}) is {job.status}{progress}")
+
+        self.action = None
+        self.wait_reason = None
+        if job.status == drive_tests.ERROR:
+            print("DlcCase({}) drive test {} could not run: {}".format(self.case_id, job.job_id, job.error))
+            self.state = State.OPERATOR_NEEDED
+        else:
+            self.test_passed = job.passed
+            self.transition_to(State.TEST_DONE)
+        return self.save(new_version = new_version, snapshot = snapshot, op = op)
+
+
+    #max_age: a stored smartctl result younger than this many seconds is reused instead of running smartctl again
+    @metrics.timed("check_SMART")
+    def check_SMART(self, *, max_age: float = smart.SMART_MAX_AGE):
 
         if not self.block_dev:
             raise Exception ("Block device isn't recognized. Block device: {}".format(self.block_dev))
-        if not self.block_dev.startswith('/dev/'):
-            full_device_path = '/dev/' + str(self.block_dev)
-            cmd = ["/usr/sbin/smartctl","-a", "-j", f"{full_device_path}"]
-        else:
-            cmd = ["/usr/sbin/smartctl","-a", "-j", f"{self.block_dev}"]
 
-        R = subprocess.run(cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        result = smart.latest(self.block_dev, max_age = max_age)
+        if result is None:
+            result = smart.collect([self.block_dev])[smart.device_path(self.block_dev)]
 
-        json_result = json.loads(R.stdout.decode())
+        #smartctl hung or didn't produce JSON
+        if result.error is not None:
+            raise Exception(result.error)
 
-        return_code = json_result['smartctl']['exit_status']
-        mask_list = [1, 2, 4, 8]
-        active_bits = [((return_code and mask) and 1) for mask in mask_list]
-        #print(active_bits)
-        #print(max(active_bits))
+        return_code = result.exit_status
         err_message = None
 
         #return code 0
-        if max(active_bits) == 0:
-            self.smart_passed = json_result['smart_status']['passed']
+        if return_code == 0:
+            self.smart_passed = result.passed
 
-        #return code 3 (disk failed)
-        elif active_bits[2]:
-            self.smart_passed = json_result['smart_status']['passed']
-            err_message = json_result['smart_status']['scsi']['ie_string']
+        #smartctl couldn't parse its arguments or open the device
+        elif return_code & (smart.CMDLINE_ERROR | smart.DEVICE_OPEN_FAILED):
+            raise Exception(result.message)
 
-        #return code 1 or 2
-        elif active_bits[0] or active_bits[1]:
-            raise Exception(json_result['smartctl']['messages'][0]['string'])
-        
-        #Any return code other than 0, 1, 2, or 3.
+        #a SMART command failed, the disk is failing, or any of the other status bits
         else:
-            self.smart_passed = json_result['smart_status']['passed']
-            err_message = json_result['smart_status']['scsi']['ie_string']
+            self.smart_passed = result.passed
+            err_message = result.ie_string or result.message
+
+        #A drive whose error counters keep growing is failing even while its overall SMART status still says passed
+        reasons = smart_trends.degrading(result.serial) if result.serial else []
+        if reasons:
+            self.smart_passed = False
+            err_message = "; ".join(reasons) if err_message is None else err_message + "; " + "; ".join(reasons)
 
         if err_message is not None:
             print("DlcCase({}).progress_NEW - SMART message: {}".format(self.case_id, err_message)) 
             
-            print("DlcCase({}).progress_NEW - populating SMART Health passed:{}. smartctl return code: {}".format(self.case_id, self.smart_passed, json_result['smartctl']['exit_status']))
+            print("DlcCase({}).progress_NEW - populating SMART Health passed:{}. smartctl return code: {}".format(self.case_id, self.smart_passed, return_code))
         
     
     def prep_OSD_for_removal(self):
+        self.drain_OSDs([self.osd_id])
 
-        #Putting this here because the current OSD removal method doesn't include reweighting CRUSH weight to 0 and because it doesn't include waiting for backfilling after taking the OSD from in to out.
-        cmd_list = []
-        all_passed = False
-
-        #stop the OSD process
-        cmd_list.append([ 'echo', 'systemctl', 'stop', 'ceph-osd@{}'.format(self.osd_id) ])
+        #update case state and save if everything went well:
+        self.state = State.RECOVERY_WAIT
+        self.wait_reason = WaitReason.cluster_health
 
-        #Reweight CRUSH weight to 0
-        cmd_list.append([ 'echo', 'ceph', 'osd', 'crush', 'reweight', 'osd.{}'.format(self.osd_id), '0' ])
 
-        #mark the OSD Out
-        cmd_list.append([ 'echo', 'ceph', 'osd', 'out', 'osd.{}'.format(self.osd_id) ])
+    #Drains several OSDs of one host in one pass: one systemctl call, one `ceph osd out`, so they share a single recovery
+    @staticmethod
+    def drain_OSDs(osd_ids):
 
-        for cmd in cmd_list:
-            
-            try:
-                #stdout&stdin= subprocess.PIPE opens a pipe to the standard stream that allows stdout and stderr to be captured and stored in the returned object (CompletedProcess) attributes ob.stdout and ob.stdin. check=True indicates that if the return code is non-zero, an exception of type CalleddProcessError should be returned. 
-                R = subprocess.run(cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, check=True)
-            except FileNotFoundError as notFound:
-                print(notFound)
-                self.state = State.OPERATOR_NEEDED
-                self.save(new_version = True)
-                sys.exit(1)
-            except subprocess.CalledProcessError as e:
-                print(e.stdout.decode())
-                print(e.stderr.decode())
-                print("Something went wrong during OSD removal prep")
-                self.state = State.OPERATOR_NEEDED
-                self.save(new_version = True)
-                sys.exit(1)
-
-            print(R.stdout.decode())
-            
-        #update case state and save if everything went well:
-        self.state = State.RECOVERY_WAIT
+        #Putting this here because the current OSD removal method doesn't include reweighting CRUSH weight to 0 and because it doesn't include waiting for backfilling after taking the OSD from in to out.
+        #Each command has a timeout (runner.py), a hung ceph CLI fails the drain instead of stalling the sweep.
+        try:
+            #stop the OSD processes
+            R = runner.run([ 'echo', 'systemctl', 'stop', *['ceph-osd@{}'.format(osd_id) for osd_id in osd_ids] ], step = "stop_osd", check = True)
+            print(R.stdout)
+
+            #Reweight CRUSH weight to 0. The command takes one OSD at a time, the OSDs don't depend on each other
+            reweights = runner.run_many(
+                runner.Command([ 'echo', 'ceph', 'osd', 'crush', 'reweight', 'osd.{}'.format(osd_id), '0' ], step = "crush_reweight", check = True)
+                for osd_id in osd_ids
+            )
+            for R in reweights:
+                print(R.stdout)
+
+            #mark the OSDs Out
+            R = runner.run([ 'echo', 'ceph', 'osd', 'out', *['osd.{}'.format(osd_id) for osd_id in osd_ids] ], step = "mark_out", check = True)
+            print(R.stdout)
+        #The caller (drain_ready) moves the cases to OPERATOR-NEEDED and saves them
+        except CommandError as e:
+            print(e.result.stdout)
+            print(e.result.stderr)
+            raise CaseError("Something went wrong during OSD removal prep: {}".format(e)) from e
 
     
-    def remove_OSD(self):
+    def remove_OSD(self, *, snapshot: Optional[ClusterSnapshot] = None, op: Optional[Operation] = None):
 
         #BEFORE doing any operations on the cluster or node, we need to make sure that the node and cluster we're working on match the details of the case. We may not be doing that at this point
         if self.state == State.RECOVERY_DONE:
             print("Recovery is done, moving to osd removal testing...")
-            found_osd_equivalent = self.get_complete_information()
+            op = op or self.operation(snapshot)
+            found_osd_equivalent = op.verify(self)
             class args:
                 def __init__( self,
                         replace = True,
@@ -489,9 +521,17 @@ class DlcCase:
             args = args()
             #print(args.dry_run)
 
-            cadmin.osd_remove(self.osd, args) 
+            #ceph-util import, only needed here
+            import ceph_admin as cadmin
+            #ceph-util exits the process when a command fails, that must not take a sweep or the daemon with it
+            try:
+                with metrics.span("osd_remove"):
+                    cadmin.osd_remove(self.osd, args)
+            except SystemExit as e:
+                raise CaseError("OSD removal failed (exit status {})".format(e.code)) from e
             self.state = State.OSD_REMOVED
-            return self.save(new_version = True)
+            #Saved against the OSD as verified before the removal, it's no longer in the cluster to check against
+            return self.save(new_version = True, snapshot = snapshot, op = op)
 
 
     # convenience
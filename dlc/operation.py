@@ -0,0 +1,75 @@
+"""
+One step of work on cases (a progress() call, `dlc new`, a batch of drains):
+* verify(case) checks the case against the OSD map, this host (hostname, host serial)
+  and SMART once, through DlcCase.get_complete_information. Every save() and
+  transition in the step then reuses that instead of checking again.
+* The cluster name (/etc/ceph/ceph_cluster) is read once per step.
+A case is verified again within the same step when:
+* its identity (osd_id, hostname, block_dev) is not what was verified,
+* it left NEW (NEW cases are looked up in the whole OSD map and keep no device,
+  every later state is checked against this host's OSDs),
+* invalidate() was called for it, e.g. after a command that changes the OSD itself.
+A new Operation verifies everything again, so nothing carries over between steps:
+the next progress() of the case (a later sweep or tick) checks the cluster afresh.
+No ceph-util imports here; the snapshot is loaded only if none was given.
+"""
+from typing import Callable, Optional
+
+from errors import CaseError
+from states import State
+import metrics
+
+
+class Operation:
+    def __init__(self, snapshot = None, *, check_cluster: Callable):
+        #check_cluster: returns (cluster name, None) or (False, error), like DlcCase._check_ceph_cluster
+        self._snapshot = snapshot
+        self._check_cluster = check_cluster
+        self._cluster: Optional[str] = None
+        #id(case) -> (case, identity when verified); the case is kept so its id can't be reused
+        self._verified = {}
+        self.verifications = 0
+
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            from snapshot import ClusterSnapshot
+            self._snapshot = ClusterSnapshot.load()
+        return self._snapshot
+
+    @property
+    def cluster(self) -> str:
+        if self._cluster is None:
+            cluster_name, e = self._check_cluster()
+            if not cluster_name:
+                raise CaseError(e)
+            self._cluster = cluster_name
+        return self._cluster
+
+    @staticmethod
+    def _identity(case) -> tuple:
+        return (case.osd_id, case.hostname, case.block_dev, case.state == State.NEW)
+
+    def verified(self, case) -> bool:
+        entry = self._verified.get(id(case))
+        return entry is not None and entry[0] is case and entry[1] == self._identity(case)
+
+    def verify(self, case) -> bool:
+        """True once the case matches the cluster; get_complete_information raises if it doesn't."""
+        if self.verified(case):
+            metrics.count("verifications", result = "reused")
+            return True
+        found = case.get_complete_information(self.snapshot)
+        self.verifications += 1
+        metrics.count("verifications", result = "checked")
+        if found:
+            #Taken after the check, which fills in the OSD's details
+            self._verified[id(case)] = (case, self._identity(case))
+        return found
+
+    def invalidate(self, case = None):
+        #Forget one case (or all), its next verify() checks the cluster again
+        if case is None:
+            self._verified.clear()
+        else:
+            self._verified.pop(id(case), None)
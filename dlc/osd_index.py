@@ -0,0 +1,80 @@
+"""
+Lookup tables over an OSD map (dict of osd_id -> CephOsd), built once and reused
+for every case resolved in the process:
+* OSD by osd_id, (hostname, dev_name), LV name, host, or host serial.
+* Reverse lookups from hosts and OSDs to the cases registered with add_cases().
+No ceph-util imports; any object with osd_id/hostname/dev_name/lv_name works.
+"""
+from collections import defaultdict
+from typing import Iterable, Optional
+
+
+def _dev(dev_name):
+    #Cases store block devices without /dev/
+    if dev_name is None:
+        return None
+    dev_name = str(dev_name)
+    return dev_name[5:] if dev_name.startswith('/dev/') else dev_name
+
+
+class OsdIndex:
+    def __init__(self, osd_map: dict):
+        self.by_id = {}
+        self.by_hostdev = {}
+        self.by_lv = {}
+        self.by_host = defaultdict(list)
+        self.host_by_serial = {}
+        self.cases_by_host = defaultdict(list)
+        self.cases_by_osd = defaultdict(list)
+
+        for osd_id, osd in osd_map.items():
+            self.by_id[int(osd_id)] = osd
+            self.by_hostdev[(osd.hostname, _dev(osd.dev_name))] = osd
+            lv_name = getattr(osd, "lv_name", None)
+            if lv_name:
+                self.by_lv[lv_name] = osd
+            self.by_host[osd.hostname].append(osd)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    # ---------- OSD lookups ----------
+    def find(self, osd_id: Optional[int] = None, hostname: Optional[str] = None, dev_name: Optional[str] = None):
+        #Same precedence as get_complete_information always had: the OSD id if it is in the map, then hostname + device
+        if osd_id is not None:
+            osd = self.by_id.get(int(osd_id))
+            if osd is not None:
+                return osd
+        if hostname is not None and dev_name is not None:
+            return self.by_hostdev.get((hostname, _dev(dev_name)))
+        return None
+
+    def by_lv_name(self, lv_name: str):
+        return self.by_lv.get(lv_name)
+
+    def on_host(self, hostname: str) -> list:
+        return list(self.by_host.get(hostname, ()))
+
+    def add_host_serial(self, hostname: str, serial: str):
+        if hostname and serial:
+            self.host_by_serial[serial] = hostname
+
+    def on_host_serial(self, serial: str) -> list:
+        hostname = self.host_by_serial.get(serial)
+        return self.on_host(hostname) if hostname is not None else []
+
+    # ---------- reverse lookups ----------
+    def add_cases(self, cases: Iterable):
+        #cases: DlcCase or CaseRecord, anything with case_id/hostname/osd_id/host_serial
+        for case in cases:
+            if case.hostname is not None:
+                self.cases_by_host[case.hostname].append(case)
+            if case.osd_id is not None and case.osd_id >= 0:
+                self.cases_by_osd[int(case.osd_id)].append(case)
+            self.add_host_serial(case.hostname, getattr(case, "host_serial", None))
+
+    def cases_on_host(self, hostname: str) -> list:
+        return list(self.cases_by_host.get(hostname, ()))
+
+    def cases_for_osd(self, osd_id: int) -> list:
+        return list(self.cases_by_osd.get(int(osd_id), ()))
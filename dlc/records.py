@@ -0,0 +1,145 @@
+"""
+Read-only case rows for queries (list, status, reports):
+* CaseRecord is a NamedTuple, no per-instance dict and no methods that write.
+* Nothing here imports ceph-util or touches the cluster.
+* query_records() filters in SQL and pages by case_id (keyset), so listing a large
+  table streams rows from an index instead of loading all of them.
+* load_record, iter_history and record_as_of fall back to the archive (archive.py)
+  for cases that were moved out of the hot tables.
+"""
+import time
+from typing import Iterator, NamedTuple, Optional
+
+from storage import db_cursor, TABLE_NAME, HISTORY_TABLE
+
+
+class CaseRecord(NamedTuple):
+    case_id: int
+    hostname: Optional[str] = None
+    host_serial: Optional[str] = None
+    smart_passed: Optional[str] = None
+    test_passed: Optional[str] = None
+    state: Optional[str] = None
+    block_dev: Optional[str] = None
+    osd_id: Optional[int] = None
+    cluster: Optional[str] = None
+    crush_weight: Optional[float] = None
+    mount: Optional[str] = None
+    action: Optional[str] = None
+    wait_reason: Optional[str] = None
+    active: int = 1
+    version: int = 1
+    updated_at: Optional[float] = None
+
+
+COLUMNS = ", ".join(CaseRecord._fields)
+
+
+def iter_records(where: str = "", params=(), *, limit: Optional[int] = None) -> Iterator[CaseRecord]:
+    #where is an SQL fragment with ? placeholders, e.g. "active = 1 AND hostname = ?"
+    sql = f"SELECT {COLUMNS} FROM {TABLE_NAME}"
+    if where:
+        sql += f" WHERE {where}"
+    sql += " ORDER BY case_id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = (*params, limit)
+    with db_cursor() as cur:
+        cur.execute(sql, params)
+        for row in cur:
+            yield CaseRecord._make(row)
+
+
+def query_records(*, state: Optional[str] = None, hostname: Optional[str] = None, cluster: Optional[str] = None,
+        osd_id: Optional[int] = None, active: Optional[bool] = True, older_than: Optional[float] = None,
+        newer_than: Optional[float] = None, after: Optional[int] = None, limit: Optional[int] = None) -> Iterator[CaseRecord]:
+    """
+    Cases matching every filter given, by case_id. active=None means active and inactive.
+    older_than/newer_than are ages in seconds of the case's current version (updated_at).
+    after: only cases with a larger case_id, the last case_id of the previous page.
+    """
+    where, params = [], []
+    if active is not None:
+        where.append("active = ?")
+        params.append(1 if active else 0)
+    for column, value in (("state", state), ("hostname", hostname), ("cluster", cluster), ("osd_id", osd_id)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    now = time.time()
+    if older_than is not None:
+        where.append("updated_at <= ?")
+        params.append(now - older_than)
+    if newer_than is not None:
+        where.append("updated_at >= ?")
+        params.append(now - newer_than)
+    if after is not None:
+        where.append("case_id > ?")
+        params.append(after)
+    return iter_records(" AND ".join(where), params, limit = limit)
+
+
+def load_record(case_id: int) -> CaseRecord:
+    for record in iter_records("case_id = ?", (case_id,)):
+        return record
+    from archive import load_archived
+    record = load_archived(case_id)
+    if record is not None:
+        return record
+    raise ValueError("Case not found")
+
+
+def iter_history(case_id: int) -> Iterator[CaseRecord]:
+    #Every version of the case, oldest first, ending with the current row
+    found = False
+    with db_cursor() as cur:
+        cur.execute(f"SELECT {COLUMNS} FROM {HISTORY_TABLE} WHERE case_id = ? ORDER BY version", (case_id,))
+        for row in cur:
+            found = True
+            yield CaseRecord._make(row)
+    for record in iter_records("case_id = ?", (case_id,)):
+        found = True
+        yield record
+    if not found:
+        from archive import iter_archived_history
+        yield from iter_archived_history(case_id)
+
+
+def state_since(case_id: int) -> Optional[float]:
+    #When the case entered its current state: the time of the first version of its latest run of that state
+    with db_cursor() as cur:
+        cur.execute(
+            f"""
+                SELECT MIN(updated_at) FROM (
+                    SELECT version, updated_at FROM {HISTORY_TABLE} WHERE case_id = :case_id
+                    UNION ALL SELECT version, updated_at FROM {TABLE_NAME} WHERE case_id = :case_id
+                ) WHERE version > (
+                    SELECT COALESCE(MAX(h.version), 0) FROM {HISTORY_TABLE} AS h JOIN {TABLE_NAME} AS c ON c.case_id = h.case_id
+                    WHERE h.case_id = :case_id AND h.state != c.state
+                )
+            """, {"case_id": case_id}
+        )
+        return cur.fetchone()[0]
+
+
+def record_as_of(case_id: int, when: float) -> Optional[CaseRecord]:
+    """
+    The version of the case that was current at unix time `when`, None if the case didn't exist yet.
+    Both lookups are a single probe of an index on (case_id, ...).
+    """
+    with db_cursor() as cur:
+        cur.execute(f"SELECT {COLUMNS} FROM {TABLE_NAME} WHERE case_id = ? AND updated_at <= ?", (case_id, when))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(
+                f"""
+                    SELECT {COLUMNS} FROM {HISTORY_TABLE}
+                    WHERE case_id = ? AND updated_at <= ?
+                    ORDER BY updated_at DESC, version DESC LIMIT 1
+                """, (case_id, when)
+            )
+            row = cur.fetchone()
+    if row is None:
+        from archive import archived_as_of
+        return archived_as_of(case_id, when)
+    return CaseRecord._make(row)
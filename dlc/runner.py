@@ -0,0 +1,249 @@
+"""
+One way to run the external commands dlc needs (ceph, systemctl, smartctl, ssh):
+* run() always returns within its timeout: the command runs in its own process group,
+  which is killed when time is up. A failed command is a CommandResult, check=True
+  turns it into a CommandError. Nothing here calls sys.exit.
+* At most `max_concurrent` commands run at once, and at most `max_per_host` against
+  the same host, so one slow node can't take every slot.
+* stdout and stderr are read as they arrive and capped at `max_output` bytes each.
+* run_many() runs independent commands in parallel; run_async() for the daemon.
+* The Executor does the actual work. FakeExecutor answers from a function instead
+  of starting processes, for tests: use(Runner(FakeExecutor(...))).
+"""
+import asyncio, contextlib, os, signal, subprocess, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
+
+from errors import CommandError
+import metrics
+
+DEFAULT_TIMEOUT = 120
+MAX_CONCURRENT = 16
+MAX_PER_HOST = 4
+MAX_OUTPUT = 1 << 20
+#How long we wait for a killed command to go away. A process stuck in the kernel (D state) can't be reaped, we leave it behind.
+KILL_GRACE = 5
+_CHUNK = 1 << 16
+
+
+@dataclass
+class CommandResult:
+    argv: List[str]
+    returncode: Optional[int] = None
+    stdout: str = ""
+    stderr: str = ""
+    seconds: float = 0.0
+    timed_out: bool = False
+    truncated: bool = False
+    #The command couldn't be started at all (not installed, no permission)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out and self.error is None
+
+    def describe(self) -> str:
+        command = " ".join(self.argv)
+        if self.error is not None:
+            return f"{command}: {self.error}"
+        if self.timed_out:
+            return f"{command}: timed out after {self.seconds:.0f}s"
+        lines = self.stderr.strip().splitlines()
+        return f"{command}: exit status {self.returncode}" + (f": {lines[-1]}" if lines else "")
+
+
+@dataclass
+class Command:
+    argv: List[str]
+    timeout: Optional[float] = None
+    host: Optional[str] = None
+    step: Optional[str] = None
+    check: bool = False
+    env: Optional[dict] = None
+    max_output: Optional[int] = field(default = MAX_OUTPUT)
+
+
+class _Capped:
+    #Keeps the first `limit` bytes of a stream and counts the rest
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self.chunks = []
+        self.kept = 0
+        self.dropped = 0
+
+    def add(self, chunk: bytes):
+        if self.limit is not None and self.kept + len(chunk) > self.limit:
+            keep = max(self.limit - self.kept, 0)
+            self.dropped += len(chunk) - keep
+            chunk = chunk[:keep]
+        self.chunks.append(chunk)
+        self.kept += len(chunk)
+
+    def text(self) -> str:
+        return b"".join(self.chunks).decode(errors = "replace")
+
+
+def _drain(pipe, buffer: _Capped):
+    with pipe:
+        while chunk := pipe.read1(_CHUNK):
+            buffer.add(chunk)
+
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        proc.kill()
+
+
+class SubprocessExecutor:
+    def execute(self, argv: List[str], *, timeout: float, max_output: Optional[int], env: Optional[dict]) -> CommandResult:
+        result = CommandResult(list(argv))
+        start = time.monotonic()
+        try:
+            #Own process group, so a timeout also kills what the command started (ssh, sh -c, ...)
+            proc = subprocess.Popen(argv, stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                    env = {**os.environ, **env} if env else None, start_new_session = True)
+        except OSError as e:
+            result.error = str(e)
+            return result
+
+        out, err = _Capped(max_output), _Capped(max_output)
+        readers = [threading.Thread(target = _drain, args = (proc.stdout, out), daemon = True),
+                threading.Thread(target = _drain, args = (proc.stderr, err), daemon = True)]
+        for reader in readers:
+            reader.start()
+        try:
+            proc.wait(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            _kill(proc)
+            result.timed_out = True
+            try:
+                proc.wait(timeout = KILL_GRACE)
+            except subprocess.TimeoutExpired:
+                pass
+        #Bounded: a grandchild that escaped the process group may keep the pipes open
+        for reader in readers:
+            reader.join(timeout = KILL_GRACE)
+
+        result.returncode = proc.returncode if not result.timed_out else None
+        result.stdout, result.stderr = out.text(), err.text()
+        result.truncated = bool(out.dropped or err.dropped)
+        result.seconds = time.monotonic() - start
+        return result
+
+
+class FakeExecutor:
+    """
+    Stand-in for SubprocessExecutor. handler(argv) returns (returncode, stdout, stderr)
+    or a CommandResult; without a handler every command succeeds with no output.
+    Every argv run is appended to .calls.
+    """
+    def __init__(self, handler: Optional[Callable] = None):
+        self.handler = handler
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def execute(self, argv, *, timeout, max_output, env) -> CommandResult:
+        with self._lock:
+            self.calls.append(list(argv))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            answer = self.handler(list(argv)) if self.handler else (0, "", "")
+        finally:
+            with self._lock:
+                self.running -= 1
+        if isinstance(answer, CommandResult):
+            return answer
+        returncode, stdout, stderr = answer
+        return CommandResult(list(argv), returncode, stdout[:max_output] if max_output else stdout, stderr)
+
+
+class Runner:
+    def __init__(self, executor = None, *, max_concurrent: int = MAX_CONCURRENT, max_per_host: int = MAX_PER_HOST,
+            default_timeout: float = DEFAULT_TIMEOUT):
+        self.executor = executor or SubprocessExecutor()
+        self.default_timeout = default_timeout
+        self.max_per_host = max_per_host
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_slots(self, host: Optional[str]):
+        if host is None:
+            return contextlib.nullcontext()
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._hosts[host]
+
+    def run(self, argv: List[str], *, timeout: Optional[float] = None, host: Optional[str] = None, step: Optional[str] = None,
+            check: bool = False, env: Optional[dict] = None, max_output: Optional[int] = MAX_OUTPUT) -> CommandResult:
+        """
+        Runs argv and returns its CommandResult. host: the machine the command runs on (an ssh
+        target), for the per-host limit; local commands only count against the global one. check: raise CommandError unless the command succeeded.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        step = step or os.path.basename(argv[0])
+        #The host slot first, so commands for a busy host don't hold global slots while they wait
+        with self._host_slots(host), self._slots:
+            with metrics.span("subprocess", step = step):
+                result = self.executor.execute(argv, timeout = timeout, max_output = max_output, env = env)
+        if result.timed_out:
+            metrics.count("command_timeouts", step = step)
+        if check and not result.ok:
+            raise CommandError(result)
+        return result
+
+    def run_many(self, commands: Iterable[Command]) -> List[CommandResult]:
+        """Runs independent commands in parallel, results in the same order. With check, the first failure is raised after all finished."""
+        commands = list(commands)
+        if not commands:
+            return []
+        with ThreadPoolExecutor(max_workers = len(commands)) as pool:
+            futures = [
+                pool.submit(self.run, c.argv, timeout = c.timeout, host = c.host, step = c.step, env = c.env, max_output = c.max_output)
+                for c in commands
+            ]
+            results = [f.result() for f in futures]
+        for command, result in zip(commands, results):
+            if command.check and not result.ok:
+                raise CommandError(result)
+        return results
+
+    async def run_async(self, argv: List[str], **kwargs) -> CommandResult:
+        return await asyncio.to_thread(self.run, argv, **kwargs)
+
+
+_runner = Runner()
+
+
+def get_runner() -> Runner:
+    return _runner
+
+
+@contextlib.contextmanager
+def use(runner: Runner):
+    #Swaps the runner every module uses, e.g. for one with a FakeExecutor
+    global _runner
+    previous, _runner = _runner, runner
+    try:
+        yield runner
+    finally:
+        _runner = previous
+
+
+def run(argv: List[str], **kwargs) -> CommandResult:
+    return _runner.run(argv, **kwargs)
+
+
+def run_many(commands: Iterable[Command]) -> List[CommandResult]:
+    return _runner.run_many(commands)
+
+
+async def run_async(argv: List[str], **kwargs) -> CommandResult:
+    return await _runner.run_async(argv, **kwargs)
@@ -0,0 +1,158 @@
+"""
+Opens cases for failing drives without an operator (`dlc scan`):
+* Looks at every OSD device of this host in the snapshot's OSD map.
+* Incremental: devices whose OSD has an active case, or with a SMART sample younger
+  than max_age, are skipped; smartctl runs only for the rest, in parallel (smart.collect).
+* A new sample whose status and error counters match the previous one needs no
+  trend query.
+* Failing (SMART status, DISK_FAILING bit) or degrading (smart_trends) drives get a
+  NEW case. uq_active_hostdev / uq_active_osdcluster keep a drive from getting two.
+"""
+import sqlite3, time
+from dataclasses import dataclass, asdict
+from typing import Callable, Optional
+
+from storage import db_cursor, db_transaction, TABLE_NAME
+from osd_index import _dev
+import metrics
+import smart
+import smart_trends
+
+#Scanning every few minutes shouldn't mean running smartctl on every drive every few minutes
+SCAN_MAX_AGE = 3600
+#Change all the time on a healthy drive, so they don't count as "changed"
+_VOLATILE = {"power_on_hours", "temperature"}
+
+FRESH = "fresh"
+HAS_CASE = "has-case"
+HEALTHY = "healthy"
+UNCHANGED = "unchanged"
+FAILING = "failing"
+OPENED = "opened"
+EXISTS = "exists"
+ERROR = "error"
+
+
+@dataclass
+class ScanResult:
+    device: str
+    osd_id: Optional[int]
+    outcome: str
+    serial: Optional[str] = None
+    case_id: Optional[int] = None
+    message: Optional[str] = None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _fingerprint(result: Optional[smart.SmartResult]):
+    if result is None or result.data is None:
+        return None
+    attributes = {k: v for k, v in smart_trends.extract(result.data).items() if k not in _VOLATILE}
+    return (result.serial, result.exit_status, result.passed, tuple(sorted(attributes.items())))
+
+
+def _status_failing(result: smart.SmartResult) -> Optional[str]:
+    if result.passed is False:
+        return "SMART overall health check failed"
+    if result.exit_status is not None and result.exit_status & smart.DISK_FAILING:
+        return "smartctl reports the disk is failing"
+    return None
+
+
+def verdict(result: smart.SmartResult) -> Optional[str]:
+    #Why the drive needs a case, None if it doesn't
+    failing = _status_failing(result)
+    if failing:
+        return failing
+    reasons = smart_trends.degrading(result.serial) if result.serial else []
+    return "; ".join(reasons) or None
+
+
+def _active_cases(hostname: str) -> tuple:
+    #(OSD ids, devices) of this host's active cases. NEW cases are saved without a block_dev
+    #(get_complete_information leaves it out until the case is worked on), so the OSD id is what says a drive has one.
+    with db_cursor() as cur:
+        cur.execute(f"SELECT osd_id, block_dev FROM {TABLE_NAME} WHERE active = 1 AND hostname = ?", (hostname,))
+        rows = cur.fetchall()
+    return {row["osd_id"] for row in rows}, {row["block_dev"] for row in rows if row["block_dev"]}
+
+
+def _open_case(hostname: str, block_dev: str, osd_id: Optional[int], snapshot):
+    #Same path as `dlc new`: the case is resolved against the OSD map and SMART before it is saved
+    from models import DlcCase, State
+    case = DlcCase(hostname = hostname, block_dev = block_dev, osd_id = osd_id if osd_id is not None else -1, state = State["NEW"])
+    return case.save(snapshot = snapshot)
+
+
+def scan(snapshot, *, max_age: float = SCAN_MAX_AGE, max_workers: int = smart.SMART_WORKERS,
+        timeout: float = smart.SMART_TIMEOUT, open_cases: bool = True, open_case: Optional[Callable] = None) -> list:
+    """
+    Checks this host's OSD devices and opens cases for failing ones (unless open_cases is False).
+    Returns one ScanResult per device.
+    """
+    open_case = open_case or _open_case
+    hostname = snapshot.hostname
+    osds = {}
+    for osd in snapshot.local_index.on_host(hostname):
+        dev = _dev(osd.dev_name)
+        if dev:
+            osds[dev] = osd
+
+    results = []
+    case_osds, case_devices = _active_cases(hostname)
+    #Samples are recorded under socket.gethostname(), which may differ from HWInv's hostname (FQDN vs short)
+    previous = smart.latest_by_device()
+    due = []
+    for dev, osd in sorted(osds.items()):
+        if osd.osd_id in case_osds or dev in case_devices:
+            results.append(ScanResult(dev, osd.osd_id, HAS_CASE))
+            continue
+        last = previous.get(smart.device_path(dev))
+        if last is not None and last.collected_at >= time.time() - max_age:
+            results.append(ScanResult(dev, osd.osd_id, FRESH, serial = last.serial))
+            continue
+        due.append(dev)
+
+    collected = smart.collect(due, max_workers = max_workers, timeout = timeout)
+    failing = []
+    for dev in due:
+        osd = osds[dev]
+        result = collected[smart.device_path(dev)]
+        if result.error is not None:
+            results.append(ScanResult(dev, osd.osd_id, ERROR, message = result.error))
+            continue
+        old = previous.get(smart.device_path(dev))
+        #Counters that didn't move can't have started a trend, so a drive that looked fine stays fine
+        if old is not None and _fingerprint(old) == _fingerprint(result) and _status_failing(old) is None:
+            results.append(ScanResult(dev, osd.osd_id, UNCHANGED, serial = result.serial))
+            continue
+        reason = verdict(result)
+        if reason is None:
+            results.append(ScanResult(dev, osd.osd_id, HEALTHY, serial = result.serial))
+        else:
+            failing.append(ScanResult(dev, osd.osd_id, FAILING, serial = result.serial, message = reason))
+
+    if open_cases and failing:
+        with db_transaction():
+            for r in failing:
+                try:
+                    #Savepoint per case, like `dlc import`
+                    with db_transaction():
+                        saved = open_case(hostname, r.device, r.osd_id, snapshot)
+                except sqlite3.IntegrityError as e:
+                    r.outcome, r.message = EXISTS, str(e)
+                    continue
+                except Exception as e:
+                    r.outcome, r.message = ERROR, f"Could not open a case ({r.message}): {type(e).__name__}: {e}"
+                    continue
+                if saved:
+                    r.outcome, r.case_id = OPENED, saved.case_id
+                else:
+                    r.outcome, r.message = ERROR, f"Could not open a case ({r.message}): no matching OSD in the OSD map"
+    results.extend(failing)
+
+    for r in results:
+        metrics.count("scan", outcome = r.outcome)
+    return sorted(results, key = lambda r: r.device)
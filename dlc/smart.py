@@ -0,0 +1,172 @@
+"""
+SMART collection for many devices at once:
+* smartctl runs in a bounded thread pool with a timeout per device, so one dying
+  disk can't hold up the others.
+* Every result (parsed JSON, exit status, time) is stored in SMART_TABLE and
+  DlcCase.check_SMART reuses one that is younger than SMART_MAX_AGE.
+* The attributes we track are also added to the time series in smart_trends.
+"""
+import json, socket, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from storage import db_cursor, db_transaction, SMART_TABLE
+import metrics
+import runner
+import smart_trends
+
+SMARTCTL = "/usr/sbin/smartctl"
+SMART_TIMEOUT = 60
+SMART_MAX_AGE = 3600
+SMART_WORKERS = 8
+
+#smartctl exit status bits (man smartctl, "RETURN VALUES")
+CMDLINE_ERROR = 1 << 0
+DEVICE_OPEN_FAILED = 1 << 1
+SMART_COMMAND_FAILED = 1 << 2
+DISK_FAILING = 1 << 3
+
+
+def device_path(block_dev: str) -> str:
+    return block_dev if block_dev.startswith('/dev/') else '/dev/' + str(block_dev)
+
+
+@dataclass
+class SmartResult:
+    device: str
+    collected_at: float
+    exit_status: Optional[int] = None
+    data: Optional[dict] = None
+    error: Optional[str] = None
+    hostname: Optional[str] = None
+
+    @property
+    def serial(self) -> Optional[str]:
+        return (self.data or {}).get('serial_number')
+
+    @property
+    def passed(self) -> Optional[bool]:
+        return (self.data or {}).get('smart_status', {}).get('passed')
+
+    @property
+    def message(self) -> Optional[str]:
+        #First message smartctl gave us, used when it couldn't talk to the device at all
+        messages = (self.data or {}).get('smartctl', {}).get('messages') or []
+        return messages[0].get('string') if messages else None
+
+    @property
+    def ie_string(self) -> Optional[str]:
+        #Only SCSI/SAS devices report an informational exception string
+        return (self.data or {}).get('smart_status', {}).get('scsi', {}).get('ie_string')
+
+
+def run_smartctl(block_dev: str, *, timeout: float = SMART_TIMEOUT) -> SmartResult:
+    device = device_path(block_dev)
+    result = SmartResult(device = device, collected_at = time.time(), hostname = socket.gethostname())
+    cmd = [SMARTCTL, "-a", "-j", device]
+
+    #runner records the call as the subprocess span with step=smartctl
+    R = runner.run(cmd, timeout = timeout, step = "smartctl")
+    if R.error is not None:
+        result.error = R.error
+        return result
+    if R.timed_out:
+        result.error = f"smartctl timed out after {timeout}s on {device}"
+        metrics.count("smartctl_timeouts")
+        return result
+
+    result.exit_status = R.returncode
+    try:
+        result.data = json.loads(R.stdout)
+    except ValueError:
+        result.error = f"smartctl returned no JSON for {device} (exit status {R.returncode}): {R.stderr.strip()}"
+        return result
+
+    #smartctl reports the same bits in its JSON, prefer those if they are there
+    result.exit_status = result.data.get('smartctl', {}).get('exit_status', R.returncode)
+    return result
+
+
+def store(results: Iterable[SmartResult]):
+    results = list(results)
+    rows = [
+        {
+            "hostname": r.hostname,
+            "device": r.device,
+            "serial": r.serial,
+            "collected_at": r.collected_at,
+            "exit_status": r.exit_status,
+            "passed": r.passed,
+            "error": r.error,
+            "json": json.dumps(r.data) if r.data is not None else None,
+        }
+        for r in results
+    ]
+    if not rows:
+        return
+    columns = ", ".join(rows[0].keys())
+    placeholders = ", ".join([f":{key}" for key in rows[0].keys()])
+    with db_transaction() as cur:
+        cur.executemany(f"INSERT INTO {SMART_TABLE} ({columns}) VALUES ({placeholders})", rows)
+        smart_trends.insert(cur, results)
+
+
+def collect(block_devs: Iterable[str], *, max_workers: int = SMART_WORKERS, timeout: float = SMART_TIMEOUT) -> dict:
+    """
+    Runs smartctl on every device in parallel and stores the results.
+    Returns {device path: SmartResult}. Timeouts and failures are in SmartResult.error, nothing is raised.
+    """
+    devices = list(dict.fromkeys(device_path(d) for d in block_devs))
+    if not devices:
+        return {}
+    with ThreadPoolExecutor(max_workers = min(max_workers, len(devices))) as pool:
+        results = list(pool.map(lambda d: run_smartctl(d, timeout = timeout), devices))
+    #Stored from this thread once all workers are done, so the pool never touches SQLite
+    store(results)
+    return {r.device: r for r in results}
+
+
+def latest(block_dev: str, *, max_age: float = SMART_MAX_AGE, hostname: Optional[str] = None) -> Optional[SmartResult]:
+    #Most recent successful result for the device that is younger than max_age
+    hostname = hostname or socket.gethostname()
+    with db_cursor() as cur:
+        cur.execute(
+            f"""
+                SELECT * FROM {SMART_TABLE}
+                WHERE hostname = ? AND device = ? AND collected_at >= ? AND error IS NULL
+                ORDER BY collected_at DESC LIMIT 1
+            """, (hostname, device_path(block_dev), time.time() - max_age)
+        )
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return _from_row(row)
+
+
+def latest_by_device(hostname: Optional[str] = None) -> dict:
+    #{device path: most recent successful result} for every device of the host, however old, in one query
+    hostname = hostname or socket.gethostname()
+    with db_cursor() as cur:
+        cur.execute(
+            f"""
+                SELECT s.* FROM {SMART_TABLE} AS s
+                JOIN (
+                    SELECT device, MAX(collected_at) AS collected_at FROM {SMART_TABLE}
+                    WHERE hostname = ? AND error IS NULL GROUP BY device
+                ) AS last ON s.device = last.device AND s.collected_at = last.collected_at
+                WHERE s.hostname = ? AND s.error IS NULL
+            """, (hostname, hostname)
+        )
+        return {row["device"]: _from_row(row) for row in cur.fetchall()}
+
+
+def _from_row(row) -> SmartResult:
+    return SmartResult(
+        device = row["device"],
+        collected_at = row["collected_at"],
+        exit_status = row["exit_status"],
+        data = json.loads(row["json"]) if row["json"] is not None else None,
+        error = row["error"],
+        hostname = row["hostname"],
+    )
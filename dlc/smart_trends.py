@@ -0,0 +1,233 @@
+"""
+SMART attributes kept as time series per drive serial:
+* Every stored smartctl result also adds one narrow row per tracked attribute to
+  SMART_ATTR_TABLE (attribute code, serial, time, value), clustered by attribute and
+  serial so one attribute across the fleet is a single range scan.
+* degrading() answers "is this drive getting worse" with plain SQL, check_SMART uses it.
+* load() and growth_rates() read a whole attribute into NumPy arrays and fit a growth
+  rate per drive in one vectorized pass. NumPy is only needed for these
+  (pip install dlc[trends]) and is imported when they are called.
+"""
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from storage import db_cursor, db_transaction, SMART_ATTR_TABLE, SMART_DEVICE_TABLE, SMART_TABLE
+
+#Codes are stored in the database, never renumber them
+ATTRIBUTES = {
+    "reallocated_sectors": 1,
+    "pending_sectors": 2,
+    "offline_uncorrectable": 3,
+    "crc_errors": 4,
+    "power_on_hours": 5,
+    "temperature": 6,
+    "media_errors": 7,
+    "percentage_used": 8,
+    "grown_defects": 9,
+    "uncorrected_read_errors": 10,
+}
+
+#ATA attribute ids (raw values) we keep
+_ATA_IDS = {5: "reallocated_sectors", 197: "pending_sectors", 198: "offline_uncorrectable", 199: "crc_errors"}
+
+#Any growth of these within TREND_WINDOW counts against the drive
+DEGRADING = {
+    "reallocated_sectors": 1,
+    "pending_sectors": 1,
+    "offline_uncorrectable": 1,
+    "media_errors": 1,
+    "grown_defects": 1,
+}
+TREND_WINDOW = 30 * 86400
+DAY = 86400.0
+
+
+def extract(data: dict) -> dict:
+    #{attribute name: value} for the attributes smartctl reported (ATA, NVMe or SCSI)
+    values = {}
+    for row in (data.get("ata_smart_attributes") or {}).get("table") or []:
+        name = _ATA_IDS.get(row.get("id"))
+        raw = (row.get("raw") or {}).get("value")
+        if name is not None and raw is not None:
+            values[name] = raw
+
+    hours = (data.get("power_on_time") or {}).get("hours")
+    if hours is not None:
+        values["power_on_hours"] = hours
+    temperature = (data.get("temperature") or {}).get("current")
+    if temperature is not None:
+        values["temperature"] = temperature
+
+    nvme = data.get("nvme_smart_health_information_log") or {}
+    for name in ("media_errors", "percentage_used"):
+        if nvme.get(name) is not None:
+            values[name] = nvme[name]
+    if "power_on_hours" not in values and nvme.get("power_on_hours") is not None:
+        values["power_on_hours"] = nvme["power_on_hours"]
+
+    if data.get("scsi_grown_defect_list") is not None:
+        values["grown_defects"] = data["scsi_grown_defect_list"]
+    uncorrected = ((data.get("scsi_error_counter_log") or {}).get("read") or {}).get("total_uncorrected_errors")
+    if uncorrected is not None:
+        values["uncorrected_read_errors"] = uncorrected
+    return values
+
+
+def insert(cur, results: Iterable):
+    #Called by smart.store() inside its transaction. results: SmartResult objects with a serial.
+    samples, devices = [], []
+    for r in results:
+        if not r.serial or r.data is None:
+            continue
+        for name, value in extract(r.data).items():
+            samples.append((ATTRIBUTES[name], r.serial, r.collected_at, int(value)))
+        devices.append((r.serial, r.hostname, r.device, r.data.get("model_name"), r.collected_at, r.collected_at))
+    if samples:
+        #Same drive, same second, same attribute: the first sample wins
+        cur.executemany(f"INSERT OR IGNORE INTO {SMART_ATTR_TABLE} (attribute, serial, collected_at, value) VALUES (?, ?, ?, ?)", samples)
+    if devices:
+        cur.executemany(
+            f"""
+                INSERT INTO {SMART_DEVICE_TABLE} (serial, hostname, device, model, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(serial) DO UPDATE SET
+                    hostname = CASE WHEN excluded.last_seen >= last_seen THEN excluded.hostname ELSE hostname END,
+                    device = CASE WHEN excluded.last_seen >= last_seen THEN excluded.device ELSE device END,
+                    model = COALESCE(excluded.model, model),
+                    first_seen = MIN(first_seen, excluded.first_seen),
+                    last_seen = MAX(last_seen, excluded.last_seen)
+            """, devices
+        )
+
+
+def backfill() -> int:
+    #Samples for smartctl results stored before the attribute table existed; returns how many results were read
+    import json
+    from smart import SmartResult
+
+    with db_cursor() as cur:
+        rows = cur.execute(f"SELECT hostname, device, collected_at, json FROM {SMART_TABLE} WHERE json IS NOT NULL").fetchall()
+    results = [
+        SmartResult(device = row["device"], collected_at = row["collected_at"], data = json.loads(row["json"]), hostname = row["hostname"])
+        for row in rows
+    ]
+    with db_transaction() as cur:
+        insert(cur, results)
+    return len(results)
+
+
+def degrading(serial: str, *, window: float = TREND_WINDOW, limits: Optional[dict] = None, now: Optional[float] = None) -> List[str]:
+    """Reasons (empty if none) why the drive's error counters grew within `window` seconds."""
+    limits = DEGRADING if limits is None else limits
+    codes = {ATTRIBUTES[name]: name for name in limits}
+    since = (now or time.time()) - window
+    with db_cursor() as cur:
+        cur.execute(
+            f"""
+                SELECT attribute, MIN(value) AS low, MAX(value) AS high FROM {SMART_ATTR_TABLE}
+                WHERE attribute IN ({", ".join("?" * len(codes))}) AND serial = ? AND collected_at >= ?
+                GROUP BY attribute
+            """, (*codes, serial, since)
+        )
+        rows = cur.fetchall()
+    reasons = []
+    for row in rows:
+        name = codes[row["attribute"]]
+        if row["high"] - row["low"] >= limits[name]:
+            reasons.append(f"{name} went from {row['low']} to {row['high']} in the last {window / DAY:g} days")
+    return reasons
+
+
+# ---------- fleet-wide queries (NumPy) ----------
+@dataclass
+class Series:
+    #Samples of one attribute for many drives, sorted by serial then time. Drive i owns times[offsets[i]:offsets[i + 1]].
+    attribute: str
+    serials: list
+    offsets: "numpy.ndarray"
+    times: "numpy.ndarray"
+    values: "numpy.ndarray"
+
+
+@dataclass
+class Trend:
+    serial: str
+    samples: int
+    first: float
+    last: float
+    per_day: float
+    first_seen: float
+    last_seen: float
+
+
+def load(attribute: str, *, since: Optional[float] = None, hostnames: Optional[Iterable[str]] = None,
+        serials: Optional[Iterable[str]] = None) -> Series:
+    import numpy as np
+
+    sql = f"SELECT serial, collected_at, value FROM {SMART_ATTR_TABLE} WHERE attribute = ?"
+    params = [ATTRIBUTES[attribute]]
+    if since is not None:
+        sql += " AND collected_at >= ?"
+        params.append(since)
+    if hostnames is not None:
+        hostnames = list(hostnames)
+        sql += f" AND serial IN (SELECT serial FROM {SMART_DEVICE_TABLE} WHERE hostname IN ({', '.join('?' * len(hostnames))}))"
+        params += hostnames
+    if serials is not None:
+        serials = list(serials)
+        sql += f" AND serial IN ({', '.join('?' * len(serials))})"
+        params += serials
+    sql += " ORDER BY serial, collected_at"
+
+    with db_cursor() as cur:
+        #Plain tuples straight from the cursor into one structured array, no list of rows in between
+        cur.row_factory = None
+        rows = np.fromiter(cur.execute(sql, params), dtype = [("serial", object), ("time", np.float64), ("value", np.float64)])
+    n = len(rows)
+    serial = rows["serial"]
+
+    #Rows come sorted by serial, a drive starts wherever the serial changes
+    starts = np.flatnonzero(serial[1:] != serial[:-1]) + 1
+    offsets = np.concatenate(([0] if n else [], starts, [n])).astype(np.int64)
+    return Series(attribute, serial[offsets[:-1]].tolist(), offsets, rows["time"].copy(), rows["value"].copy())
+
+
+def growth_rates(attribute: str, *, since: Optional[float] = None, hostnames: Optional[Iterable[str]] = None,
+        min_samples: int = 2) -> List[Trend]:
+    """
+    Least-squares growth per day of `attribute` for every drive with at least
+    min_samples samples, fastest growing first.
+    """
+    import numpy as np
+
+    series = load(attribute, since = since, hostnames = hostnames)
+    if not series.serials:
+        return []
+    starts = series.offsets[:-1]
+    counts = np.diff(series.offsets)
+    days = series.times / DAY
+    y = series.values
+
+    #Times centred per drive, so the fit doesn't lose precision to large epoch values
+    mean_t = np.add.reduceat(days, starts) / counts
+    t = days - np.repeat(mean_t, counts)
+    sxx = np.add.reduceat(t * t, starts)
+    sxy = np.add.reduceat(t * y, starts)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        slope = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1), 0.0)
+
+    ends = series.offsets[1:] - 1
+    keep = np.nonzero(counts >= min_samples)[0]
+    order = keep[np.argsort(-slope[keep], kind = "stable")]
+    return [
+        Trend(
+            serial = series.serials[i],
+            samples = int(counts[i]),
+            first = float(y[starts[i]]),
+            last = float(y[ends[i]]),
+            per_day = float(slope[i]),
+            first_seen = float(series.times[starts[i]]),
+            last_seen = float(series.times[ends[i]]),
+        )
+        for i in order
+    ]
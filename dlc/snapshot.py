@@ -0,0 +1,166 @@
+"""
+One view of the cluster shared by every case in a process:
+* Builds hwinv.HWInv() and cc.CephOsdMap once instead of once per case.
+* Evaluates cc.CephState().is_clean() at most once.
+* ClusterSnapshot.load() reuses the OSD map saved under ~/.dlc/ by an earlier
+  process, as long as the osdmap epoch hasn't changed and the file is younger
+  than CACHE_TTL.
+* Hostname and host serial come from host_cache, which is valid until the next reboot.
+"""
+import json, os, pickle, socket, tempfile, time
+from pathlib import Path
+from typing import Optional
+
+#ceph-util import. hwinv is imported only when a snapshot has to be built, a cache hit doesn't need it.
+import ceph_common as cc
+import metrics
+import host_cache
+import runner
+from errors import CommandError
+from osd_index import OsdIndex
+
+#Keyed by hostname in case ~/.dlc is on a home directory shared between nodes
+_CACHE_PATH = Path.home() / ".dlc" / f"osdmap-{socket.gethostname()}.pickle"
+CACHE_TTL = 300
+_CACHE_FORMAT = 2
+
+
+def osdmap_epoch() -> Optional[int]:
+    #`ceph osd stat` only returns counters and the epoch, so it is much cheaper than building a CephOsdMap
+    try:
+        R = runner.run(["ceph", "osd", "stat", "--format", "json"], timeout = 10, step = "osd_stat", check = True)
+        stat = json.loads(R.stdout)
+    except (CommandError, ValueError):
+        return None
+    #Older releases nest the counters under "osdmap"
+    stat = stat.get("osdmap", stat)
+    epoch = stat.get("epoch")
+    return int(epoch) if epoch is not None else None
+
+
+class ClusterSnapshot:
+    def __init__(self, hw=None, osd_map=None, *, epoch=None, refresh_host: bool = False):
+        self._hw = hw
+        self._host: Optional[host_cache.HostIdentity] = None
+        self._refresh_host = refresh_host
+        if osd_map is None:
+            with metrics.span("osdmap_build"):
+                osd_map = cc.CephOsdMap(self.hw)
+        self.OsdMap = osd_map
+        self.epoch = epoch
+        self._is_clean: Optional[bool] = None
+        self._usage = None
+        self._index: Optional[OsdIndex] = None
+        self._local_index: Optional[OsdIndex] = None
+
+    @property
+    def hw(self):
+        #A snapshot read from the cache only builds HWInv if something actually needs it
+        if self._hw is None:
+            import hwinv
+            with metrics.span("hwinv"):
+                self._hw = hwinv.HWInv()
+        return self._hw
+
+    @property
+    def host(self) -> host_cache.HostIdentity:
+        #The boot-scoped cache wins; HWInv/dmidecode only run on a miss (and reuse our HWInv if we built one)
+        if self._host is None:
+            self._host = host_cache.load(self._hw, refresh = self._refresh_host)
+        return self._host
+
+    @property
+    def hostname(self):
+        return self.host.hostname
+
+    @property
+    def host_serial(self):
+        return self.host.serial
+
+    @property
+    def index(self) -> OsdIndex:
+        #Whole cluster, used to resolve NEW cases
+        if self._index is None:
+            self._index = OsdIndex(self.OsdMap.osd_map)
+        return self._index
+
+    @property
+    def local_index(self) -> OsdIndex:
+        #This host only, used once a case has to be worked on here
+        if self._local_index is None:
+            self._local_index = OsdIndex(self.OsdMap.osd_map_local)
+            self._local_index.add_host_serial(self.hostname, self.host_serial)
+        return self._local_index
+
+    @staticmethod
+    @metrics.timed("cluster_health")
+    def is_cluster_clean() -> bool:
+        return bool(cc.CephState().is_clean())
+
+    def is_clean(self) -> bool:
+        #Every case waiting on cluster health sees the same answer within one sweep
+        if self._is_clean is None:
+            self._is_clean = self.is_cluster_clean()
+        return self._is_clean
+
+    @property
+    def usage(self):
+        #OSD usage and failure domains for drain admission, read at most once per snapshot
+        if self._usage is None:
+            import drain
+            self._usage = drain.ClusterUsage.load()
+        return self._usage
+
+    # ---------- on-disk cache ----------
+    @classmethod
+    def load(cls, *, refresh: bool = False, ttl: float = CACHE_TTL) -> "ClusterSnapshot":
+        epoch = osdmap_epoch()
+        if not refresh:
+            cached = cls._read_cache(epoch, ttl)
+            if cached is not None:
+                metrics.count("snapshot_cache", result = "hit")
+                return cached
+        metrics.count("snapshot_cache", result = "refresh" if refresh else "miss")
+
+        snapshot = cls(epoch = epoch, refresh_host = refresh)
+        snapshot._write_cache()
+        return snapshot
+
+    @classmethod
+    def _read_cache(cls, epoch, ttl) -> Optional["ClusterSnapshot"]:
+        try:
+            with open(_CACHE_PATH, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        if not isinstance(data, dict) or data.get("format") != _CACHE_FORMAT:
+            return None
+        if time.time() - data["created"] > ttl:
+            return None
+        #Without an epoch (ceph osd stat failed) only the TTL protects us
+        if epoch is not None and data["epoch"] != epoch:
+            return None
+
+        return cls(osd_map = data["OsdMap"], epoch = data["epoch"])
+
+    def _write_cache(self):
+        data = {
+            "format": _CACHE_FORMAT,
+            "created": time.time(),
+            "epoch": self.epoch,
+            "OsdMap": self.OsdMap,
+        }
+        _CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        #Write to a temp file and rename so concurrent readers see either the old or the new snapshot, never half of one
+        fd, tmp = tempfile.mkstemp(dir = _CACHE_PATH.parent, prefix = _CACHE_PATH.name, suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(data, f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, _CACHE_PATH)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            print("Could not cache the OSD map snapshot, continuing without it: {}".format(e))
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,40 @@
+"""
+Case states, actions and wait reasons. No ceph-util imports, so read-only
+commands can use these without loading the cluster modules.
+"""
+from enum import Enum
+
+class State(str, Enum):
+    #OSD failure -> Log failure into database -> start resolution 'Change OSD/disk attributes' (CRUSH weight, etc.) -> wait ceph health (totally clean) -> re-check OSD/disk attributes (OSD reweighted, disk not missing, etc.) -> remove OSD (osd-remove --replace) -> check failure type (IO error?) -> check smartctl -> test disk? -> test results...
+    #There should be a case state plus an action for any one point in time.
+
+    NEW = "NEW" 
+    NEW_DETAIL = "NEW-DETAILS"
+    RECOVERY_WAIT = "RECOVERY-WAIT"
+    RECOVERY_DONE = "RECOVERY-DONE"
+    OSD_REMOVED = "OSD-REMOVED"
+    DRIVE_TESTING = "DRIVE-TESTING"
+    TEST_DONE = "TEST-DONE"
+    REPLACE_DRIVE = "REPLACE-DRIVE"
+    WAIT_FOR_REPLACE = "WAIT-FOR_REPLACE"
+    REBUILD_OSD = "REBUILD-OSD"
+    RESOLVED = "RESOLVED"
+    OPERATOR_NEEDED = "OPERATOR-NEEDED"
+
+class Action(str, Enum):
+    logging = "Logging info"
+    testing_disk = "Testing disk"
+    checking_info = "Checking for information"
+    checking_smart = "Checking SMART Health"
+    editing_OSD = "Editing OSD"
+    operator_handoff = "Handing to operator"
+    removing_OSD = "Removing OSD"
+    reweighting_OSD = "Reweighting OSD"
+    none = None
+
+class WaitReason(str, Enum):
+    cluster_health = "Waiting for 'HEALTH_OK'"
+    disk_test_completion = "Waiting for disk test to finish"
+    disk_replacement_completion = "Waiting for disk replacement"
+    drain_budget = "Waiting for drain budget"
+    none = None
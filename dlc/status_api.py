@@ -0,0 +1,229 @@
+"""
+Read-only status of the dlc cases on this node for monitoring (`dlc status-server`):
+* StatusView keeps the active cases, the count per state and the recent state
+  transitions in memory.
+* refresh() only queries SQLite when PRAGMA data_version says another connection
+  committed, and then only for rows updated since the last refresh (ix_case_updated).
+  A full reload every `resync` seconds picks up rows changed behind our back.
+* Responses are rendered once per change, so a scrape is a dict lookup and a write.
+* Plain HTTP/1.0 over a Unix socket (curl --unix-socket) or on localhost:
+  GET /status, /cases[?state=&hostname=], /cases/<case_id>, /transitions, /metrics.
+Nothing here imports ceph-util, and serve() opens the database read-only, so it
+never migrates or writes it (another dlc command has to create it first).
+"""
+import asyncio, json, os, signal, time
+from collections import Counter, deque
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from records import iter_records, query_records
+from storage import get_conn, read_only
+from metrics import PREFIX, format_labels
+
+SOCKET_PATH = os.path.join(os.path.expanduser("~"), ".dlc", "status.sock")
+INTERVAL = 2.0
+#Another process may commit a row whose updated_at is a little older than one we have already seen
+LOOKBACK = 30.0
+RESYNC = 300.0
+TRANSITIONS = 200
+REQUEST_TIMEOUT = 5.0
+
+JSON = "application/json"
+TEXT = "text/plain; version=0.0.4"
+
+
+class StatusView:
+    def __init__(self, *, transitions: int = TRANSITIONS, lookback: float = LOOKBACK, resync: float = RESYNC):
+        self.cases = {}
+        self.transitions = deque(maxlen = transitions)
+        self.lookback = lookback
+        self.resync = resync
+        self.refreshed_at: Optional[float] = None
+        self._since: Optional[float] = None
+        self._synced_at: Optional[float] = None
+        self._data_version = None
+        self._rendered = {}
+
+    # ---------- keeping up with the database ----------
+    def _apply(self, record, now: float) -> bool:
+        old = self.cases.get(record.case_id)
+        if old is not None and old.version == record.version and old.active == record.active:
+            return False
+        if old is None and not record.active:
+            #Opened and closed between two refreshes, or closed long ago
+            return False
+        if old is None or old.state != record.state or not record.active:
+            self.transitions.append({
+                "case_id": record.case_id,
+                "hostname": record.hostname,
+                "osd_id": record.osd_id,
+                "from": old.state if old is not None else None,
+                "to": record.state,
+                "active": bool(record.active),
+                "at": record.updated_at or now,
+            })
+        if record.active:
+            self.cases[record.case_id] = record
+        else:
+            del self.cases[record.case_id]
+        return True
+
+    def refresh(self, *, now: Optional[float] = None) -> bool:
+        """Brings the view up to date, True if anything changed."""
+        now = time.time() if now is None else now
+        #Per connection, so every refresh has to run on the same thread (serve() runs it on the event loop)
+        data_version = get_conn().execute("PRAGMA data_version").fetchone()[0]
+        full = self._synced_at is None or now - self._synced_at >= self.resync
+        if not full and data_version == self._data_version:
+            self.refreshed_at = now
+            return False
+
+        changed = False
+        if full:
+            records = list(query_records())
+            seen = {r.case_id for r in records}
+            for case_id in set(self.cases) - seen:
+                #Gone without us seeing it closed (archived, deleted)
+                del self.cases[case_id]
+                changed = True
+            self._synced_at = now
+        else:
+            records = iter_records("updated_at >= ?", (self._since - self.lookback,))
+        for record in records:
+            changed |= self._apply(record, now)
+            if record.updated_at is not None:
+                self._since = max(self._since or 0.0, record.updated_at)
+        if self._since is None:
+            self._since = now
+
+        self._data_version = data_version
+        self.refreshed_at = now
+        if changed:
+            self._rendered.clear()
+        return changed
+
+    # ---------- answers ----------
+    def state_counts(self) -> dict:
+        return dict(sorted(Counter(r.state for r in self.cases.values()).items()))
+
+    def _render(self, key: str) -> bytes:
+        if key == "/status":
+            oldest = min((r.updated_at for r in self.cases.values() if r.updated_at is not None), default = None)
+            body = {
+                "cases": len(self.cases),
+                "states": self.state_counts(),
+                "oldest_update": oldest,
+                "transitions": len(self.transitions),
+            }
+        elif key == "/cases":
+            body = [r._asdict() for r in self.cases.values()]
+        elif key == "/transitions":
+            body = list(self.transitions)
+        elif key == "/metrics":
+            lines = [f"# HELP {PREFIX}_active_cases Active cases per state", f"# TYPE {PREFIX}_active_cases gauge"]
+            for state, n in self.state_counts().items():
+                lines.append(f"{PREFIX}_active_cases{format_labels([('state', state)])} {n}")
+            return ("\n".join(lines) + "\n").encode()
+        return json.dumps(body).encode()
+
+    def respond(self, method: str, target: str):
+        #(HTTP status, content type, body) for one request
+        if method not in ("GET", "HEAD"):
+            return 405, JSON, b'{"error": "read-only"}'
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/status"
+        query = parse_qs(url.query)
+
+        if path == "/cases" and query:
+            state, hostname = query.get("state", [None])[0], query.get("hostname", [None])[0]
+            cases = [r._asdict() for r in self.cases.values()
+                    if (state is None or r.state == state) and (hostname is None or r.hostname == hostname)]
+            return 200, JSON, json.dumps(cases).encode()
+        if path.startswith("/cases/"):
+            try:
+                record = self.cases.get(int(path[len("/cases/"):]))
+            except ValueError:
+                record = None
+            if record is None:
+                return 404, JSON, b'{"error": "no active case with that id"}'
+            return 200, JSON, json.dumps(record._asdict()).encode()
+        if path not in ("/status", "/cases", "/transitions", "/metrics"):
+            return 404, JSON, b'{"error": "unknown path"}'
+
+        body = self._rendered.get(path)
+        if body is None:
+            body = self._rendered[path] = self._render(path)
+        return 200, TEXT if path == "/metrics" else JSON, body
+
+
+# ---------- serving ----------
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+async def _handle(view: StatusView, reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout = REQUEST_TIMEOUT)
+        #Headers are read and ignored
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout = REQUEST_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2:
+            status, content_type, body = view.respond(parts[0], parts[1])
+        else:
+            status, content_type, body = 400, JSON, b'{"error": "bad request"}'
+        head = (
+            f"HTTP/1.0 {status} {_REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        ).encode()
+        writer.write(head if parts and parts[0] == "HEAD" else head + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(view: Optional[StatusView] = None, *, socket_path: Optional[str] = None, host: str = "127.0.0.1",
+        port: Optional[int] = None, interval: float = INTERVAL, stop: Optional[asyncio.Event] = None):
+    view = view or StatusView()
+    stop = stop or asyncio.Event()
+    #Opened with mode=ro, so serving can't migrate or write the database (all of it runs on this thread)
+    with read_only():
+        view.refresh()
+
+        handler = lambda reader, writer: _handle(view, reader, writer)
+        if socket_path is not None:
+            #A socket left behind by a previous run would make the bind fail
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(handler, path = socket_path)
+        else:
+            server = await asyncio.start_server(handler, host, port)
+
+        try:
+            async with server:
+                while not stop.is_set():
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout = interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    try:
+                        view.refresh()
+                    except Exception as e:
+                        #Scrapes keep getting the last good view
+                        print("dlc status refresh failed: {}: {}".format(type(e).__name__, e))
+        finally:
+            if socket_path is not None and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+def run(**kwargs):
+    async def _main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await serve(stop = stop, **kwargs)
+    asyncio.run(_main())
@@ -1,21 +1,28 @@
 """
 Very small wrapper around sqlite3:
-* Ensures schema is present.
+* One connection per thread, reused for every statement in the process.
+* Brings the schema up to date once per database via PRAGMA user_version.
+* read_only() opens the thread's connection with mode=ro for readers that must never write.
 * Yields a cursor that commits/rolls back automatically.
 """
 from contextlib import contextmanager
-import os, sqlite3
+import itertools, os, sqlite3, threading
 from pathlib import Path
 
+import metrics
+
 _DB_PATH = Path.home() / ".dlc" / "dlc.sqlite"
 _DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
 TABLE_NAME = "testing_table"
 HISTORY_TABLE = "history_testing_table"
+SMART_TABLE = "smart_results"
+DRIVE_TEST_TABLE = "drive_tests"
+SMART_ATTR_TABLE = "smart_attributes"
+SMART_DEVICE_TABLE = "smart_devices"
+ARCHIVE_INDEX_TABLE = "archived_cases"
 
 DDL = f"""
-PRAGMA foreign_keys = ON;
-
 CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
     case_id          INTEGER PRIMARY KEY AUTOINCREMENT,
     hostname         TEXT DEFAULT NULL,
@@ -58,21 +65,289 @@ CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
 """
 
 
+#Schema changes go at the end of this list and are never edited once released. Entry i brings user_version from i to i + 1.
+MIGRATIONS = [
+    DDL,
+    f"""
+    CREATE TABLE IF NOT EXISTS {SMART_TABLE} (
+        result_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+        hostname         TEXT DEFAULT NULL,
+        device           TEXT NOT NULL,
+        serial           TEXT DEFAULT NULL,
+        collected_at     REAL NOT NULL,
+        exit_status      INTEGER DEFAULT NULL,
+        passed           INTEGER DEFAULT NULL,
+        error            TEXT DEFAULT NULL,
+        json             TEXT DEFAULT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS ix_smart_device_time
+        ON {SMART_TABLE}(hostname, device, collected_at);
+    """,
+    #Per-case version numbers and the time each version took effect. History rows keep the version and time they had while current.
+    f"""
+    ALTER TABLE {TABLE_NAME} ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE {TABLE_NAME} ADD COLUMN updated_at REAL DEFAULT NULL;
+    ALTER TABLE {HISTORY_TABLE} ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE {HISTORY_TABLE} ADD COLUMN updated_at REAL DEFAULT NULL;
+
+    UPDATE {HISTORY_TABLE} SET version = (
+        SELECT COUNT(*) FROM {HISTORY_TABLE} AS h
+        WHERE h.case_id = {HISTORY_TABLE}.case_id AND h.rowid <= {HISTORY_TABLE}.rowid
+    );
+    UPDATE {TABLE_NAME} SET version = 1 + (
+        SELECT COUNT(*) FROM {HISTORY_TABLE} AS h WHERE h.case_id = {TABLE_NAME}.case_id
+    );
+
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_history_case_version
+        ON {HISTORY_TABLE}(case_id, version);
+
+    CREATE INDEX IF NOT EXISTS ix_history_case_time
+        ON {HISTORY_TABLE}(case_id, updated_at);
+    """,
+    #Background disk tests (drive_tests.py) and their outcome on the case
+    f"""
+    CREATE TABLE IF NOT EXISTS {DRIVE_TEST_TABLE} (
+        job_id           INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id          INTEGER NOT NULL,
+        hostname         TEXT NOT NULL,
+        device           TEXT NOT NULL,
+        controller       TEXT NOT NULL DEFAULT 'unknown',
+        kind             TEXT NOT NULL,
+        status           TEXT NOT NULL DEFAULT 'queued',
+        submitted_at     REAL NOT NULL,
+        started_at       REAL DEFAULT NULL,
+        finished_at      REAL DEFAULT NULL,
+        progress         REAL DEFAULT NULL,
+        passed           INTEGER DEFAULT NULL,
+        handle           TEXT DEFAULT NULL,
+        result           TEXT DEFAULT NULL,
+        error            TEXT DEFAULT NULL
+    );
+
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_drive_test_open_case
+        ON {DRIVE_TEST_TABLE}(case_id)
+        WHERE finished_at IS NULL;
+
+    CREATE INDEX IF NOT EXISTS ix_drive_test_host_status
+        ON {DRIVE_TEST_TABLE}(hostname, status);
+
+    ALTER TABLE {TABLE_NAME} ADD COLUMN test_passed TEXT DEFAULT NULL;
+    ALTER TABLE {HISTORY_TABLE} ADD COLUMN test_passed TEXT DEFAULT NULL;
+    """,
+    #SMART attribute time series (smart_trends.py): one narrow row per sample, clustered by attribute and drive
+    f"""
+    CREATE TABLE IF NOT EXISTS {SMART_ATTR_TABLE} (
+        attribute        INTEGER NOT NULL,
+        serial           TEXT NOT NULL,
+        collected_at     REAL NOT NULL,
+        value            INTEGER NOT NULL,
+        PRIMARY KEY (attribute, serial, collected_at)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS {SMART_DEVICE_TABLE} (
+        serial           TEXT PRIMARY KEY,
+        hostname         TEXT DEFAULT NULL,
+        device           TEXT DEFAULT NULL,
+        model            TEXT DEFAULT NULL,
+        first_seen       REAL NOT NULL,
+        last_seen        REAL NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS ix_smart_device_host
+        ON {SMART_DEVICE_TABLE}(hostname);
+    """,
+    #Filters of `dlc list` (records.query_records). Each index ends in case_id, so a filtered page comes out in case_id order without a sort.
+    f"""
+    CREATE INDEX IF NOT EXISTS ix_case_active
+        ON {TABLE_NAME}(active, case_id);
+
+    CREATE INDEX IF NOT EXISTS ix_case_state
+        ON {TABLE_NAME}(state, case_id);
+
+    CREATE INDEX IF NOT EXISTS ix_case_hostname
+        ON {TABLE_NAME}(hostname, case_id);
+
+    CREATE INDEX IF NOT EXISTS ix_case_osd
+        ON {TABLE_NAME}(osd_id, case_id);
+
+    CREATE INDEX IF NOT EXISTS ix_case_updated
+        ON {TABLE_NAME}(updated_at);
+    """,
+    #Where each archived case went (archive.py). The case and its history live in the archive file named by `partition`.
+    f"""
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_INDEX_TABLE} (
+        case_id          INTEGER PRIMARY KEY,
+        partition        TEXT NOT NULL,
+        hostname         TEXT DEFAULT NULL,
+        osd_id           INTEGER DEFAULT NULL,
+        cluster          TEXT DEFAULT NULL,
+        resolved_at      REAL DEFAULT NULL,
+        archived_at      REAL NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS ix_archived_host
+        ON {ARCHIVE_INDEX_TABLE}(hostname, case_id);
+    """,
+    #DlcCase.save closes a case when it reaches RESOLVED; close the ones saved before it did
+    f"""
+    UPDATE {TABLE_NAME} SET active = 0 WHERE state = 'RESOLVED' AND active = 1;
+    """,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+#journal_mode can't be changed inside a transaction, so these run before the migrations
+PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA foreign_keys = ON;
+PRAGMA busy_timeout = 5000;
+PRAGMA temp_store = MEMORY;
+"""
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_checked = set()
+_savepoints = itertools.count()
+
+
+def _statements(script):
+    #executescript() commits first, so migrations are run statement by statement inside our own transaction
+    stmt = ""
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            yield stmt.strip()
+            stmt = ""
+    if stmt.strip():
+        yield stmt.strip()
+
+
+def _user_version(c) -> int:
+    return c.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _migrate(c):
+    if _user_version(c) >= SCHEMA_VERSION:
+        return
+    #IMMEDIATE takes the write lock, so a second process waits here and then sees the new user_version
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        version = _user_version(c)
+        for target, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            for stmt in _statements(script):
+                c.execute(stmt)
+            c.execute(f"PRAGMA user_version = {target}")
+        c.execute("COMMIT")
+    except BaseException:
+        c.execute("ROLLBACK")
+        raise
+
+
 def _open_conn():
+    if getattr(_local, "read_only", False):
+        return _open_read_only()
+    Path(_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
     c = sqlite3.connect(_DB_PATH, isolation_level=None)  # autocommit
     c.row_factory = sqlite3.Row
-    c.executescript(DDL)
+    c.executescript(PRAGMAS)
+    with _schema_lock:
+        if _DB_PATH not in _schema_checked:
+            _migrate(c)
+            _schema_checked.add(_DB_PATH)
+    return c
+
+
+def _open_read_only():
+    #mode=ro: no journal_mode change and no migrations, so the database has to exist and be up to date already
+    c = sqlite3.connect(Path(_DB_PATH).resolve().as_uri() + "?mode=ro", uri=True, isolation_level=None)
+    c.row_factory = sqlite3.Row
+    c.execute("PRAGMA busy_timeout = 5000")
+    version = _user_version(c)
+    if version < SCHEMA_VERSION:
+        c.close()
+        raise sqlite3.OperationalError(f"{_DB_PATH} is at schema version {version}, run any dlc command that writes to bring it to {SCHEMA_VERSION}")
+    return c
+
+
+def get_conn():
+    #The connection is rebuilt if _DB_PATH changed (tests point it at a temp file)
+    c = getattr(_local, "conn", None)
+    if c is None or _local.path != _DB_PATH:
+        if c is not None:
+            c.close()
+        c = _open_conn()
+        _local.conn = c
+        _local.path = _DB_PATH
     return c
 
 
+def close_conn():
+    c = getattr(_local, "conn", None)
+    if c is not None:
+        c.close()
+        _local.conn = None
+
+
+@contextmanager
+def read_only():
+    #Within the block this thread's connection is opened read-only: any write fails with sqlite3.OperationalError
+    previous = getattr(_local, "read_only", False)
+    close_conn()
+    _local.read_only = True
+    try:
+        yield
+    finally:
+        close_conn()
+        _local.read_only = previous
+
+
 @contextmanager
 def db_cursor():
-    conn = _open_conn()
-    cur = conn.cursor()
+    #Outside of db_transaction() every statement commits on its own
+    cur = get_conn().cursor()
     try:
-        yield cur
-        conn.commit()
+        with metrics.span("db_cursor"):
+            yield cur
     finally:
-        conn.close()
+        cur.close()
+
+
+@contextmanager
+def db_transaction():
+    """
+    Everything run on the yielded cursor commits together or not at all.
+    Nested calls become savepoints, so an inner failure only undoes the inner block.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    if conn.in_transaction:
+        #Only the outermost transaction is timed, savepoints are part of it
+        name = f"sp_{next(_savepoints)}"
+        cur.execute(f"SAVEPOINT {name}")
+        try:
+            yield cur
+        except BaseException:
+            cur.execute(f"ROLLBACK TO {name}")
+            cur.execute(f"RELEASE {name}")
+            raise
+        else:
+            cur.execute(f"RELEASE {name}")
+        finally:
+            cur.close()
+        return
 
-#_open_conn()
+    with metrics.span("db_transaction"):
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            yield cur
+        except BaseException:
+            #Some errors (e.g. SQLITE_FULL) already rolled the transaction back
+            if conn.in_transaction:
+                cur.execute("ROLLBACK")
+            raise
+        else:
+            cur.execute("COMMIT")
+        finally:
+            cur.close()
@@ -0,0 +1,133 @@
+"""
+Progress every active case on this host in one process:
+* One ClusterSnapshot (OSD map, host inventory, cluster health) for the whole sweep.
+* A failing case is recorded in its SweepResult instead of ending the sweep.
+* Background drive tests (drive_tests.step) are polled and started around the cases.
+* Cases ready to drain (NEW_DETAIL) are admitted together against the drain budget
+  (drain.py), so the OSDs of this host that fail together drain together.
+"""
+from dataclasses import dataclass, asdict
+from typing import Iterable, Optional
+
+from models import DlcCase, State, CaseError, CaseWaiting, ConcurrentUpdateError
+from snapshot import ClusterSnapshot
+import drive_tests
+import drain
+
+PROGRESSED = "progressed"
+UNCHANGED = "unchanged"
+WAITING = "waiting"
+OPERATOR_NEEDED = "operator-needed"
+FAILED = "failed"
+#Someone else saved the case first; nothing was written, the next run starts from their version
+CONFLICT = "conflict"
+
+
+@dataclass
+class SweepResult:
+    case_id: int
+    state_before: str
+    state_after: Optional[str]
+    outcome: str
+    message: Optional[str] = None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _state_value(state):
+    return state.value if isinstance(state, State) else state
+
+
+#Nothing for dlc to do until an operator steps in, or ever again
+IDLE_STATES = {State.OPERATOR_NEEDED, State.RESOLVED}
+
+
+def progress_case(case: DlcCase, snapshot: ClusterSnapshot, *, new_version: bool = True) -> SweepResult:
+    before = _state_value(case.state)
+    if case.state == State.OPERATOR_NEEDED:
+        return SweepResult(case.case_id, before, before, OPERATOR_NEEDED)
+    if case.state in IDLE_STATES:
+        return SweepResult(case.case_id, before, before, UNCHANGED)
+    try:
+        updated = case.progress(new_version=new_version, snapshot=snapshot)
+    except CaseWaiting as e:
+        return SweepResult(case.case_id, before, _state_value(case.state), WAITING, str(e))
+    except ConcurrentUpdateError as e:
+        return SweepResult(case.case_id, before, before, CONFLICT, str(e))
+    #ceph-util code may still call sys.exit, that must not end the sweep either
+    except (Exception, SystemExit) as e:
+        return SweepResult(case.case_id, before, _state_value(case.state), FAILED, f"{type(e).__name__}: {e}")
+
+    after = _state_value(case.state)
+    if case.state == State.OPERATOR_NEEDED:
+        outcome = OPERATOR_NEEDED
+    elif not updated or after == before:
+        outcome = UNCHANGED
+    else:
+        outcome = PROGRESSED
+    return SweepResult(case.case_id, before, after, outcome)
+
+
+def drain_batch(cases: Iterable[DlcCase], snapshot: ClusterSnapshot, cluster_name: str, *, new_version: bool = True) -> list:
+    """
+    Admits and drains the NEW_DETAIL cases among `cases` in one go. Returns a SweepResult for
+    each case it handled; the others (and everything if the batch fails) are left to progress_case.
+    """
+    #One operation for the batch: each case is checked against the cluster once, here, and not again by its saves
+    op = DlcCase.operation(snapshot)
+    ready = []
+    for case in cases:
+        if case.state != State.NEW_DETAIL:
+            continue
+        try:
+            if op.verify(case) and case.cluster == cluster_name:
+                ready.append(case)
+        #progress_case reports it
+        except (Exception, SystemExit):
+            pass
+    if not ready:
+        return []
+
+    before = {case.case_id: _state_value(case.state) for case in ready}
+    try:
+        plan = drain.drain_ready(ready, snapshot, new_version=new_version, op=op)
+    except (Exception, SystemExit) as e:
+        print("Draining {} cases together failed, progressing them one by one: {}: {}".format(len(ready), type(e).__name__, e))
+        return []
+
+    results = []
+    for case in ready:
+        after = _state_value(case.state)
+        if case.case_id in plan.waiting:
+            results.append(SweepResult(case.case_id, before[case.case_id], after, WAITING, plan.waiting[case.case_id]))
+        elif case.state == State.OPERATOR_NEEDED:
+            results.append(SweepResult(case.case_id, before[case.case_id], after, OPERATOR_NEEDED))
+        else:
+            results.append(SweepResult(case.case_id, before[case.case_id], after, PROGRESSED))
+    return results
+
+
+#case_ids limits the sweep to those cases (e.g. the batch a coordinator sent to this host)
+def sweep(snapshot: Optional[ClusterSnapshot] = None, *, new_version: bool = True, case_ids: Optional[Iterable[int]] = None) -> list:
+    if snapshot is None:
+        snapshot = ClusterSnapshot.load()
+
+    cluster_name, e = DlcCase._check_ceph_cluster()
+    if not cluster_name:
+        raise CaseError(e)
+
+    cases = DlcCase.load_active(snapshot.hostname, cluster_name)
+    if case_ids is not None:
+        wanted = set(case_ids)
+        cases = [case for case in cases if case.case_id in wanted]
+
+    #Tests that finished are recorded before their cases look, tests queued by this sweep start right after it
+    drive_tests.step(snapshot.hostname)
+    #Cases drained here have just started recovering, they aren't progressed again in this sweep
+    results = drain_batch(cases, snapshot, cluster_name, new_version=new_version)
+    handled = {r.case_id for r in results}
+    results += [progress_case(case, snapshot, new_version=new_version) for case in cases if case.case_id not in handled]
+    results.sort(key=lambda r: r.case_id)
+    drive_tests.step(snapshot.hostname)
+    return results
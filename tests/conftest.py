@@ -0,0 +1,44 @@
+import copy
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+FAKES = ROOT / "benchmarks" / "fakes"
+
+#dlc's modules import each other by flat name (`from storage import db_cursor`), as when run from inside dlc/
+sys.path.insert(0, str(ROOT / "dlc"))
+
+
+@pytest.fixture(autouse=True)
+def tmp_db(monkeypatch, tmp_path):
+    #Every test gets its own database instead of ~/.dlc/dlc.sqlite, and its connection is closed after it
+    import storage
+
+    monkeypatch.setattr(storage, "_DB_PATH", tmp_path / "db.sqlite")
+    yield
+    storage.close_conn()
+
+
+@pytest.fixture
+def cluster(monkeypatch, tmp_path, tmp_db):
+    #The benchmark's stand-ins for ceph-util, smartctl and the ceph CLI (benchmarks/fakes/), so models can be
+    #imported and cases driven through their states. Two hosts of four OSDs, this host is host000, and
+    #everything else dlc keeps under ~/.dlc goes to tmp_path too.
+    monkeypatch.syspath_prepend(str(FAKES))
+    monkeypatch.setenv("PATH", str(FAKES / "bin") + os.pathsep + os.environ.get("PATH", ""))
+    import fake_cluster, drain, drive_tests, host_cache, models, smart, snapshot
+
+    monkeypatch.setattr(fake_cluster, "CONFIG", copy.deepcopy(fake_cluster.CONFIG))
+    monkeypatch.setattr(fake_cluster, "CALLS", {})
+    fake_cluster.configure(hosts = 2, osds_per_host = 4)
+    monkeypatch.setattr(snapshot, "_CACHE_PATH", tmp_path / "osdmap.pickle")
+    monkeypatch.setattr(host_cache, "_CACHE_PATH", tmp_path / "host.json")
+    monkeypatch.setattr(drain, "BUDGET_PATH", tmp_path / "drain.json")
+    monkeypatch.setattr(drive_tests, "LOG_DIR", tmp_path / "drive-tests")
+    monkeypatch.setattr(smart, "SMARTCTL", str(FAKES / "smartctl"))
+    (tmp_path / "ceph_cluster").write_text("testcluster\n")
+    monkeypatch.setattr(models, "CEPH_CLUSTER_FILE", str(tmp_path / "ceph_cluster"))
+    return fake_cluster
@@ -0,0 +1,94 @@
+import archive
+import records
+import storage
+from miscellaneous import save_case_history
+
+DAY = 86400
+NOW = 1_700_000_000.0
+
+
+def _case(state, active, updated_at, versions=1):
+    #A case with versions - 1 history rows, the current row last updated at updated_at
+    with storage.db_cursor() as cur:
+        cur.execute(f"INSERT INTO {storage.TABLE_NAME} (hostname, state, osd_id, cluster, active, updated_at) VALUES ('n1', 'NEW', 1, 'c1', 1, ?)",
+                (updated_at - versions,))
+        case_id = cur.lastrowid
+    for version in range(2, versions + 1):
+        save_case_history(case_id)
+        with storage.db_cursor() as cur:
+            cur.execute(f"UPDATE {storage.TABLE_NAME} SET version = ?, updated_at = ? WHERE case_id = ?",
+                    (version, updated_at - versions + version, case_id))
+    with storage.db_cursor() as cur:
+        cur.execute(f"UPDATE {storage.TABLE_NAME} SET state = ?, active = ?, updated_at = ? WHERE case_id = ?",
+                (state, active, updated_at, case_id))
+    return case_id
+
+
+def test_old_resolved_cases_move_with_their_history():
+    old = _case("RESOLVED", 0, NOW - 200 * DAY, versions=3)
+    older = _case("RESOLVED", 0, NOW - 400 * DAY)
+    recent = _case("RESOLVED", 0, NOW - 10 * DAY)
+    open_case = _case("RECOVERY-WAIT", 1, NOW - 300 * DAY)
+    before = list(records.iter_history(old))
+
+    result = archive.archive(now=NOW, batch=1)
+    assert (result.cases, result.history_rows, result.skipped) == (2, 2, 0)
+    assert len(result.partitions) == 2
+
+    remaining = [r.case_id for r in records.iter_records()]
+    assert remaining == [recent, open_case]
+    with storage.db_cursor() as cur:
+        assert cur.execute(f"SELECT COUNT(*) FROM {storage.HISTORY_TABLE} WHERE case_id = ?", (old,)).fetchone()[0] == 0
+
+    #Still found through the index
+    assert records.load_record(old) == before[-1]
+    assert list(records.iter_history(old)) == before
+    assert records.record_as_of(old, NOW - 200 * DAY - 1.5).version == 1
+    assert records.record_as_of(old, NOW - 200 * DAY - 1).version == 2
+    assert archive.load_archived(old, version=1) == before[0]
+    assert records.load_record(older).state == "RESOLVED"
+
+    #Nothing left to do
+    assert archive.archive(now=NOW).cases == 0
+
+
+def test_a_case_changed_while_archiving_stays(monkeypatch):
+    case_id = _case("RESOLVED", 0, NOW - 200 * DAY)
+    write = archive._write
+
+    def reopened_meanwhile(partition, cases, history):
+        write(partition, cases, history)
+        with storage.db_cursor() as cur:
+            cur.execute(f"UPDATE {storage.TABLE_NAME} SET version = version + 1 WHERE case_id = ?", (case_id,))
+
+    monkeypatch.setattr(archive, "_write", reopened_meanwhile)
+    result = archive.archive(now=NOW)
+    assert (result.cases, result.skipped) == (0, 1)
+    assert records.load_record(case_id).version == 2
+    assert archive.partition_for(case_id) is None
+
+
+def test_a_case_resolved_by_dlc_is_archived(cluster):
+    from models import DlcCase, State
+    from sweep import sweep
+
+    case = DlcCase(osd_id=0, state=State.NEW).save()
+    for _ in range(3):
+        sweep()
+    #The operator sends the drive for replacement, dlc takes it from there
+    case = DlcCase.load(case.case_id)
+    assert case.state == State.OSD_REMOVED
+    case.transition_to(State.REPLACE_DRIVE)
+    case.save(new_version=True)
+    for _ in range(3):
+        case.progress()
+    resolved = records.load_record(case.case_id)
+    assert (resolved.state, resolved.active) == ("RESOLVED", 0)
+
+    #Its OSD can get a new case right away
+    DlcCase(osd_id=0, state=State.NEW).save()
+
+    result = archive.archive(min_age=0)
+    assert result.cases == 1
+    assert [r.state for r in records.iter_history(case.case_id)][-1] == "RESOLVED"
+    assert archive.partition_for(case.case_id) is not None
@@ -0,0 +1,25 @@
+import subprocess
+import sys
+from pathlib import Path
+
+DLC = Path(__file__).resolve().parent.parent / "dlc"
+
+#Modules that read-only commands (list, history) must not import: ceph-util and everything that uses it
+CLUSTER_MODULES = ["ceph_common", "ceph_admin", "hwinv", "tabular", "models", "snapshot", "smart", "subprocess"]
+
+
+def _imported_after(code: str) -> list:
+    #A fresh interpreter, so modules imported by other tests don't count
+    check = f"import sys\n{code}\nprint(' '.join(m for m in {CLUSTER_MODULES!r} if m in sys.modules))"
+    R = subprocess.run([sys.executable, "-c", check], cwd=DLC, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return R.stdout.decode().split()
+
+
+def test_read_only_commands_do_not_import_cluster_modules(tmp_path):
+    code = (
+        "import cli, records, storage\n"
+        f"storage._DB_PATH = {str(tmp_path / 'db.sqlite')!r}\n"
+        "cli._parser().parse_args(['list'])\n"
+        "list(records.iter_records()); list(records.iter_history(1))\n"
+    )
+    assert _imported_after(code) == []
@@ -0,0 +1,89 @@
+import json
+import sys
+import time
+
+import pytest
+
+import coordinator
+import runner
+import storage
+
+#Stand-in for `dlc sweep --json` on a host: sleeps, then reports every case it was given as progressed
+FAKE_SWEEP = """
+import json, sys, time
+host = sys.argv[1]
+if host == "bad":
+    print("cannot reach cluster", file=sys.stderr)
+    sys.exit(1)
+time.sleep(float(sys.argv[2]))
+for case_id in sys.argv[3:]:
+    if host == "failing":
+        print("Going into history to save...", file=sys.stderr)
+        print(json.dumps({"case_id": int(case_id), "outcome": "failed", "message": "No valid OSD object found"}))
+    else:
+        print(json.dumps({"case_id": int(case_id), "outcome": "progressed"}))
+if host == "failing":
+    sys.exit(1)
+"""
+
+
+def _add_cases(hosts):
+    with storage.db_transaction() as cur:
+        for i, hostname in enumerate(hosts):
+            cur.execute(
+                f"INSERT INTO {storage.TABLE_NAME} (hostname, state, block_dev, osd_id, cluster) VALUES (?, 'NEW', ?, ?, 'c1')",
+                (hostname, f"sd{i}", i),
+            )
+
+
+def _command(delay):
+    def command(hostname, case_ids):
+        return [sys.executable, "-c", FAKE_SWEEP, hostname, str(delay), *map(str, case_ids)]
+    return command
+
+
+def test_hosts_are_swept_in_parallel():
+    _add_cases(["n1", "n1", "n2", "n3", "n4"])
+    assert coordinator.active_cases_by_host() == {"n1": [1, 2], "n2": [3], "n3": [4], "n4": [5]}
+
+    start = time.monotonic()
+    results = coordinator.coordinate(coordinator.LocalTransport(), max_hosts=4, command=_command(0.5))
+    assert time.monotonic() - start < 1.5
+
+    assert [h.hostname for h in results] == ["n1", "n2", "n3", "n4"]
+    assert all(h.ok for h in results)
+    assert [r["case_id"] for r in results[0].results] == [1, 2]
+
+
+def test_max_hosts_is_not_capped_by_the_runner():
+    _add_cases(["n1", "n2", "n3", "n4"])
+    with runner.use(runner.Runner(max_concurrent=2)):
+        start = time.monotonic()
+        results = coordinator.coordinate(coordinator.LocalTransport(), max_hosts=4, command=_command(1))
+        assert time.monotonic() - start < 1.8
+    assert all(h.ok for h in results)
+
+
+def test_failures_and_timeouts_are_per_host():
+    _add_cases(["bad", "slow", "n1", "failing"])
+
+    results = {h.hostname: h for h in coordinator.coordinate(coordinator.LocalTransport(), command=_command(0), timeout=10)}
+    assert not results["bad"].ok and results["bad"].error == "cannot reach cluster"
+    assert results["n1"].ok
+    #The failed case says why, not the sweep's last progress message on stderr
+    assert not results["failing"].ok
+    assert results["failing"].error == "case 4: No valid OSD object found"
+
+    slow = coordinator.run_host(coordinator.LocalTransport(), "slow", [2], timeout=0.5, command=_command(5))
+    assert not slow.ok and "timed out" in slow.error
+
+
+def test_ssh_command():
+    with pytest.raises(TypeError):
+        coordinator.Transport()
+    transport = coordinator.SSHTransport()
+    argv = coordinator.sweep_command("n1", [4, 5])
+    assert transport.command("n1", argv) == [
+        "ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=10", "n1", "--",
+        "dlc", "sweep", "--json", "--case-id", "4", "--case-id", "5",
+    ]
@@ -0,0 +1,58 @@
+import asyncio
+
+import records
+
+
+def _tick(daemon):
+    return asyncio.run(daemon.tick())
+
+
+def test_cases_stay_in_memory_between_ticks(cluster):
+    from daemon import Daemon
+    from models import DlcCase, State
+
+    first = DlcCase(osd_id=0, state=State.NEW).save()
+    daemon = Daemon()
+    _tick(daemon)
+    kept = daemon.cases[first.case_id]
+    assert kept.state == State.NEW_DETAIL
+
+    #Opened between ticks: loaded and progressed in the next one, the first case isn't read again
+    second = DlcCase(osd_id=1, state=State.NEW).save()
+    results = _tick(daemon)
+    assert daemon.cases[first.case_id] is kept
+    assert {r.case_id: r.state_after for r in results} == {first.case_id: "RECOVERY-WAIT", second.case_id: "NEW-DETAILS"}
+
+
+def test_health_waiting_cases_are_left_alone_until_clean(cluster):
+    from daemon import Daemon
+    from models import DlcCase, State
+
+    case = DlcCase(osd_id=0, state=State.NEW).save()
+    daemon = Daemon()
+    _tick(daemon)
+    _tick(daemon)
+
+    cluster.CONFIG["clean"] = False
+    assert _tick(daemon) == []
+    assert records.load_record(case.case_id).state == "RECOVERY-WAIT"
+
+    cluster.CONFIG["clean"] = True
+    [result] = _tick(daemon)
+    assert result.state_after == "OSD-REMOVED"
+
+
+def test_a_failed_case_is_reloaded_and_one_pass_runs(cluster):
+    from daemon import Daemon
+    from models import DlcCase, State
+    from sweep import FAILED
+
+    gone = DlcCase(osd_id=99, hostname="host000", state=State.NEW_DETAIL).save(force_save=True)
+    daemon = Daemon()
+    [result] = _tick(daemon)
+    assert result.outcome == FAILED
+    assert gone.case_id not in daemon.cases
+
+    #run(once=True) does one tick, a failure in it is reported and not raised
+    asyncio.run(daemon.run(once=True))
+    assert daemon.last_results[gone.case_id].outcome == FAILED
@@ -0,0 +1,205 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import drain
+import storage
+from drain import ClusterUsage, DrainBudget
+
+
+def _case(case_id, hostname, osd_id):
+    return SimpleNamespace(case_id=case_id, hostname=hostname, osd_id=osd_id)
+
+
+#Two racks, two hosts each, 100 GiB on every OSD
+GiB = 1024 ** 3
+USAGE = ClusterUsage(
+    {osd_id: 100 * GiB for osd_id in range(16)},
+    {"n1": "rack1", "n2": "rack1", "n3": "rack2", "n4": "rack2"},
+)
+
+
+def test_osds_of_a_host_drain_as_one_group():
+    ready = [_case(3, "n2", 5), _case(1, "n1", 0), _case(2, "n1", 1)]
+    result = drain.plan(ready, [], DrainBudget(), USAGE)
+
+    assert [[c.case_id for c in group] for group in result.groups] == [[1, 2], [3]]
+    assert result.waiting == {}
+
+
+def test_osd_and_host_limits_count_what_already_drains():
+    draining = [_case(10, "n1", 8), _case(11, "n3", 9)]
+    ready = [_case(1, "n1", 0), _case(2, "n1", 1), _case(3, "n4", 12)]
+    result = drain.plan(ready, draining, DrainBudget(max_osds=4, max_per_host=2), USAGE)
+
+    assert [c.case_id for c in result.admitted] == [1, 3]
+    assert "max_per_host 2" in result.waiting[2]
+
+    result = drain.plan(ready, draining, DrainBudget(max_osds=2), USAGE)
+    assert result.admitted == []
+    assert set(result.waiting) == {1, 2, 3}
+
+
+def test_failure_domain_limits():
+    #Off by default, so a drain doesn't have to read OSD usage
+    assert not DrainBudget().needs_usage
+
+    draining = [_case(10, "n1", 8)]
+    ready = [_case(1, "n2", 2), _case(2, "n3", 4)]
+    assert len(drain.plan(ready, draining, DrainBudget(), USAGE).admitted) == 2
+    result = drain.plan(ready, draining, DrainBudget(max_domains=1), USAGE)
+
+    #n2 is in rack1 like the OSD that is already draining, n3 would add rack2
+    assert [c.case_id for c in result.admitted] == [1]
+    assert "max_domains 1" in result.waiting[2]
+
+    result = drain.plan(ready, draining, DrainBudget(max_per_domain=1, max_domains=1), USAGE)
+    assert result.admitted == []
+
+
+def test_byte_budget_lets_an_oversized_osd_drain_alone():
+    usage = ClusterUsage({0: 500 * GiB, 1: 100 * GiB}, {})
+    budget = DrainBudget(max_bytes=150 * GiB)
+    result = drain.plan([_case(1, "n1", 0), _case(2, "n1", 1)], [], budget, usage)
+
+    assert [c.case_id for c in result.admitted] == [1]
+    assert "bytes would be moving" in result.waiting[2]
+
+    assert drain.plan([_case(2, "n1", 1)], [_case(1, "n1", 0)], budget, usage).admitted == []
+
+
+def test_draining_reads_recovering_cases_of_the_cluster():
+    with storage.db_cursor() as cur:
+        for hostname, state, osd_id, cluster, active in (
+            ("n1", "RECOVERY-WAIT", 1, "c1", 1),
+            ("n2", "RECOVERY-DONE", 2, "c1", 1),
+            ("n3", "RECOVERY-WAIT", 3, "c2", 1),
+            ("n4", "NEW-DETAILS", 4, "c1", 1),
+            ("n5", "RECOVERY-WAIT", 5, "c1", 0),
+        ):
+            cur.execute(f"INSERT INTO {storage.TABLE_NAME} (hostname, state, osd_id, cluster, active) VALUES (?, ?, ?, ?, ?)",
+                    (hostname, state, osd_id, cluster, active))
+
+    assert sorted(r.osd_id for r in drain.draining("c1")) == [1, 2]
+
+
+def test_usage_from_osd_df_tree():
+    data = {"nodes": [
+        {"id": -1, "name": "default", "type": "root", "children": [-2, -5]},
+        {"id": -2, "name": "rack1", "type": "rack", "children": [-3]},
+        {"id": -3, "name": "n1", "type": "host", "children": [0, 1]},
+        {"id": -5, "name": "n2", "type": "host", "children": [2]},
+        {"id": 0, "name": "osd.0", "type": "osd", "kb_used": 1024},
+        {"id": 1, "name": "osd.1", "type": "osd", "kb_used": 2048},
+        {"id": 2, "name": "osd.2", "type": "osd", "kb_used": 0},
+    ]}
+    usage = ClusterUsage.from_osd_df_tree(data)
+
+    assert usage.osd_bytes(1) == 2 * 1024 * 1024
+    assert usage.osd_bytes(99) == 0
+    assert usage.failure_domain("n1") == "rack1"
+    #Not under a rack: the host is its own failure domain
+    assert usage.failure_domain("n2") == "n2"
+
+
+def test_budget_overrides(tmp_path):
+    path = tmp_path / "drain.json"
+    assert DrainBudget.load(path) == DrainBudget()
+
+    path.write_text(json.dumps({"max_osds": 2, "max_domains": 1, "unknown": 1}))
+    assert DrainBudget.load(path) == DrainBudget(max_osds=2, max_domains=1)
+
+    path.write_text("{not json")
+    assert DrainBudget.load(path) == DrainBudget()
+
+
+def _ready(*osd_ids):
+    #Real cases of this host, verified and saved in NEW_DETAIL
+    from models import DlcCase, State
+    cases = []
+    for osd_id in osd_ids:
+        case = DlcCase(osd_id=osd_id, state=State.NEW).save()
+        case.progress()
+        cases.append(case)
+    return cases
+
+
+def test_drain_ready_reserves_the_budget_and_saves_waiting_cases_once(cluster):
+    from models import State, WaitReason
+    from snapshot import ClusterSnapshot
+
+    cases = _ready(0, 1, 2)
+    budget = DrainBudget(max_per_host=2)
+    snapshot = ClusterSnapshot.load()
+    result = drain.drain_ready(cases, snapshot, budget=budget)
+
+    assert [c.case_id for c in result.admitted] == [cases[0].case_id, cases[1].case_id]
+    assert [c.state for c in cases] == [State.RECOVERY_WAIT, State.RECOVERY_WAIT, State.NEW_DETAIL]
+    assert cases[2].wait_reason == WaitReason.drain_budget
+    assert [r.state for r in drain.draining("testcluster")] == ["RECOVERY-WAIT", "RECOVERY-WAIT"]
+    #No OSD usage (`ceph osd df tree`) was needed for these limits
+    assert snapshot._usage is None
+
+    #Still over budget: the waiting case isn't saved again
+    version = cases[2].version
+    result = drain.drain_ready(cases[2:], ClusterSnapshot.load(), budget=budget)
+    assert result.admitted == [] and cases[2].version == version
+
+
+def test_nothing_is_reserved_if_a_save_fails(cluster):
+    from models import ConcurrentUpdateError, State
+    from snapshot import ClusterSnapshot
+
+    cases = _ready(0, 1)
+    #Someone else saved the second case since it was loaded
+    with storage.db_cursor() as cur:
+        cur.execute(f"UPDATE {storage.TABLE_NAME} SET version = version + 1 WHERE case_id = ?", (cases[1].case_id,))
+    versions = [c.version for c in cases]
+
+    with pytest.raises(ConcurrentUpdateError):
+        drain.drain_ready(cases, ClusterSnapshot.load())
+    #The first case's save was rolled back with the rest, and the objects say so
+    assert [(c.state, c.wait_reason, c.version) for c in cases] == [(State.NEW_DETAIL, None, v) for v in versions]
+    assert drain.draining("testcluster") == []
+
+
+def test_a_failed_drain_needs_an_operator(cluster, monkeypatch):
+    from models import CaseError, DlcCase, State
+    from snapshot import ClusterSnapshot
+
+    def fail(osd_ids):
+        raise CaseError("ceph osd out timed out")
+
+    monkeypatch.setattr(DlcCase, "drain_OSDs", staticmethod(fail))
+    cases = _ready(0, 1)
+    result = drain.drain_ready(cases, ClusterSnapshot.load())
+    assert len(result.groups) == 1
+    assert [c.state for c in cases] == [State.OPERATOR_NEEDED, State.OPERATOR_NEEDED]
+
+
+def test_a_case_is_only_recovering_once_its_osd_is_out(cluster, monkeypatch):
+    from models import DlcCase, State
+    from snapshot import ClusterSnapshot
+
+    drained = []
+
+    def killed(osd_ids):
+        #The process dies halfway through the drain
+        assert [r.state for r in drain.draining("testcluster")] == ["NEW-DETAILS", "NEW-DETAILS"]
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(DlcCase, "drain_OSDs", staticmethod(killed))
+    cases = _ready(0, 1)
+    with pytest.raises(KeyboardInterrupt):
+        drain.drain_ready(cases, ClusterSnapshot.load())
+    #Still reserved, so the budget counts them, but not RECOVERY_WAIT: remove_OSD can't get to them
+    assert [(r.state, r.action) for r in drain.draining("testcluster")] == [("NEW-DETAILS", "Reweighting OSD")] * 2
+
+    #The next run drains them again without spending more budget, and only then do they recover
+    monkeypatch.setattr(DlcCase, "drain_OSDs", staticmethod(drained.append))
+    cases = [DlcCase.load(c.case_id) for c in cases]
+    result = drain.drain_ready(cases, ClusterSnapshot.load(), budget=DrainBudget(max_osds=2))
+    assert drained == [[0, 1]] and result.waiting == {}
+    assert [(c.state, c.action) for c in cases] == [(State.RECOVERY_WAIT, None)] * 2
+    assert [r.state for r in drain.draining("testcluster")] == ["RECOVERY-WAIT", "RECOVERY-WAIT"]
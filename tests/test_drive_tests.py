@@ -0,0 +1,164 @@
+import time
+
+import pytest
+
+import drive_tests
+import storage
+from drive_tests import Poll
+
+
+@pytest.fixture(autouse=True)
+def log_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(drive_tests, "LOG_DIR", tmp_path / "drive-tests")
+
+
+class FakeRunner:
+    #Tests "run" until the test marks them finished; results are kept per job like a real runner would
+    def __init__(self):
+        self.started = []
+        self.finished = {}
+
+    def start(self, job):
+        self.started.append(job.job_id)
+        return {"token": f"t{job.job_id}"}
+
+    def poll(self, job):
+        assert job.handle == {"token": f"t{job.job_id}"}
+        if job.job_id not in self.finished:
+            return Poll(done=False, progress=50)
+        return Poll(done=True, progress=100, passed=self.finished[job.job_id], result={"fake": True})
+
+
+def _submit(n, controller):
+    return drive_tests.submit(n, "n1", f"sd{n}", kind="fake", controller=controller)
+
+
+def test_caps_are_per_host_and_per_controller(monkeypatch):
+    runner = FakeRunner()
+    monkeypatch.setitem(drive_tests.RUNNERS, "fake", runner)
+    for n in range(1, 7):
+        _submit(n, "hba0" if n <= 4 else "hba1")
+
+    drive_tests.step("n1", max_per_host=3, max_per_controller=2)
+    #Two on hba0, then job 5 on hba1 jumps the queue over the hba0 jobs that have to wait
+    assert runner.started == [1, 2, 5]
+
+    runner.finished[1] = True
+    runner.finished[5] = False
+    drive_tests.step("n1", max_per_host=3, max_per_controller=2)
+    assert runner.started == [1, 2, 5, 3, 6]
+
+    done = {job.job_id: job for job in drive_tests.jobs(case_id=1) + drive_tests.jobs(case_id=5)}
+    assert (done[1].status, done[1].passed, done[1].result) == (drive_tests.DONE, True, {"fake": True})
+    assert (done[5].status, done[5].passed) == (drive_tests.DONE, False)
+    assert drive_tests.get(2).progress == 50
+
+
+def test_restart_resumes_polling_instead_of_rerunning(monkeypatch):
+    first = FakeRunner()
+    monkeypatch.setitem(drive_tests.RUNNERS, "fake", first)
+    _submit(1, "hba0")
+    drive_tests.step("n1")
+
+    #A new dlc process: nothing in memory, the job is picked up from the database
+    second = FakeRunner()
+    second.finished[1] = True
+    monkeypatch.setitem(drive_tests.RUNNERS, "fake", second)
+    drive_tests.step("n1")
+    assert second.started == []
+    assert drive_tests.latest(1).status == drive_tests.DONE
+
+
+def test_one_open_test_per_case():
+    drive_tests.submit(1, "n1", "sda", controller="hba0")
+    with pytest.raises(storage.sqlite3.IntegrityError):
+        drive_tests.submit(1, "n1", "sda", controller="hba0")
+
+
+def test_command_tests_run_side_by_side(monkeypatch):
+    monkeypatch.setitem(drive_tests.RUNNERS, "sleep", drive_tests.CommandTest(["sh", "-c", "sleep 0.5; test {device} != /dev/bad"]))
+    for n, dev in enumerate(["sda", "sdb", "sdc", "sdd", "bad"], start=1):
+        drive_tests.submit(n, "n1", dev, kind="sleep", controller="hba0")
+
+    start = time.monotonic()
+    drive_tests.step("n1", max_per_controller=8)
+    while drive_tests.jobs(hostname="n1", unfinished=True):
+        time.sleep(0.05)
+        drive_tests.step("n1")
+    assert time.monotonic() - start < 2
+
+    results = {job.device: job for job in drive_tests.jobs(hostname="n1")}
+    assert all(results[dev].passed for dev in ["sda", "sdb", "sdc", "sdd"])
+    assert results["bad"].status == drive_tests.DONE and results["bad"].passed is False
+    assert results["bad"].result["exit_status"] == 1
+
+
+def test_a_job_claimed_but_never_started_fails_after_a_grace_period(monkeypatch):
+    runner = FakeRunner()
+    monkeypatch.setitem(drive_tests.RUNNERS, "fake", runner)
+    job = _submit(1, "hba0")
+    #Claimed by another process, which is still in the runner's start() or died there
+    assert drive_tests._claim(job)
+
+    drive_tests.step("n1")
+    assert drive_tests.get(1).status == drive_tests.RUNNING
+
+    with storage.db_cursor() as cur:
+        cur.execute(f"UPDATE {storage.DRIVE_TEST_TABLE} SET started_at = started_at - ?", (drive_tests.START_GRACE,))
+    drive_tests.step("n1")
+    job = drive_tests.get(1)
+    assert job.status == drive_tests.ERROR and "never recorded as started" in job.error
+    assert runner.started == []
+
+
+def test_a_job_abandoned_while_starting_stays_abandoned(monkeypatch):
+    class Abandoned(FakeRunner):
+        def __init__(self):
+            super().__init__()
+            self.cancelled = []
+
+        def start(self, job):
+            #Another process gives up on the case while this one starts its test
+            assert drive_tests.step("n1") and drive_tests.get(job.job_id).status == drive_tests.RUNNING
+            drive_tests.abandon(job.case_id, "superseded")
+            return super().start(job)
+
+        def cancel(self, job):
+            self.cancelled.append(job.handle)
+
+    runner = Abandoned()
+    monkeypatch.setitem(drive_tests.RUNNERS, "fake", runner)
+    _submit(1, "hba0")
+    [job] = drive_tests.step("n1")
+    assert (job.status, job.error) == (drive_tests.ERROR, "superseded")
+    assert drive_tests.get(1).handle is None
+    #The test it had just started is stopped
+    assert runner.cancelled == [{"token": "t1"}]
+
+
+def test_a_case_tested_again_gets_a_new_test(cluster, monkeypatch):
+    from models import Action, DlcCase, State
+
+    runner = FakeRunner()
+    monkeypatch.setitem(drive_tests.RUNNERS, drive_tests.DEFAULT_KIND, runner)
+    case = DlcCase(osd_id=0, state=State.NEW).save()
+    case.state = State.DRIVE_TESTING
+    case.save(new_version=True)
+
+    case.progress()
+    first = drive_tests.latest(case.case_id)
+    drive_tests.step("host000")
+    runner.finished[first.job_id] = True
+    drive_tests.step("host000")
+    case.progress()
+    assert (case.state, case.test_passed) == (State.TEST_DONE, True)
+
+    #Sent back to testing by an operator: the earlier result doesn't count for this stay
+    case.transition_to(State.OPERATOR_NEEDED)
+    case.save(new_version=True)
+    case.transition_to(State.DRIVE_TESTING)
+    case.save(new_version=True)
+    case.progress()
+    second = drive_tests.latest(case.case_id)
+    assert second.job_id != first.job_id and second.status == drive_tests.QUEUED
+    assert (case.state, case.action) == (State.DRIVE_TESTING, Action.testing_disk)
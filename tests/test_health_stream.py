@@ -0,0 +1,115 @@
+import asyncio
+import json
+import sys
+import time
+
+import health_stream
+from health_stream import HealthStream
+
+
+def _status(clean, total=128):
+    states = [{"state_name": "active+clean", "count": clean}]
+    if clean < total:
+        states.append({"state_name": "active+undersized+degraded", "count": total - clean})
+    return json.dumps({"health": {"status": "HEALTH_WARN"}, "pgmap": {"num_pgs": total, "pgs_by_state": states}})
+
+
+#Replays "<delay> <line>" records from argv[1] with the given pauses, like a slow `ceph -w`
+REPLAY = """
+import sys, time
+for record in open(sys.argv[1]):
+    delay, line = record.rstrip("\\n").split(" ", 1)
+    time.sleep(float(delay))
+    print(line, flush=True)
+time.sleep(30)
+"""
+
+
+def test_parse_line():
+    assert health_stream.parse_line(_status(128)) is True
+    assert health_stream.parse_line(_status(120)) is False
+    assert health_stream.parse_line(json.dumps({"health": {"status": "HEALTH_OK"}})) is True
+    assert health_stream.parse_line("2026-10-17T10:00:00 mon.a [INF] Cluster is now healthy") is True
+    assert health_stream.parse_line("2026-10-17T10:00:00 mon.a [WRN] Health check failed: Degraded data redundancy") is False
+    assert health_stream.parse_line("2026-10-17T10:00:00 mon.a [INF] osd.3 marked itself down") is None
+    assert health_stream.parse_line("{not json") is None
+
+
+def test_flapping_is_debounced(tmp_path):
+    recording = tmp_path / "stream"
+    recording.write_text("\n".join([
+        f"0 {_status(100)}",
+        f"0.1 {_status(128)}",
+        f"0.1 {_status(127)}",  #back to degraded before the debounce ran out
+        f"0.1 {_status(128)}",
+    ]) + "\n")
+
+    async def main():
+        stream = HealthStream([sys.executable, "-c", REPLAY, str(recording)], debounce=0.4)
+        reader = asyncio.create_task(stream.run())
+        start = time.monotonic()
+        while stream.clean is None:
+            await asyncio.sleep(0.01)
+        assert await asyncio.wait_for(stream.wait_clean(), 5) is True
+        woke_after = time.monotonic() - start
+        #Already woken for this clean period, the next call only returns on a new transition
+        again = asyncio.create_task(stream.wait_clean())
+        await asyncio.sleep(0.2)
+        assert not again.done()
+        again.cancel()
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        return stream, woke_after
+
+    stream, woke_after = asyncio.run(main())
+    #Last transition to clean at ~0.3s plus 0.4s of debounce; the first clean period never woke anyone
+    assert 0.6 < woke_after < 2
+    assert stream.transitions == 4
+
+
+def test_ended_stream_falls_back_to_polling(tmp_path):
+    recording = tmp_path / "stream"
+    recording.write_text(f"{_status(128)}\n")
+
+    async def main():
+        stream = HealthStream(str(recording), debounce=0)
+        await stream.run()
+        return stream, await stream.wait_clean()
+
+    stream, woke = asyncio.run(main())
+    assert stream.closed and not stream.live
+    assert woke is False
+
+
+def test_command_exit_forgets_the_state():
+    async def main():
+        stream = HealthStream([sys.executable, "-c", f"print({_status(128)!r})"], debounce=0, restart_delay=30)
+        reader = asyncio.create_task(stream.run())
+        for _ in range(100):
+            if stream.transitions == 1 and stream.clean is None:
+                break
+            await asyncio.sleep(0.05)
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        return stream
+
+    stream = asyncio.run(main())
+    assert stream.transitions == 1 and stream.clean is None
+
+
+def test_built_and_fed_outside_the_loop_it_waits_in():
+    #daemon.run() builds the stream before asyncio.run(); nothing in it may belong to another loop
+    stream = HealthStream("-", debounce=0)
+    stream.feed(_status(120))
+
+    async def main():
+        waiter = asyncio.create_task(stream.wait_clean())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        stream.feed(_status(128))
+        return await asyncio.wait_for(waiter, 5)
+
+    assert asyncio.run(main()) is True
+    #A second loop, as when the daemon is started again in the same process
+    stream.feed(_status(120))
+    assert asyncio.run(main()) is True
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import pytest
+
+import host_cache
+
+
+class FakeHW:
+    #Stand-in for hwinv.HWInv, counts dmidecode calls
+    def __init__(self, hostname="node1", serial="SER1"):
+        self.hostname = hostname
+        self.serial = serial
+        self.dmidecode_calls = 0
+
+    def dmidecode(self):
+        self.dmidecode_calls += 1
+        return SimpleNamespace(sysinfo={"system": {"serial": self.serial}})
+
+
+@pytest.fixture
+def boot(monkeypatch, tmp_path):
+    boot_id = tmp_path / "boot_id"
+    boot_id.write_text("boot-1\n")
+    monkeypatch.setattr(host_cache, "BOOT_ID_PATH", str(boot_id))
+    monkeypatch.setattr(host_cache, "_CACHE_PATH", tmp_path / "host.json")
+    return boot_id
+
+
+def test_identity_is_cached_until_reboot(boot):
+    hw = FakeHW()
+    assert host_cache.load(hw) == host_cache.HostIdentity("node1", "SER1", "boot-1")
+    assert host_cache.load(FakeHW(serial="OTHER")).serial == "SER1"
+    assert hw.dmidecode_calls == 1
+
+    #after a reboot (e.g. a motherboard swap) the serial is read again
+    boot.write_text("boot-2\n")
+    assert host_cache.load(FakeHW(serial="SER2")).serial == "SER2"
+    assert host_cache.load(FakeHW(serial="OTHER"), refresh=True).serial == "OTHER"
+
+
+def test_nothing_is_cached_without_boot_id(boot):
+    boot.unlink()
+    host_cache.load(FakeHW())
+    assert host_cache.load(FakeHW(serial="SER2")).serial == "SER2"
+    assert not host_cache._CACHE_PATH.exists()
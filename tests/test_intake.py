@@ -0,0 +1,60 @@
+import io
+
+import records
+import storage
+
+
+def test_import_resolves_every_spec_against_one_snapshot(cluster):
+    from intake import import_cases, read_specs, CREATED, CONFLICT, INVALID
+
+    lines = io.StringIO(
+        '{"osd_id": 0}\n'
+        '{"hostname": "host001", "block_dev": "/dev/sdb"}\n'
+        'not json\n'
+        '{"osd_id": 0}\n'
+        '{"osd_id": 99}\n'
+        '{"osd_id": "two"}\n'
+    )
+    results = import_cases(read_specs(lines))
+
+    assert [r.outcome for r in results] == [CREATED, CREATED, INVALID, CONFLICT, INVALID, INVALID]
+    assert [r.line for r in results] == [1, 2, 3, 4, 5, 6]
+    #host001's sdb is its second OSD
+    assert (results[1].osd_id, results[1].hostname) == (5, "host001")
+    assert "No valid OSD" in results[4].message
+    assert cluster.CALLS["osdmap"] == 1
+
+    #The rows that went in are committed, the failed ones left nothing behind
+    assert [(r.osd_id, r.state) for r in records.iter_records()] == [(0, "NEW"), (5, "NEW")]
+
+
+def test_csv_rows(cluster):
+    from intake import import_cases, read_specs, CREATED
+
+    rows = io.StringIO("hostname,block_dev,osd_id\n,,2\nhost000,sdd,\n")
+    results = import_cases(read_specs(rows, "csv"))
+    assert [(r.outcome, r.osd_id) for r in results] == [(CREATED, 2), (CREATED, 3)]
+
+
+def test_input_is_read_before_the_write_lock_and_the_cluster_name_once(cluster, monkeypatch):
+    from intake import import_cases, read_specs, CREATED
+    from models import DlcCase
+
+    reads = []
+    check_cluster = DlcCase._check_ceph_cluster
+
+    def counted():
+        reads.append(1)
+        return check_cluster()
+
+    monkeypatch.setattr(DlcCase, "_check_ceph_cluster", staticmethod(counted))
+
+    def slow_stdin():
+        #Other dlc writers must not wait on this tool waiting on its input
+        for spec in read_specs(io.StringIO('{"osd_id": 0}\n{"osd_id": 1}\n{"osd_id": 2}\n')):
+            assert not storage.get_conn().in_transaction
+            yield spec
+
+    results = import_cases(slow_stdin())
+    assert [r.outcome for r in results] == [CREATED] * 3
+    assert len(reads) == 1
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+    metrics.configure(json_log=None)
+
+
+def test_spans_counters_and_json_log(tmp_path):
+    log = tmp_path / "metrics.jsonl"
+    metrics.configure(json_log=log)
+
+    with metrics.span("smartctl"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.span("smartctl"):
+            raise RuntimeError
+    metrics.count("transitions", from_state="NEW", to_state="NEW-DETAILS")
+
+    spans = metrics.snapshot()["spans"]
+    [(key, s)] = spans.items()
+    assert json.loads(key)[0] == "smartctl"
+    assert (s["count"], s["errors"]) == (2, 1)
+
+    entries = [json.loads(line) for line in log.read_text().splitlines()]
+    assert [e.get("error") for e in entries[:2]] == [None, "RuntimeError"]
+    assert entries[2]["to_state"] == "NEW-DETAILS"
+
+
+def test_flush_accumulates_across_processes_and_renders_prometheus(tmp_path):
+    state, prom = tmp_path / "metrics.json", tmp_path / "dlc.prom"
+    for _ in range(2):
+        with metrics.span("db_cursor"):
+            pass
+        metrics.count("transitions", from_state="NEW", to_state="NEW-DETAILS")
+        metrics.flush(prom, state_path=state)
+
+    text = prom.read_text()
+    assert 'dlc_span_calls_total{span="db_cursor"} 2' in text
+    assert 'dlc_transitions_total{from_state="NEW",to_state="NEW-DETAILS"} 2' in text
+    assert metrics.snapshot() == {"spans": {}, "counters": {}}
+
+
+def test_nothing_recorded_or_read_only_commands_leave_the_totals_alone(tmp_path, monkeypatch):
+    import cli
+
+    state = tmp_path / "metrics.json"
+    assert metrics.flush(state_path=state) is None
+    assert not state.exists()
+
+    monkeypatch.setattr(metrics, "METRICS_STATE", state)
+    cli.main(["list", "--format", "json"])
+    assert metrics.snapshot()["spans"]
+    assert not state.exists()
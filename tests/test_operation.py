@@ -0,0 +1,146 @@
+import pytest
+
+from errors import CaseError
+from operation import Operation
+from states import State
+
+
+class FakeCase:
+    #Stands in for DlcCase: get_complete_information fills in the device like the real one does
+    def __init__(self, state=State.NEW_DETAIL, osd_id=3, hostname="n1", block_dev=None):
+        self.state, self.osd_id, self.hostname, self.block_dev = state, osd_id, hostname, block_dev
+        self.checks = []
+
+    def get_complete_information(self, snapshot):
+        self.checks.append(snapshot)
+        self.block_dev = "sdc" if self.state != State.NEW else None
+        return True
+
+
+def _op(clusters=("ceph1",)):
+    reads = []
+
+    def check_cluster():
+        reads.append(1)
+        return clusters[0], (None if clusters[0] else FileNotFoundError("/etc/ceph/ceph_cluster"))
+
+    return Operation("snapshot", check_cluster=check_cluster), reads
+
+
+def test_a_case_is_verified_once_per_operation():
+    op, reads = _op()
+    case = FakeCase()
+    for _ in range(4):
+        assert op.verify(case)
+        assert op.cluster == "ceph1"
+    assert case.checks == ["snapshot"]
+    assert op.verifications == 1
+    assert len(reads) == 1
+
+    #The next step starts over
+    op, _ = _op()
+    op.verify(case)
+    assert len(case.checks) == 2
+
+
+def test_reverified_when_identity_state_class_or_invalidated():
+    op, _ = _op()
+    case = FakeCase(state=State.NEW)
+    op.verify(case)
+
+    #Leaving NEW: checked against this host's OSDs this time
+    case.state = State.NEW_DETAIL
+    op.verify(case)
+    op.verify(case)
+    assert len(case.checks) == 2
+
+    case.osd_id = 4
+    op.verify(case)
+    assert len(case.checks) == 3
+
+    op.invalidate(case)
+    op.verify(case)
+    other = FakeCase(osd_id=5)
+    op.verify(other)
+    op.invalidate()
+    op.verify(case)
+    op.verify(other)
+    assert (len(case.checks), len(other.checks)) == (5, 2)
+
+
+def test_failures_are_not_remembered():
+    op, _ = _op()
+    case = FakeCase()
+    case.get_complete_information = lambda snapshot: (_ for _ in ()).throw(Exception("No valid OSD object found"))
+    for _ in range(2):
+        with pytest.raises(Exception, match="No valid OSD"):
+            op.verify(case)
+    assert op.verifications == 0
+
+    op, reads = _op(clusters=(False,))
+    with pytest.raises(CaseError):
+        op.cluster
+
+
+@pytest.fixture
+def checks(cluster, monkeypatch):
+    #case_id of every real get_complete_information, and every read of the cluster file
+    from models import DlcCase
+
+    calls = {"cases": [], "cluster": 0}
+    get_complete_information = DlcCase.get_complete_information
+    check_cluster = DlcCase._check_ceph_cluster
+
+    def counted_information(self, snapshot=None):
+        calls["cases"].append(self.case_id)
+        return get_complete_information(self, snapshot)
+
+    def counted_cluster():
+        calls["cluster"] += 1
+        return check_cluster()
+
+    monkeypatch.setattr(DlcCase, "get_complete_information", counted_information)
+    monkeypatch.setattr(DlcCase, "_check_ceph_cluster", staticmethod(counted_cluster))
+    return calls
+
+
+def test_one_step_of_a_real_case_checks_the_cluster_once(checks):
+    from models import DlcCase
+    from snapshot import ClusterSnapshot
+    from sweep import sweep
+
+    case = DlcCase(osd_id=0, state=State.NEW).save()
+    sweep()
+    sweep()
+    case = DlcCase.load(case.case_id)
+    assert case.state == State.RECOVERY_WAIT
+
+    #RECOVERY_WAIT -> RECOVERY_DONE (saved) -> remove_OSD -> OSD_REMOVED (saved), all with one check
+    checks["cases"].clear()
+    checks["cluster"] = 0
+    op = DlcCase.operation(ClusterSnapshot.load())
+    case.progress(op=op)
+    assert case.state == State.OSD_REMOVED
+    assert checks["cases"] == [case.case_id]
+    assert (op.verifications, checks["cluster"]) == (1, 1)
+
+    #A new operation is a new step, and the case is checked again
+    case.transition_to(State.REPLACE_DRIVE)
+    case.save(new_version=True)
+    assert checks["cases"] == [case.case_id] * 2
+
+
+def test_a_drained_batch_checks_each_case_once(checks):
+    from models import DlcCase
+    from snapshot import ClusterSnapshot
+    from sweep import drain_batch
+
+    cases = [DlcCase(osd_id=osd_id, state=State.NEW).save() for osd_id in (0, 1)]
+    for case in cases:
+        case.progress()
+    checks["cases"].clear()
+
+    #The batch verifies, drain_ready admits and drains, every case is saved: one check each
+    results = drain_batch(cases, ClusterSnapshot.load(), "testcluster")
+    assert [r.state_after for r in results] == ["RECOVERY-WAIT", "RECOVERY-WAIT"]
+    assert sorted(checks["cases"]) == [case.case_id for case in cases]
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from osd_index import OsdIndex
+
+
+def _osd(osd_id, hostname, dev_name):
+    return SimpleNamespace(osd_id=osd_id, hostname=hostname, dev_name=dev_name, lv_name=f"lv-{osd_id}")
+
+
+def _index():
+    osd_map = {i: _osd(i, f"host{i // 10}", f"sd{chr(ord('a') + i % 10)}") for i in range(30)}
+    return OsdIndex(osd_map)
+
+
+def test_osd_lookups():
+    index = _index()
+    assert len(index) == 30
+    assert index.find(osd_id=12).hostname == "host1"
+    assert index.find(hostname="host2", dev_name="/dev/sdc").osd_id == 22
+    #an id that isn't in the map falls back to hostname + device, like get_complete_information always did
+    assert index.find(osd_id=-1, hostname="host0", dev_name="sdb").osd_id == 1
+    assert index.find(osd_id=-1) is None
+    assert index.by_lv_name("lv-7").osd_id == 7
+    assert [o.osd_id for o in index.on_host("host1")] == list(range(10, 20))
+
+
+def test_reverse_lookups():
+    index = _index()
+    cases = [
+        SimpleNamespace(case_id=1, hostname="host1", osd_id=12, host_serial="SER1"),
+        SimpleNamespace(case_id=2, hostname="host1", osd_id=15, host_serial="SER1"),
+        SimpleNamespace(case_id=3, hostname="host2", osd_id=-1, host_serial=None),
+    ]
+    index.add_cases(cases)
+    assert [c.case_id for c in index.cases_on_host("host1")] == [1, 2]
+    assert [c.case_id for c in index.cases_for_osd(15)] == [2]
+    assert index.cases_for_osd(-1) == []
+    assert len(index.on_host_serial("SER1")) == 10
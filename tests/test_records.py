@@ -0,0 +1,120 @@
+import pytest
+
+import records
+import storage
+
+
+def test_records_are_read_only_rows():
+    with storage.db_cursor() as cur:
+        cur.execute(f"INSERT INTO {storage.TABLE_NAME} (hostname, state, osd_id, cluster) VALUES ('n1', 'NEW', 7, 'c1')")
+        cur.execute(f"INSERT INTO {storage.TABLE_NAME} (hostname, state, osd_id, cluster, active) VALUES ('n2', 'RESOLVED', 8, 'c1', 0)")
+
+    rows = list(records.iter_records())
+    assert [r.osd_id for r in rows] == [7, 8]
+    assert list(records.iter_records("active = ?", (1,))) == rows[:1]
+    assert not hasattr(rows[0], "__dict__")
+    with pytest.raises(AttributeError):
+        rows[0].state = "RESOLVED"
+
+    assert records.load_record(rows[1].case_id).state == "RESOLVED"
+    with pytest.raises(ValueError, match="Case not found"):
+        records.load_record(999)
+
+
+def test_history_versions_and_point_in_time():
+    from miscellaneous import save_case_history
+
+    with storage.db_cursor() as cur:
+        cur.execute(f"INSERT INTO {storage.TABLE_NAME} (hostname, state, osd_id, cluster, updated_at) VALUES ('n1', 'NEW', 7, 'c1', 100)")
+        case_id = cur.lastrowid
+    for state, when in (("NEW-DETAILS", 200), ("RECOVERY-WAIT", 300)):
+        save_case_history(case_id)
+        with storage.db_cursor() as cur:
+            cur.execute(
+                f"UPDATE {storage.TABLE_NAME} SET state = ?, updated_at = ?, version = version + 1 WHERE case_id = ?",
+                (state, when, case_id),
+            )
+
+    history = list(records.iter_history(case_id))
+    assert [(r.version, r.state) for r in history] == [(1, "NEW"), (2, "NEW-DETAILS"), (3, "RECOVERY-WAIT")]
+
+    assert records.record_as_of(case_id, 50) is None
+    assert records.record_as_of(case_id, 150).state == "NEW"
+    assert records.record_as_of(case_id, 250).version == 2
+    assert records.record_as_of(case_id, 1000).state == "RECOVERY-WAIT"
+
+    with storage.db_cursor() as cur:
+        plan = " ".join(r["detail"] for r in cur.execute(
+            f"EXPLAIN QUERY PLAN SELECT * FROM {storage.HISTORY_TABLE} WHERE case_id = 1 AND updated_at <= 5 ORDER BY updated_at DESC LIMIT 1"
+        ))
+    assert "ix_history_case_time" in plan
+
+
+def _insert_cases(n):
+    rows = [(f"n{i % 3}", "RESOLVED" if i % 2 else "NEW", i, "c1", 0 if i % 2 else 1, 1000.0 + i) for i in range(n)]
+    with storage.db_transaction() as cur:
+        cur.executemany(
+            f"INSERT INTO {storage.TABLE_NAME} (hostname, state, osd_id, cluster, active, updated_at) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+
+def test_query_filters_and_keyset_pages(monkeypatch):
+    _insert_cases(20)
+    monkeypatch.setattr(records.time, "time", lambda: 1020.0)
+
+    active = list(records.query_records())
+    assert [r.osd_id for r in active] == list(range(0, 20, 2))
+    assert len(list(records.query_records(active=None))) == 20
+    assert [r.osd_id for r in records.query_records(hostname="n1", state="NEW")] == [4, 10, 16]
+    assert [r.osd_id for r in records.query_records(osd_id=7, active=False)] == [7]
+    #updated_at 1000 + osd_id, "now" is 1020
+    assert [r.osd_id for r in records.query_records(older_than=16)] == [0, 2, 4]
+    assert [r.osd_id for r in records.query_records(newer_than=4)] == [16, 18]
+
+    pages, after = [], None
+    while True:
+        page = list(records.query_records(active=None, after=after, limit=6))
+        if not page:
+            break
+        pages.append([r.case_id for r in page])
+        after = page[-1].case_id
+    assert [len(p) for p in pages] == [6, 6, 6, 2]
+    assert sum(pages, []) == [r.case_id for r in records.query_records(active=None)]
+
+
+def test_filtered_pages_use_an_index():
+    _insert_cases(10)
+    with storage.db_cursor() as cur:
+        for where, params in (("active = ? AND state = ?", (1, "NEW")), ("active = ? AND hostname = ?", (1, "n1")), ("active = ?", (1,))):
+            cur.execute(f"EXPLAIN QUERY PLAN SELECT * FROM {storage.TABLE_NAME} WHERE {where} AND case_id > ? ORDER BY case_id LIMIT 10", (*params, 0))
+            plan = " ".join(row["detail"] for row in cur.fetchall())
+            assert "USING INDEX" in plan and "TEMP B-TREE" not in plan, plan
+
+
+def test_list_streams_json_and_csv(capsys):
+    import csv, json
+    import cli
+
+    _insert_cases(5)
+    cli.main(["list", "--format", "json", "--limit", "2"])
+    out, err = capsys.readouterr()
+    lines = [json.loads(line) for line in out.splitlines()]
+    assert [line["osd_id"] for line in lines] == [0, 2]
+    assert f"--after {lines[-1]['case_id']}" in err
+
+    cli.main(["list", "--format", "csv", "--all", "--hostname", "n2"])
+    rows = list(csv.DictReader(capsys.readouterr().out.splitlines()))
+    assert [row["osd_id"] for row in rows] == ["2"]
+
+
+def test_list_table_has_one_header(capsys, monkeypatch):
+    import cli
+
+    _insert_cases(5)
+    monkeypatch.setattr(cli, "TABLE_BLOCK", 2)
+    cli.main(["list", "--all"])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 6
+    assert lines[0].split()[:2] == ["case_id", "hostname"]
+    #Widths come from the first block and hold for every row
+    assert len({len(line) for line in lines}) == 1
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+import runner
+from errors import CommandError
+from runner import Command, FakeExecutor, Runner
+
+
+def test_output_is_captured_and_capped():
+    R = Runner().run(["sh", "-c", "head -c 5000 /dev/zero | tr '\\0' x; echo oops >&2; exit 3"], max_output=1000)
+    assert R.returncode == 3 and not R.ok
+    assert R.stdout == "x" * 1000 and R.truncated
+    assert R.stderr == "oops\n"
+    assert R.describe().endswith("exit status 3: oops")
+
+
+def test_timeout_kills_the_whole_process_group(monkeypatch):
+    monkeypatch.setattr(runner, "KILL_GRACE", 1)
+    start = time.monotonic()
+    #The background sleep keeps stdout open; it has to die with its parent for run() to return
+    R = Runner().run(["sh", "-c", "sleep 30 & sleep 30"], timeout=0.5)
+    assert time.monotonic() - start < 5
+    assert R.timed_out and R.returncode is None
+    with pytest.raises(CommandError, match="timed out"):
+        Runner().run(["sleep", "5"], timeout=0.2, check=True)
+
+
+def test_missing_command_is_a_result_not_an_exception():
+    R = Runner().run(["/nonexistent/dlc-command"])
+    assert R.error is not None and not R.ok
+
+
+def test_limits_per_host_and_overall():
+    release = threading.Event()
+    executor = FakeExecutor(lambda argv: (release.wait(5), (0, argv[-1], ""))[1])
+    r = Runner(executor, max_concurrent=3, max_per_host=1)
+
+    commands = [Command(["ssh", host, "true", host], host=host) for host in ("n1", "n1", "n2", "n3", "n4")]
+    done = []
+    t = threading.Thread(target=lambda: done.extend(r.run_many(c for c in commands)))
+    t.start()
+    time.sleep(0.3)
+    assert executor.running == 3
+    release.set()
+    t.join(5)
+    assert executor.max_running == 3
+    assert [R.stdout for R in done] == ["n1", "n1", "n2", "n3", "n4"]
+
+    executor = FakeExecutor(lambda argv: (time.sleep(0.05), (0, "", ""))[1])
+    Runner(executor, max_per_host=1).run_many(Command(["ssh", "n1", "true"], host="n1") for _ in range(4))
+    assert executor.max_running == 1
+
+
+def test_run_many_keeps_order_and_raises_after_all_finished():
+    executor = FakeExecutor(lambda argv: (1, "", "no such osd") if argv[-1] == "osd.2" else (0, argv[-1], ""))
+    r = Runner(executor)
+    results = r.run_many(Command(["ceph", "osd", "out", f"osd.{i}"]) for i in range(4))
+    assert [R.ok for R in results] == [True, True, False, True]
+
+    with pytest.raises(CommandError, match="no such osd"):
+        r.run_many(Command(["ceph", "osd", "out", f"osd.{i}"], check=True) for i in range(4))
+    assert len(executor.calls) == 8
+
+
+def test_use_swaps_the_shared_runner():
+    executor = FakeExecutor()
+    with runner.use(Runner(executor)):
+        assert runner.run(["ceph", "osd", "stat"]).ok
+    assert executor.calls == [["ceph", "osd", "stat"]]
+    assert runner.get_runner().executor is not executor
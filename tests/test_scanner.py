@@ -0,0 +1,106 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import scanner
+import smart
+import storage
+from osd_index import OsdIndex
+
+FAKE_SMARTCTL = """#!/bin/sh
+# stand-in for smartctl -a -j <device>, logs every device it is run on
+echo "$3" >> {LOG}
+case "$3" in
+    /dev/sdb) echo '{FAILING}'; exit 8 ;;
+    *) echo '{PASSING}' | sed "s/SERIAL/$(basename $3)/" ;;
+esac
+"""
+
+
+@pytest.fixture
+def smartctl_log(monkeypatch, tmp_path):
+    passing = {"smartctl": {"exit_status": 0}, "serial_number": "SERIAL", "smart_status": {"passed": True}}
+    failing = {"smartctl": {"exit_status": 8}, "serial_number": "FAIL1", "smart_status": {"passed": False}}
+    log = tmp_path / "smartctl.log"
+    script = tmp_path / "smartctl"
+    script.write_text(FAKE_SMARTCTL.replace("{LOG}", str(log)).replace("{PASSING}", json.dumps(passing)).replace("{FAILING}", json.dumps(failing)))
+    script.chmod(0o755)
+    monkeypatch.setattr(smart, "SMARTCTL", str(script))
+    return log
+
+
+def _snapshot():
+    osds = {n: SimpleNamespace(osd_id=n, hostname="n1", dev_name=f"/dev/sd{'abcd'[n]}") for n in range(4)}
+    osds[9] = SimpleNamespace(osd_id=9, hostname="n2", dev_name="/dev/sda")
+    return SimpleNamespace(hostname="n1", local_index=OsdIndex(osds))
+
+
+def _open_case(hostname, block_dev, osd_id, snapshot):
+    #What DlcCase.save() ends up writing, without the OSD map lookup: a NEW case keeps no block_dev
+    with storage.db_cursor() as cur:
+        cur.execute(
+            f"INSERT INTO {storage.TABLE_NAME} (hostname, state, block_dev, osd_id, cluster) VALUES (?, 'NEW', NULL, ?, 'c1')",
+            (hostname, osd_id),
+        )
+        return SimpleNamespace(case_id=cur.lastrowid)
+
+
+def _outcomes(results):
+    return {r.device: r.outcome for r in results}
+
+
+def test_scan_opens_cases_and_skips_what_it_can(smartctl_log):
+    _open_case("n1", "sdc", 2, None)
+    snapshot = _snapshot()
+
+    results = scanner.scan(snapshot, open_case=_open_case)
+    assert _outcomes(results) == {"sda": scanner.HEALTHY, "sdb": scanner.OPENED, "sdc": scanner.HAS_CASE, "sdd": scanner.HEALTHY}
+    assert sorted(smartctl_log.read_text().split()) == ["/dev/sda", "/dev/sdb", "/dev/sdd"]
+    assert [r.message for r in results if r.device == "sdb"] == ["SMART overall health check failed"]
+
+    #Right after: nothing is due, smartctl doesn't run at all
+    smartctl_log.unlink()
+    results = scanner.scan(snapshot, open_case=_open_case)
+    assert _outcomes(results) == {"sda": scanner.FRESH, "sdb": scanner.HAS_CASE, "sdc": scanner.HAS_CASE, "sdd": scanner.FRESH}
+    assert not smartctl_log.exists()
+
+    #Once the samples are old, the drives are checked again and found unchanged
+    with storage.db_cursor() as cur:
+        cur.execute(f"UPDATE {storage.SMART_TABLE} SET collected_at = collected_at - 7200")
+    results = scanner.scan(snapshot, open_case=_open_case)
+    assert _outcomes(results)["sda"] == scanner.UNCHANGED
+    assert sorted(smartctl_log.read_text().split()) == ["/dev/sda", "/dev/sdd"]
+
+
+def test_dry_run_and_duplicates(smartctl_log):
+    snapshot = _snapshot()
+    results = scanner.scan(snapshot, open_cases=False)
+    assert _outcomes(results)["sdb"] == scanner.FAILING
+
+    def conflicting(hostname, block_dev, osd_id, snapshot):
+        #Someone opened the case between our check and the insert; the unique index catches it
+        _open_case(hostname, block_dev, osd_id, snapshot)
+        return _open_case(hostname, block_dev, osd_id, snapshot)
+
+    with storage.db_cursor() as cur:
+        cur.execute(f"DELETE FROM {storage.SMART_TABLE}")
+    results = scanner.scan(snapshot, open_case=conflicting)
+    assert _outcomes(results)["sdb"] == scanner.EXISTS
+    #The savepoint undid both inserts
+    with storage.db_cursor() as cur:
+        assert cur.execute(f"SELECT COUNT(*) FROM {storage.TABLE_NAME}").fetchone()[0] == 0
+
+
+def test_a_case_opened_by_dlc_keeps_its_drive_out_of_the_next_scan(cluster, monkeypatch):
+    from snapshot import ClusterSnapshot
+
+    monkeypatch.setenv("FAKE_SMARTCTL_FAIL", "/dev/sdb")
+    results = scanner.scan(ClusterSnapshot.load())
+    assert _outcomes(results) == {"sda": scanner.HEALTHY, "sdb": scanner.OPENED, "sdc": scanner.HEALTHY, "sdd": scanner.HEALTHY}
+
+    #Every sample is due again, but the drive with a case isn't checked again
+    results = scanner.scan(ClusterSnapshot.load(), max_age=0)
+    assert _outcomes(results)["sdb"] == scanner.HAS_CASE
+    with storage.db_cursor() as cur:
+        assert cur.execute(f"SELECT COUNT(*) FROM {storage.SMART_TABLE} WHERE device = '/dev/sdb'").fetchone()[0] == 1
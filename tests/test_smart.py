@@ -0,0 +1,61 @@
+import json
+import time
+
+import pytest
+
+import metrics
+import runner
+import smart
+import storage
+
+FAKE_SMARTCTL = """#!/bin/sh
+# stand-in for smartctl -a -j <device>
+case "$3" in
+    /dev/hung) exec sleep 30 ;;
+    /dev/failing) echo '{FAILING}'; exit 8 ;;
+    *) echo '{PASSING}' ;;
+esac
+"""
+
+
+@pytest.fixture
+def fake_smartctl(monkeypatch, tmp_path):
+    passing = {"smartctl": {"exit_status": 0}, "serial_number": "S1", "smart_status": {"passed": True}}
+    failing = {"smartctl": {"exit_status": 8}, "serial_number": "S2", "smart_status": {"passed": False}}
+    script = tmp_path / "smartctl"
+    script.write_text(FAKE_SMARTCTL.replace("{PASSING}", json.dumps(passing)).replace("{FAILING}", json.dumps(failing)))
+    script.chmod(0o755)
+    monkeypatch.setattr(smart, "SMARTCTL", str(script))
+    monkeypatch.setattr(runner, "KILL_GRACE", 1)
+
+
+def test_collect_runs_in_parallel_and_times_out(fake_smartctl):
+    start = time.monotonic()
+    results = smart.collect(["sda", "/dev/failing", "hung"], timeout=1)
+    assert time.monotonic() - start < 10
+
+    assert results["/dev/sda"].passed is True
+    assert results["/dev/sda"].serial == "S1"
+    assert results["/dev/failing"].exit_status & smart.DISK_FAILING
+    assert results["/dev/failing"].passed is False
+    assert "timed out" in results["/dev/hung"].error
+
+
+def test_each_smartctl_call_is_timed_once(fake_smartctl):
+    metrics.reset()
+    smart.run_smartctl("sda")
+    #As the runner's subprocess span, not again in a span of its own
+    spans = [(json.loads(key), s["count"]) for key, s in metrics.snapshot()["spans"].items()]
+    assert spans == [(["subprocess", [["step", "smartctl"]]], 1)]
+
+
+def test_latest_reuses_fresh_results_only(fake_smartctl):
+    smart.collect(["sda", "hung"], timeout=1)
+
+    assert smart.latest("sda").serial == "S1"
+    #failed collections are never reused
+    assert smart.latest("hung") is None
+
+    with storage.db_cursor() as cur:
+        cur.execute(f"UPDATE {storage.SMART_TABLE} SET collected_at = collected_at - 7200")
+    assert smart.latest("sda", max_age=3600) is None
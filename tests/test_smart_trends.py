@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+import smart
+import smart_trends
+import storage
+
+DAY = 86400
+
+
+def _ata(serial, pending, hours):
+    return {
+        "serial_number": serial,
+        "model_name": "HDD 8TB",
+        "smart_status": {"passed": True},
+        "power_on_time": {"hours": hours},
+        "temperature": {"current": 35},
+        "ata_smart_attributes": {"table": [
+            {"id": 5, "name": "Reallocated_Sector_Ct", "raw": {"value": 0}},
+            {"id": 9, "name": "Power_On_Hours", "raw": {"value": hours}},
+            {"id": 197, "name": "Current_Pending_Sector", "raw": {"value": pending}},
+        ]},
+    }
+
+
+def test_extract_ata_and_nvme():
+    assert smart_trends.extract(_ata("S1", 8, 100)) == {
+        "reallocated_sectors": 0, "pending_sectors": 8, "power_on_hours": 100, "temperature": 35,
+    }
+    nvme = {"nvme_smart_health_information_log": {"media_errors": 2, "percentage_used": 7, "power_on_hours": 900}}
+    assert smart_trends.extract(nvme) == {"media_errors": 2, "percentage_used": 7, "power_on_hours": 900}
+
+
+def test_stored_results_feed_the_series_and_degrading():
+    now = time.time()
+    smart.store([
+        smart.SmartResult("/dev/sda", now - 10 * DAY, 0, _ata("S1", 0, 100), hostname="n1"),
+        smart.SmartResult("/dev/sda", now - 1 * DAY, 0, _ata("S1", 16, 316), hostname="n1"),
+        smart.SmartResult("/dev/sdb", now - 1 * DAY, 0, _ata("S2", 3, 50), hostname="n1"),
+        smart.SmartResult("/dev/sdc", now, None, None, error="timed out", hostname="n1"),
+    ])
+
+    assert smart_trends.degrading("S1", now=now) == ["pending_sectors went from 0 to 16 in the last 30 days"]
+    #A constant (even non-zero) count isn't a trend
+    assert smart_trends.degrading("S2", now=now) == []
+    #Outside the window the old sample doesn't count
+    assert smart_trends.degrading("S1", window=5 * DAY, now=now) == []
+
+
+def test_growth_rates_across_the_fleet():
+    pytest.importorskip("numpy")
+    start = 1.7e9
+    drives, samples = 200, 500
+    rows = []
+    for d in range(drives):
+        for i in range(samples):
+            #Drive d gains d pending sectors per day
+            rows.append((smart_trends.ATTRIBUTES["pending_sectors"], f"S{d:04d}", start + i * DAY / 4, d * i // 4))
+    with storage.db_transaction() as cur:
+        cur.executemany(f"INSERT INTO {storage.SMART_ATTR_TABLE} VALUES (?, ?, ?, ?)", rows)
+        cur.execute(f"INSERT INTO {storage.SMART_DEVICE_TABLE} VALUES ('S0199', 'n9', 'sdz', NULL, 0, 0)")
+
+    begin = time.monotonic()
+    trends = smart_trends.growth_rates("pending_sectors")
+    assert time.monotonic() - begin < 5
+
+    assert len(trends) == drives
+    assert trends[0].serial == "S0199" and trends[0].per_day == pytest.approx(199, rel=0.01)
+    assert trends[-1].serial == "S0000" and trends[-1].per_day == 0
+    assert trends[0].samples == samples and trends[0].last == 199 * 499 // 4
+
+    only_n9 = smart_trends.growth_rates("pending_sectors", hostnames=["n9"])
+    assert [t.serial for t in only_n9] == ["S0199"]
+    assert smart_trends.growth_rates("media_errors") == []
+
+
+def test_older_samples_move_first_seen_back_but_not_the_location():
+    now = time.time()
+    #Live sample first, then one from before the drive moved to n1 (as backfill() adds them)
+    smart.store([smart.SmartResult("/dev/sda", now, 0, _ata("S1", 0, 100), hostname="n1")])
+    smart.store([smart.SmartResult("/dev/sdq", now - 100 * DAY, 0, _ata("S1", 0, 10), hostname="n0")])
+    assert smart_trends.backfill() == 2
+
+    with storage.db_cursor() as cur:
+        row = cur.execute(f"SELECT * FROM {storage.SMART_DEVICE_TABLE} WHERE serial = 'S1'").fetchone()
+    assert (row["first_seen"], row["last_seen"]) == (now - 100 * DAY, now)
+    assert (row["hostname"], row["device"]) == ("n1", "/dev/sda")
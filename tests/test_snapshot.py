@@ -0,0 +1,77 @@
+import pickle
+
+import pytest
+
+
+@pytest.fixture
+def snapshot(cluster):
+    import snapshot
+    return snapshot
+
+
+def _builds(cluster):
+    return cluster.CALLS.get("osdmap", 0)
+
+
+def _rewrite_cache(snapshot, **changes):
+    with open(snapshot._CACHE_PATH, "rb") as f:
+        data = pickle.load(f)
+    data.update(changes)
+    with open(snapshot._CACHE_PATH, "wb") as f:
+        pickle.dump(data, f)
+
+
+def test_the_osd_map_is_reused_while_the_epoch_holds(cluster, snapshot, monkeypatch):
+    first = snapshot.ClusterSnapshot.load()
+    assert (_builds(cluster), first.epoch) == (1, 1000)
+
+    #Same epoch, within the TTL: read back from ~/.dlc, ceph isn't asked for the map again
+    again = snapshot.ClusterSnapshot.load()
+    assert _builds(cluster) == 1
+    assert again.index.find(osd_id=5) is not None
+
+    #An OSD was added, marked out, moved...: the map is built again and cached under the new epoch
+    monkeypatch.setenv("FAKE_CEPH_EPOCH", "1001")
+    assert snapshot.ClusterSnapshot.load().epoch == 1001
+    assert _builds(cluster) == 2
+    snapshot.ClusterSnapshot.load()
+    assert _builds(cluster) == 2
+
+
+def test_expired_refreshed_or_foreign_caches_are_rebuilt(cluster, snapshot):
+    snapshot.ClusterSnapshot.load()
+
+    _rewrite_cache(snapshot, created=0.0)
+    snapshot.ClusterSnapshot.load()
+    assert _builds(cluster) == 2
+
+    #`--refresh` ignores a cache that would otherwise be used
+    snapshot.ClusterSnapshot.load(refresh=True)
+    assert _builds(cluster) == 3
+
+    #Written by an older dlc
+    _rewrite_cache(snapshot, format=snapshot._CACHE_FORMAT - 1)
+    snapshot.ClusterSnapshot.load()
+    assert _builds(cluster) == 4
+
+    snapshot._CACHE_PATH.write_bytes(b"not a pickle")
+    snapshot.ClusterSnapshot.load()
+    assert _builds(cluster) == 5
+    snapshot.ClusterSnapshot.load()
+    assert _builds(cluster) == 5
+
+
+def test_the_cache_is_replaced_whole_or_not_at_all(cluster, snapshot, monkeypatch):
+    snapshot.ClusterSnapshot.load()
+    before = snapshot._CACHE_PATH.read_bytes()
+    assert list(snapshot._CACHE_PATH.parent.glob("*.tmp")) == []
+
+    def no_space(src, dst):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(snapshot.os, "replace", no_space)
+    monkeypatch.setenv("FAKE_CEPH_EPOCH", "1001")
+    assert snapshot.ClusterSnapshot.load().epoch == 1001
+    #Readers still see the old snapshot in full, and the temp file is gone
+    assert snapshot._CACHE_PATH.read_bytes() == before
+    assert list(snapshot._CACHE_PATH.parent.glob("*.tmp")) == []
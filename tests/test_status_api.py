@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import status_api
+import storage
+
+
+def _write(sql, params=()):
+    #From another thread, so the view's connection sees another connection commit (PRAGMA data_version)
+    def _run():
+        with storage.db_cursor() as cur:
+            cur.execute(sql, params)
+        storage.close_conn()
+    t = threading.Thread(target=_run)
+    t.start()
+    t.join()
+
+
+def _insert(hostname, state, osd_id, updated_at):
+    _write(f"INSERT INTO {storage.TABLE_NAME} (hostname, state, osd_id, cluster, updated_at) VALUES (?, ?, ?, 'c1', ?)",
+            (hostname, state, osd_id, updated_at))
+
+
+def _update(case_id, updated_at, **columns):
+    sets = ", ".join(f"{k} = ?" for k in columns)
+    _write(f"UPDATE {storage.TABLE_NAME} SET {sets}, version = version + 1, updated_at = ? WHERE case_id = ?",
+            (*columns.values(), updated_at, case_id))
+
+
+def test_view_follows_the_database_incrementally():
+    _insert("n1", "NEW", 1, 100.0)
+    _insert("n1", "RECOVERY-WAIT", 2, 100.0)
+    view = status_api.StatusView()
+    assert view.refresh(now=200.0)
+    assert view.state_counts() == {"NEW": 1, "RECOVERY-WAIT": 1}
+
+    #Nothing committed since: no query at all
+    assert not view.refresh(now=201.0)
+
+    _update(1, 210.0, state="NEW-DETAILS")
+    _update(2, 211.0, state="RESOLVED", active=0)
+    _insert("n2", "NEW", 3, 212.0)
+    assert view.refresh(now=220.0)
+    assert sorted(view.cases) == [1, 3]
+    assert view.state_counts() == {"NEW": 1, "NEW-DETAILS": 1}
+    moves = [(t["case_id"], t["from"], t["to"]) for t in view.transitions]
+    assert moves[-3:] == [(1, "NEW", "NEW-DETAILS"), (2, "RECOVERY-WAIT", "RESOLVED"), (3, None, "NEW")]
+
+    #Rows removed behind our back only go away with the next full reload
+    _write(f"DELETE FROM {storage.TABLE_NAME} WHERE case_id = 3")
+    view.refresh(now=221.0)
+    assert 3 in view.cases
+    view.refresh(now=221.0 + status_api.RESYNC)
+    assert sorted(view.cases) == [1]
+
+
+def test_the_view_reads_through_a_read_only_connection(monkeypatch, tmp_path):
+    import sqlite3
+
+    _insert("n1", "NEW", 1, 100.0)
+    view = status_api.StatusView()
+    with storage.read_only():
+        assert view.refresh(now=200.0)
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            with storage.db_cursor() as cur:
+                cur.execute(f"DELETE FROM {storage.TABLE_NAME}")
+    assert list(view.cases) == [1]
+
+    #A database that was never migrated is refused rather than brought up to date
+    old = tmp_path / "old.sqlite"
+    sqlite3.connect(old).close()
+    monkeypatch.setattr(storage, "_DB_PATH", old)
+    with storage.read_only():
+        with pytest.raises(sqlite3.OperationalError, match="schema version 0"):
+            view.refresh(now=300.0)
+    assert old.stat().st_size == 0
+
+
+def test_responses():
+    _insert("n1", "NEW", 1, 100.0)
+    _insert("n2", "NEW", 2, 100.0)
+    view = status_api.StatusView()
+    view.refresh(now=200.0)
+
+    status, _, body = view.respond("GET", "/status")
+    assert status == 200 and json.loads(body)["states"] == {"NEW": 2}
+    assert view.respond("GET", "/status")[2] is body
+    assert [c["osd_id"] for c in json.loads(view.respond("GET", "/cases?hostname=n2")[2])] == [2]
+    assert json.loads(view.respond("GET", "/cases/1")[2])["hostname"] == "n1"
+    assert view.respond("GET", "/cases/9")[0] == 404
+    assert view.respond("POST", "/cases")[0] == 405
+    assert 'dlc_active_cases{state="NEW"} 2' in view.respond("GET", "/metrics")[2].decode()
+
+
+def test_serves_http_over_a_unix_socket(tmp_path):
+    _insert("n1", "NEW", 1, 100.0)
+    path = str(tmp_path / "status.sock")
+
+    async def _scrape():
+        stop = asyncio.Event()
+        server = asyncio.create_task(status_api.serve(socket_path=path, interval=0.05, stop=stop))
+        for _ in range(100):
+            if (tmp_path / "status.sock").exists():
+                break
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b"GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        stop.set()
+        await server
+        return response
+
+    response = asyncio.run(_scrape())
+    head, body = response.split(b"\r\n\r\n", 1)
+    assert head.startswith(b"HTTP/1.0 200")
+    assert json.loads(body)["cases"] == 1
+    assert not (tmp_path / "status.sock").exists()
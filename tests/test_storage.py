@@ -0,0 +1,115 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+
+def _insert(cur, hostname, block_dev, osd_id):
+    cur.execute(
+        f"INSERT INTO {storage.TABLE_NAME} (hostname, state, block_dev, osd_id, cluster) VALUES (?, 'NEW', ?, ?, 'c1')",
+        (hostname, block_dev, osd_id),
+    )
+
+
+def test_connection_is_reused_and_schema_is_current():
+    with storage.db_cursor() as cur:
+        conn = cur.connection
+        assert cur.execute("PRAGMA user_version").fetchone()[0] == storage.SCHEMA_VERSION
+        assert cur.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    with storage.db_cursor() as cur:
+        assert cur.connection is conn
+
+
+def test_existing_unversioned_db_is_upgraded(tmp_path, monkeypatch):
+    path = tmp_path / "old.sqlite"
+    old = sqlite3.connect(path)
+    old.executescript(storage.DDL)
+    old.execute(f"INSERT INTO {storage.TABLE_NAME} (hostname, state) VALUES ('n1', 'NEW')")
+    old.commit()
+    old.close()
+
+    monkeypatch.setattr(storage, "_DB_PATH", path)
+    with storage.db_cursor() as cur:
+        assert cur.execute("PRAGMA user_version").fetchone()[0] == storage.SCHEMA_VERSION
+        assert cur.execute(f"SELECT COUNT(*) FROM {storage.TABLE_NAME}").fetchone()[0] == 1
+
+
+def test_transaction_rolls_back_and_savepoint_keeps_outer_work():
+    with pytest.raises(RuntimeError):
+        with storage.db_transaction() as cur:
+            _insert(cur, "n1", "sda", 1)
+            raise RuntimeError
+
+    with storage.db_transaction() as cur:
+        _insert(cur, "n1", "sda", 1)
+        with pytest.raises(sqlite3.IntegrityError):
+            with storage.db_transaction() as inner:
+                _insert(inner, "n1", "sda", 2)
+        _insert(cur, "n1", "sdb", 3)
+
+    with storage.db_cursor() as cur:
+        rows = cur.execute(f"SELECT osd_id FROM {storage.TABLE_NAME} ORDER BY osd_id").fetchall()
+    assert [r["osd_id"] for r in rows] == [1, 3]
+
+
+def _save_as(case_id, state):
+    #The real compare-and-swap: load the current version, change it, save it as the next one
+    from models import DlcCase
+    case = DlcCase.load(case_id)
+    case.state = state
+    return case.save(new_version=True, force_save=True)
+
+
+def test_concurrent_writers_never_lose_an_update(cluster):
+    from models import ConcurrentUpdateError, State
+
+    with storage.db_transaction() as cur:
+        _insert(cur, "n1", "sda", 1)
+
+    workers, rounds = 8, 10
+    states = [State.NEW_DETAIL, State.RECOVERY_WAIT, State.OPERATOR_NEEDED]
+    conflicts = []
+
+    def worker(n):
+        for i in range(rounds):
+            while True:
+                try:
+                    _save_as(1, states[(n + i) % len(states)])
+                    break
+                except ConcurrentUpdateError:
+                    conflicts.append(n)
+        storage.close_conn()
+
+    import threading
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with storage.db_cursor() as cur:
+        assert cur.execute(f"SELECT version FROM {storage.TABLE_NAME} WHERE case_id = 1").fetchone()[0] == workers * rounds + 1
+        history = [r[0] for r in cur.execute(f"SELECT version FROM {storage.HISTORY_TABLE} WHERE case_id = 1 ORDER BY version")]
+    #Every save left exactly one history row, for the version it replaced
+    assert history == list(range(1, workers * rounds + 1))
+
+
+def test_stale_version_writes_nothing(cluster):
+    from models import ConcurrentUpdateError, DlcCase, State
+
+    with storage.db_transaction() as cur:
+        _insert(cur, "n1", "sda", 1)
+    stale = DlcCase.load(1)
+    saved = _save_as(1, State.RECOVERY_WAIT)
+    assert (saved.version, stale.version) == (2, 1)
+
+    stale.state = State.OPERATOR_NEEDED
+    with pytest.raises(ConcurrentUpdateError):
+        stale.save(new_version=True, force_save=True)
+    assert stale.version == 1
+
+    with storage.db_cursor() as cur:
+        row = cur.execute(f"SELECT state, version FROM {storage.TABLE_NAME} WHERE case_id = 1").fetchone()
+        assert (row["state"], row["version"]) == ("RECOVERY-WAIT", 2)
+        assert cur.execute(f"SELECT COUNT(*) FROM {storage.HISTORY_TABLE}").fetchone()[0] == 1
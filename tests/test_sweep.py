@@ -0,0 +1,69 @@
+import pytest
+
+import records
+import storage
+
+
+@pytest.fixture
+def new_case(cluster):
+    from models import DlcCase, State
+
+    def new_case(osd_id, **kwargs):
+        return DlcCase(osd_id=osd_id, state=State.NEW, **kwargs).save()
+
+    return new_case
+
+
+def _states(case_id):
+    return [r.state for r in records.iter_history(case_id)]
+
+
+def test_cases_move_one_state_per_sweep_against_one_snapshot(cluster, new_case):
+    from sweep import sweep, UNCHANGED
+
+    first, second = new_case(0), new_case(1)
+    for _ in range(4):
+        results = sweep()
+        assert [r.case_id for r in results] == [first.case_id, second.case_id]
+    assert [r.outcome for r in results] == [UNCHANGED, UNCHANGED]
+
+    #The OSD map was built once, the other sweeps read the cached snapshot.
+    #The drain is reserved in NEW_DETAIL and the case only recovers once its OSD is out.
+    assert _states(first.case_id) == ["NEW", "NEW-DETAILS", "NEW-DETAILS", "RECOVERY-WAIT", "RECOVERY-DONE", "OSD-REMOVED"]
+    assert records.load_record(second.case_id).state == "OSD-REMOVED"
+    assert cluster.CALLS["osdmap"] == 1
+
+
+def test_waiting_and_failing_cases_do_not_stop_the_sweep(cluster, new_case):
+    from models import DlcCase, State
+    from sweep import sweep, FAILED, PROGRESSED, WAITING
+
+    waiting = new_case(0)
+    sweep()
+    sweep()
+    assert records.load_record(waiting.case_id).state == "RECOVERY-WAIT"
+
+    #An OSD that left the map since the case was opened
+    gone = DlcCase(osd_id=99, hostname="host000", state=State.NEW_DETAIL).save(force_save=True)
+    cluster.CONFIG["clean"] = False
+    results = {r.case_id: r for r in sweep()}
+    assert results[waiting.case_id].outcome == WAITING
+    assert results[gone.case_id].outcome == FAILED
+    assert "No valid OSD" in results[gone.case_id].message
+
+    cluster.CONFIG["clean"] = True
+    results = {r.case_id: r for r in sweep(case_ids=[waiting.case_id])}
+    assert list(results) == [waiting.case_id]
+    assert results[waiting.case_id].outcome == PROGRESSED
+    assert records.load_record(gone.case_id).state == "NEW-DETAILS"
+
+
+def test_only_this_hosts_cases_are_swept(cluster, new_case):
+    from sweep import sweep
+
+    #osd.5 is on host001
+    remote = new_case(5)
+    assert remote.hostname == "host001"
+    assert sweep() == []
+    with storage.db_cursor() as cur:
+        assert cur.execute(f"SELECT state FROM {storage.TABLE_NAME} WHERE case_id = ?", (remote.case_id,)).fetchone()[0] == "NEW"